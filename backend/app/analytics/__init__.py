@@ -1,5 +1,13 @@
 # analytics/__init__.py
-from .patient_analysis import get_patient_statistics, get_duckdb_conn
-
-__all__ = ["get_patient_statistics", "get_duckdb_conn"]
+from ..db_duck import get_duckdb_conn
+from .patient_analysis import get_patient_statistics, refresh_patient_stats
+from .snapshot import refresh_snapshot, ensure_snapshot, get_snapshot_status
 
+__all__ = [
+    "get_patient_statistics",
+    "get_duckdb_conn",
+    "refresh_patient_stats",
+    "refresh_snapshot",
+    "ensure_snapshot",
+    "get_snapshot_status",
+]
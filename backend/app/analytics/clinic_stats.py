@@ -0,0 +1,62 @@
+# analytics/clinic_stats.py
+from .snapshot import ensure_snapshot, read_snapshot_manifest
+
+# 時間粒度 -> 期間起日（日、月初、年初）
+ENCOUNTER_STATS_GRANULARITIES = {
+    "day": "s.visit_date",
+    "month": "CAST(date_trunc('month', s.visit_date) AS DATE)",
+    "year": "CAST(date_trunc('year', s.visit_date) AS DATE)",
+}
+
+# 分組方式 -> (額外輸出欄位, JOIN, GROUP BY, ORDER BY)
+ENCOUNTER_STATS_GROUPS = {
+    "none": ("", "", "", ""),
+    "department": (
+        ", s.dept_id, d.name AS department_name",
+        "LEFT JOIN snap.department d ON s.dept_id = d.dept_id",
+        ", s.dept_id, d.name",
+        ", s.dept_id",
+    ),
+    "provider": (
+        ", s.provider_id, pr.name AS provider_name, s.dept_id",
+        "LEFT JOIN snap.provider pr ON s.provider_id = pr.user_id",
+        ", s.provider_id, pr.name, s.dept_id",
+        ", provider_name, s.provider_id",
+    ),
+}
+
+
+def _month_key(value):
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def encounter_stats_query(date_from, date_to, granularity="day", group_by="none"):
+    """
+    全院看診次數統計的 DuckDB 查詢，回傳 (sql, params)：
+    - 讀取分析快照的每日彙總 snap.encounter_daily（每日 × 醫師一列），月、年統計由日彙總再加總，
+      資料量與 ENCOUNTER 筆數無關
+    - 日期區間 [date_from, date_to]（含兩端）同時以 month 與 visit_date 篩選，
+      區間外的月份檔依 Parquet 統計資訊直接略過，不讀取
+    - group_by：none、department（科別）、provider（醫師）
+    """
+    ensure_snapshot()
+    period = ENCOUNTER_STATS_GRANULARITIES[granularity]
+    columns, join, group, order = ENCOUNTER_STATS_GROUPS[group_by]
+    sql = f"""
+        SELECT
+            {period} AS period{columns},
+            CAST(SUM(s.encounter_count) AS BIGINT) AS encounter_count
+        FROM snap.encounter_daily s
+        {join}
+        WHERE s.month BETWEEN ? AND ?
+          AND s.visit_date BETWEEN ? AND ?
+        GROUP BY {period}{group}
+        ORDER BY period{order};
+    """
+    return sql, [_month_key(date_from), _month_key(date_to), date_from, date_to]
+
+
+def encounter_stats_as_of():
+    """統計資料的時間（分析快照建立時間）"""
+    manifest = read_snapshot_manifest()
+    return manifest["built_at"] if manifest else None
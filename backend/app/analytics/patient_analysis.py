@@ -1,23 +1,137 @@
 # analytics/patient_analysis.py
-import duckdb
-from ..config import PG_URI
+from ..db_duck import duck_engine
+from ..repositories import PatientRepository, PatientStatsRepository
+from .snapshot import ensure_snapshot, read_snapshot_manifest
 
-DUCKDB_FILE = "clinic_analytics.duckdb"
+# 統計資料回傳的常見診斷筆數（cube 內保存所有診斷的次數）
+TOP_DIAGNOSES_LIMIT = 10
 
+# 從分析快照計算病人統計 cube 的一列：{condition} 選出要重算的病人（作用在 snap.encounter e）
+_PATIENT_STATS_SQL = """
+    WITH affected AS (
+        SELECT DISTINCT e.patient_id
+        FROM snap.encounter e
+        WHERE {condition}
+    ),
+    enc AS (
+        SELECT e.enct_id, e.patient_id, e.provider_id, e.encounter_at
+        FROM snap.encounter e
+        WHERE e.patient_id IN (SELECT patient_id FROM affected)
+    ),
+    -- 1. 年度就診次數
+    yearly AS (
+        SELECT
+            patient_id,
+            CAST(EXTRACT(YEAR FROM encounter_at) AS INTEGER) AS year,
+            COUNT(*) AS visit_count
+        FROM enc
+        GROUP BY patient_id, year
+    ),
+    yearly_agg AS (
+        SELECT
+            patient_id,
+            SUM(visit_count) AS total_visits,
+            to_json(list({{'year': year, 'visit_count': visit_count}} ORDER BY year DESC)) AS annual_visits
+        FROM yearly
+        GROUP BY patient_id
+    ),
+    -- 2. 各科別就診分布
+    dept_agg AS (
+        SELECT
+            patient_id,
+            to_json(list(
+                {{'dept_id': dept_id, 'department_name': department_name, 'visit_count': visit_count}}
+                ORDER BY visit_count DESC, dept_id
+            )) AS department_distribution
+        FROM (
+            SELECT enc.patient_id, d.dept_id, d.name AS department_name, COUNT(*) AS visit_count
+            FROM enc
+            JOIN snap.provider pr ON enc.provider_id = pr.user_id
+            JOIN snap.department d ON pr.dept_id = d.dept_id
+            GROUP BY enc.patient_id, d.dept_id, d.name
+        )
+        GROUP BY patient_id
+    ),
+    -- 3. 診斷次數（全部保存，讀取時取前幾名）
+    dx_agg AS (
+        SELECT
+            patient_id,
+            to_json(list(
+                {{'code_icd': code_icd, 'diagnosis_description': diagnosis_description, 'diagnosis_count': diagnosis_count}}
+                ORDER BY diagnosis_count DESC, code_icd
+            )) AS diagnosis_frequency
+        FROM (
+            SELECT enc.patient_id, dx.code_icd, dis.description AS diagnosis_description, COUNT(*) AS diagnosis_count
+            FROM snap.diagnosis dx
+            JOIN enc ON dx.enct_id = enc.enct_id
+            JOIN snap.disease dis ON dx.code_icd = dis.code_icd
+            GROUP BY enc.patient_id, dx.code_icd, dis.description
+        )
+        GROUP BY patient_id
+    )
+    SELECT
+        y.patient_id,
+        CAST(y.total_visits AS INTEGER),
+        CAST(y.annual_visits AS VARCHAR),
+        COALESCE(CAST(d.department_distribution AS VARCHAR), '[]'),
+        COALESCE(CAST(x.diagnosis_frequency AS VARCHAR), '[]')
+    FROM yearly_agg y
+    LEFT JOIN dept_agg d ON d.patient_id = y.patient_id
+    LEFT JOIN dx_agg x ON x.patient_id = y.patient_id
+    ORDER BY y.patient_id;
+"""
 
-def get_duckdb_conn():
+
+def compute_patient_stats(condition="TRUE", params=None):
+    """
+    從分析快照計算病人統計 cube 的列（不查詢 PostgreSQL）：
+    condition 為作用在 snap.encounter e 的條件，選出要重算的病人。
+    回傳 (patient_id, total_visits, annual_visits, department_distribution, diagnosis_frequency)，後三者為 JSON 字串。
+    """
+    ensure_snapshot()
+    return duck_engine.fetch_rows(_PATIENT_STATS_SQL.format(condition=condition), params)
+
+
+def refresh_patient_stats(snapshot_summary):
+    """
+    分析快照更新後重算病人統計 cube（snapshot_summary 為 refresh_snapshot 的回傳值）：
+    - 就診月份有重抓：只重算這些月份有就診的病人
+    - 完整重建：重算所有病人，並刪除已沒有任何就診的病人
+    回傳 {"patients": 重算人數, "deleted": 刪除筆數}。
+    """
+    built_at = snapshot_summary["built_at"]
+    months = snapshot_summary["refreshed"].get("encounter")
+    if months is None:
+        return {"patients": 0, "deleted": 0}
+
+    if months == "all":
+        rows = compute_patient_stats()
+    else:
+        rows = compute_patient_stats("list_contains(?, e.month)", [months])
+    written = PatientStatsRepository.upsert_patient_stats(rows, built_at)
+    deleted = PatientStatsRepository.delete_stale_patient_stats(built_at) if months == "all" else 0
+    return {"patients": written, "deleted": deleted}
+
+
+def _refresh_one_patient(patient_id: int):
     """
-    初始化 DuckDB 連接並設置 PostgreSQL 掃描器。
-    - 啟用 postgres_scanner extension
-    - 將 PostgreSQL 主庫附掛為 pgdb source（唯讀，僅用於查詢）
+    cube 裡還沒有這位病人（新病人、尚未跑過排程）：從快照算出一列並寫入。
+    病人不存在時回傳 None；快照中沒有任何就診時回傳空的統計但不寫入
+    （cube 只保存有就診的病人，任意 patient_id 不會在表中留下資料）。
     """
-    con = duckdb.connect(DUCKDB_FILE)
-    # 啟用 postgres_scanner extension
-    con.execute("INSTALL postgres_scanner")
-    con.execute("LOAD postgres_scanner")
-    # 把 PostgreSQL 附掛成 pgdb（用於唯讀查詢）
-    con.execute(f"ATTACH '{PG_URI}' AS pgdb (TYPE POSTGRES)")
-    return con
+    if not PatientRepository.patient_exists(patient_id):
+        return None
+    rows = compute_patient_stats("e.patient_id = ?", [patient_id])
+    if not rows:
+        return {
+            "total_visits": 0,
+            "annual_visits": [],
+            "department_distribution": [],
+            "diagnosis_frequency": [],
+            "snapshot_built_at": read_snapshot_manifest()["built_at"],
+        }
+    PatientStatsRepository.upsert_patient_stats(rows, read_snapshot_manifest()["built_at"])
+    return PatientStatsRepository.get_patient_stats(patient_id)
 
 
 def get_patient_statistics(patient_id: int):
@@ -26,71 +140,25 @@ def get_patient_statistics(patient_id: int):
     - 年度就診次數
     - 各科別就診分布
     - 常見診斷 top 10
-    
+    只讀取病人統計 cube（PATIENT_STATS）的一列；資料截至 as_of（分析快照時間）。
+
     Args:
         patient_id: 病人 ID
-    
+
     Returns:
-        dict: 包含統計資料的字典
+        dict: 包含統計資料的字典；病人不存在時回傳 None
     """
-    con = get_duckdb_conn()
-    
-    try:
-        # 1. 年度就診次數
-        annual_visits_query = """
-            SELECT
-                EXTRACT(YEAR FROM e.encounter_at) AS year,
-                COUNT(*) AS visit_count
-            FROM pgdb.public.ENCOUNTER e
-            JOIN pgdb.public.APPOINTMENT a ON e.appt_id = a.appt_id
-            WHERE a.patient_id = ?
-            GROUP BY EXTRACT(YEAR FROM e.encounter_at)
-            ORDER BY year DESC;
-        """
-        annual_visits_df = con.execute(annual_visits_query, [patient_id]).df()
-        annual_visits = annual_visits_df.to_dict('records') if not annual_visits_df.empty else []
-        
-        # 2. 各科別就診分布
-        department_distribution_query = """
-            SELECT
-                d.dept_id,
-                d.name AS department_name,
-                COUNT(*) AS visit_count
-            FROM pgdb.public.ENCOUNTER e
-            JOIN pgdb.public.APPOINTMENT a ON e.appt_id = a.appt_id
-            JOIN pgdb.public.PROVIDER pr ON e.provider_id = pr.user_id
-            JOIN pgdb.public.DEPARTMENT d ON pr.dept_id = d.dept_id
-            WHERE a.patient_id = ?
-            GROUP BY d.dept_id, d.name
-            ORDER BY visit_count DESC;
-        """
-        department_distribution_df = con.execute(department_distribution_query, [patient_id]).df()
-        department_distribution = department_distribution_df.to_dict('records') if not department_distribution_df.empty else []
-        
-        # 3. 常見診斷 top 10
-        top_diagnoses_query = """
-            SELECT
-                d.code_icd,
-                dis.description AS diagnosis_description,
-                COUNT(*) AS diagnosis_count
-            FROM pgdb.public.DIAGNOSIS d
-            JOIN pgdb.public.ENCOUNTER e ON d.enct_id = e.enct_id
-            JOIN pgdb.public.APPOINTMENT a ON e.appt_id = a.appt_id
-            JOIN pgdb.public.DISEASE dis ON d.code_icd = dis.code_icd
-            WHERE a.patient_id = ?
-            GROUP BY d.code_icd, dis.description
-            ORDER BY diagnosis_count DESC
-            LIMIT 10;
-        """
-        top_diagnoses_df = con.execute(top_diagnoses_query, [patient_id]).df()
-        top_diagnoses = top_diagnoses_df.to_dict('records') if not top_diagnoses_df.empty else []
-        
-        return {
-            "patient_id": patient_id,
-            "annual_visits": annual_visits,
-            "department_distribution": department_distribution,
-            "top_diagnoses": top_diagnoses,
-        }
-    finally:
-        con.close()
+    row = PatientStatsRepository.get_patient_stats(patient_id)
+    if row is None:
+        row = _refresh_one_patient(patient_id)
+        if row is None:
+            return None
 
+    return {
+        "patient_id": patient_id,
+        "total_visits": row["total_visits"],
+        "annual_visits": row["annual_visits"],
+        "department_distribution": row["department_distribution"],
+        "top_diagnoses": row["diagnosis_frequency"][:TOP_DIAGNOSES_LIMIT],
+        "as_of": row["snapshot_built_at"],
+    }
@@ -0,0 +1,517 @@
+# analytics/snapshot.py
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from ..config import (
+    ANALYTICS_SNAPSHOT_DIR,
+    ANALYTICS_SNAPSHOT_FULL_REBUILD_HOURS,
+    ANALYTICS_SNAPSHOT_OVERLAP_SECONDS,
+)
+from ..db_duck import duck_engine
+from ..pg_base import pg_conn
+from ..repositories import DiagnosisRepository
+
+# 分析查詢透過 snap.<表名> 讀取快照（DuckDB view，指向 Parquet 檔）
+SNAPSHOT_SCHEMA = "snap"
+
+_MANIFEST_FILE = "manifest.json"
+# 分區表沒有任何資料時保留一個 0 筆的檔案，讓 view 的檔案清單不為空並帶出欄位型別
+_EMPTY_FILE = "_empty.parquet"
+_MONTH_FILE = re.compile(r"^(\d{4}-\d{2})\.parquet$")
+
+# 快照資料表：名稱 -> (分區欄位, 檔案內排序, PostgreSQL 查詢)
+# - 分區欄位不為 None：依該欄位的月份分檔（<表名>/<YYYY-MM>.parquet），查詢需輸出 month 欄位，
+#   {where} 由 ETL 換成要重抓的月份條件。就診相關的表都依就診月份分區，同一次就診的資料落在同一個月份檔
+# - 分區欄位為 None：維度表，整表重抓（<表名>/all.parquet）
+# 就診只保留分析用欄位（不含主訴與 SOAP 病歷文字），並帶出掛號的 patient_id，分析時不必再 JOIN 掛號
+SNAPSHOT_TABLES = {
+    "encounter": (
+        "e.encounter_at",
+        "patient_id, encounter_at",
+        """
+        SELECT
+            e.enct_id,
+            e.appt_id,
+            a.patient_id,
+            e.provider_id,
+            e.encounter_at,
+            e.status,
+            to_char(e.encounter_at, 'YYYY-MM') AS month
+        FROM ENCOUNTER e
+        JOIN APPOINTMENT a ON e.appt_id = a.appt_id
+        WHERE {where}
+        """,
+    ),
+    "diagnosis": (
+        "e.encounter_at",
+        "enct_id, code_icd",
+        """
+        SELECT
+            dx.enct_id,
+            dx.code_icd,
+            dx.is_primary,
+            to_char(e.encounter_at, 'YYYY-MM') AS month
+        FROM DIAGNOSIS dx
+        JOIN ENCOUNTER e ON dx.enct_id = e.enct_id
+        WHERE {where}
+        """,
+    ),
+    "prescription": (
+        "e.encounter_at",
+        "enct_id, rx_id",
+        """
+        SELECT
+            rx.rx_id,
+            rx.enct_id,
+            to_char(e.encounter_at, 'YYYY-MM') AS month
+        FROM PRESCRIPTION rx
+        JOIN ENCOUNTER e ON rx.enct_id = e.enct_id
+        WHERE {where}
+        """,
+    ),
+    "include": (
+        "e.encounter_at",
+        "rx_id, med_id",
+        """
+        SELECT
+            inc.rx_id,
+            inc.med_id,
+            inc.dosage,
+            inc.frequency,
+            inc.days,
+            inc.quantity,
+            to_char(e.encounter_at, 'YYYY-MM') AS month
+        FROM INCLUDE inc
+        JOIN PRESCRIPTION rx ON inc.rx_id = rx.rx_id
+        JOIN ENCOUNTER e ON rx.enct_id = e.enct_id
+        WHERE {where}
+        """,
+    ),
+    "lab_result": (
+        "e.encounter_at",
+        "enct_id, lab_id",
+        """
+        SELECT
+            lab.lab_id,
+            lab.enct_id,
+            lab.loinc_code,
+            lab.item_name,
+            lab.value,
+            lab.unit,
+            lab.ref_low,
+            lab.ref_high,
+            lab.abnormal_flag,
+            lab.reported_at,
+            to_char(e.encounter_at, 'YYYY-MM') AS month
+        FROM LAB_RESULT lab
+        JOIN ENCOUNTER e ON lab.enct_id = e.enct_id
+        WHERE {where}
+        """,
+    ),
+    "payment": (
+        "e.encounter_at",
+        "enct_id, payment_id",
+        """
+        SELECT
+            pay.payment_id,
+            pay.enct_id,
+            pay.amount,
+            pay.method,
+            pay.invoice_no,
+            pay.paid_at,
+            to_char(e.encounter_at, 'YYYY-MM') AS month
+        FROM PAYMENT pay
+        JOIN ENCOUNTER e ON pay.enct_id = e.enct_id
+        WHERE {where}
+        """,
+    ),
+    # 掛號依門診日期的月份分區，並帶出門診的醫師、日期與時段
+    "appointment": (
+        "cs.date",
+        "patient_id, appt_id",
+        """
+        SELECT
+            a.appt_id,
+            a.patient_id,
+            a.session_id,
+            a.slot_seq,
+            a.current_status,
+            cs.provider_id,
+            cs.date AS session_date,
+            cs.period,
+            to_char(cs.date, 'YYYY-MM') AS month
+        FROM APPOINTMENT a
+        JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+        WHERE {where}
+        """,
+    ),
+    "provider": (
+        None,
+        "user_id",
+        """
+        SELECT pr.user_id, pr.dept_id, u.name, pr.active
+        FROM PROVIDER pr
+        JOIN "USER" u ON pr.user_id = u.user_id
+        """,
+    ),
+    "department": (
+        None,
+        "dept_id",
+        """
+        SELECT d.dept_id, d.name, d.category_id, dc.name AS category_name
+        FROM DEPARTMENT d
+        LEFT JOIN DEPARTMENT_CATEGORY dc ON d.category_id = dc.category_id
+        """,
+    ),
+    # DISEASE（ICD 目錄）筆數多且幾乎不變：內容簽章沒變就不重抓
+    "disease": (
+        None,
+        "code_icd",
+        """
+        SELECT code_icd, NULLIF(TRIM({desc_field}), '') AS description
+        FROM DISEASE
+        """,
+    ),
+}
+
+# 由快照再彙總的資料表（DuckDB 讀本機 Parquet 計算，不查詢 PostgreSQL）：名稱 -> (檔案內排序, DuckDB 查詢)
+# 依就診月份分區，就診月份重抓時一起重算；{where} 為月份條件，{encounter} / {provider} 為快照檔路徑
+SNAPSHOT_AGGREGATES = {
+    # 每日各醫師看診次數，科別為計算當時醫師所屬科別（醫師換科後，舊月份在下次完整重建時更新）
+    "encounter_daily": (
+        "visit_date, provider_id",
+        """
+        SELECT
+            CAST(e.encounter_at AS DATE) AS visit_date,
+            e.provider_id,
+            pr.dept_id,
+            COUNT(*) AS encounter_count,
+            e.month
+        FROM read_parquet({encounter}) e
+        LEFT JOIN read_parquet({provider}) pr ON e.provider_id = pr.user_id
+        WHERE {where}
+        GROUP BY ALL
+        """,
+    ),
+}
+
+# 同一個 worker 內同時只跑一次快照更新
+_build_lock = threading.Lock()
+# 目前的 DuckDB 連線是否已建立 snap.* view
+_views_installed = False
+# ENCOUNTER 是否有 updated_at（migrate_history_sync.sql；緩存結果）
+_has_encounter_updated_at = None
+
+
+def _sql_literal(value):
+    """DuckDB / PostgreSQL 字串常值（單引號加倍）"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _manifest_path():
+    return os.path.join(ANALYTICS_SNAPSHOT_DIR, _MANIFEST_FILE)
+
+
+def _table_pattern(table):
+    return os.path.join(ANALYTICS_SNAPSHOT_DIR, table, "*.parquet")
+
+
+def read_snapshot_manifest():
+    """讀取快照的 manifest（high-water mark、最後建立時間、各表筆數）；尚未建立時回傳 None"""
+    try:
+        with open(_manifest_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_ready():
+    """快照是否已完整建立過一次（manifest 在所有資料表寫好後才產生）"""
+    return os.path.exists(_manifest_path())
+
+
+def _install_views(con):
+    """建立 snap.<表名> view 指向快照的 Parquet 檔；快照尚未建立時不動作"""
+    global _views_installed
+    if not snapshot_ready():
+        _views_installed = False
+        return
+    con.execute(f"CREATE SCHEMA IF NOT EXISTS {SNAPSHOT_SCHEMA}")
+    for table in (*SNAPSHOT_TABLES, *SNAPSHOT_AGGREGATES):
+        con.execute(
+            f"CREATE OR REPLACE VIEW {SNAPSHOT_SCHEMA}.{table} AS "
+            f"SELECT * FROM read_parquet({_sql_literal(_table_pattern(table))})"
+        )
+    _views_installed = True
+
+
+# DuckDB 引擎（重新）連線時一併建立 view
+duck_engine.add_connect_hook(_install_views)
+
+
+def ensure_snapshot():
+    """
+    分析查詢前呼叫：確認 snap.* view 可用。
+    快照目錄還沒有任何快照時（例如剛部署、排程器未啟用）先同步建立一次。
+    """
+    if _views_installed:
+        return
+    with _build_lock:
+        if not snapshot_ready():
+            _refresh(full=True)
+    with duck_engine.cursor() as cur:
+        _install_views(cur)
+
+
+def _encounter_has_updated_at(conn):
+    global _has_encounter_updated_at
+    if _has_encounter_updated_at is None:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM information_schema.columns
+                    WHERE table_name = 'encounter' AND column_name = 'updated_at'
+                );
+                """
+            )
+            _has_encounter_updated_at = cur.fetchone()[0]
+    return _has_encounter_updated_at
+
+
+def _changed_encounter_months(conn, high_water):
+    """就診本身或其診斷、處方、檢驗、繳費在 high-water mark 之後有變更的月份"""
+    with conn.cursor() as cur:
+        if _encounter_has_updated_at(conn):
+            cur.execute(
+                """
+                SELECT DISTINCT to_char(encounter_at, 'YYYY-MM')
+                FROM ENCOUNTER
+                WHERE updated_at > %s::timestamptz;
+                """,
+                (high_water["changed_at"],),
+            )
+        else:
+            # 未執行 migrate_history_sync.sql：只能以 enct_id 找出新就診，另外每次重抓當月
+            # （舊就診後來補上的診斷等資料由定期的完整重建補上）
+            cur.execute(
+                """
+                SELECT DISTINCT to_char(encounter_at, 'YYYY-MM')
+                FROM ENCOUNTER
+                WHERE enct_id > %s
+                UNION
+                SELECT to_char(NOW(), 'YYYY-MM');
+                """,
+                (high_water["enct_id"],),
+            )
+        return {row[0] for row in cur.fetchall()}
+
+
+def _changed_appointment_months(conn, high_water):
+    """有新掛號或掛號狀態變更的門診月份"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT to_char(cs.date, 'YYYY-MM')
+            FROM APPOINTMENT a
+            JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+            WHERE a.status_changed_at > %s::timestamptz
+            UNION
+            SELECT to_char(cs.date, 'YYYY-MM')
+            FROM APPOINTMENT a
+            JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+            WHERE a.appt_id > %s;
+            """,
+            (high_water["changed_at"], high_water["appt_id"]),
+        )
+        return {row[0] for row in cur.fetchall()}
+
+
+def _month_filter(column, months):
+    """只抓指定月份的 WHERE 條件（以範圍比較，可使用欄位上的索引）"""
+    ranges = " OR ".join(
+        f"({column} >= DATE '{month}-01' AND {column} < DATE '{month}-01' + INTERVAL '1 month')"
+        for month in sorted(months)
+    )
+    return f"({ranges})"
+
+
+def _copy_to_parquet(cur, select_sql, path):
+    """寫到暫存檔後 os.replace，查詢端不會讀到寫到一半的檔案"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    cur.execute(f"COPY ({select_sql}) TO {_sql_literal(tmp_path)} (FORMAT PARQUET, COMPRESSION ZSTD)")
+    os.replace(tmp_path, path)
+
+
+def _month_files(table_dir):
+    files = {}
+    for name in os.listdir(table_dir):
+        match = _MONTH_FILE.match(name)
+        if match:
+            files[match.group(1)] = os.path.join(table_dir, name)
+    return files
+
+
+def _publish_table(cur, table, partitioned, order_by, source_sql, months):
+    """
+    把 source_sql（DuckDB 查詢）的結果寫成快照檔，回傳該表目前的總筆數：
+    - months 為 None：整表；分區表另外刪除來源已沒有資料的月份檔
+    - 否則只重寫這些月份，月份內已沒有資料時刪除該月份檔
+    """
+    table_dir = os.path.join(ANALYTICS_SNAPSHOT_DIR, table)
+    os.makedirs(table_dir, exist_ok=True)
+    cur.execute(f"CREATE OR REPLACE TEMP TABLE snapshot_stage AS {source_sql}")
+    try:
+        if not partitioned:
+            _copy_to_parquet(
+                cur,
+                f"SELECT * FROM snapshot_stage ORDER BY {order_by}",
+                os.path.join(table_dir, "all.parquet"),
+            )
+        else:
+            staged = {row[0] for row in cur.execute("SELECT DISTINCT month FROM snapshot_stage").fetchall()}
+            for month in sorted(staged):
+                _copy_to_parquet(
+                    cur,
+                    f"SELECT * FROM snapshot_stage WHERE month = {_sql_literal(month)} ORDER BY {order_by}",
+                    os.path.join(table_dir, f"{month}.parquet"),
+                )
+
+            existing = _month_files(table_dir)
+            candidates = existing.keys() if months is None else months
+            for month in set(candidates) - staged:
+                if month in existing:
+                    os.remove(existing[month])
+
+            empty_path = os.path.join(table_dir, _EMPTY_FILE)
+            if _month_files(table_dir):
+                if os.path.exists(empty_path):
+                    os.remove(empty_path)
+            elif not os.path.exists(empty_path):
+                _copy_to_parquet(cur, "SELECT * FROM snapshot_stage LIMIT 0", empty_path)
+    finally:
+        cur.execute("DROP TABLE IF EXISTS snapshot_stage")
+
+    # 只讀 Parquet metadata，不掃資料
+    return cur.execute(f"SELECT COUNT(*) FROM read_parquet({_sql_literal(_table_pattern(table))})").fetchone()[0]
+
+
+def _needs_full_rebuild(manifest, db_now):
+    if manifest is None or set(manifest.get("tables", {})) != {*SNAPSHOT_TABLES, *SNAPSHOT_AGGREGATES}:
+        return True
+    last_full = datetime.fromisoformat(manifest["last_full_rebuild_at"])
+    return db_now - last_full > timedelta(hours=ANALYTICS_SNAPSHOT_FULL_REBUILD_HOURS)
+
+
+def _refresh(full):
+    started = time.perf_counter()
+    manifest = read_snapshot_manifest()
+
+    with pg_conn() as conn:
+        desc_field = DiagnosisRepository._get_disease_desc_field(conn)
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT
+                    NOW(),
+                    (SELECT COALESCE(MAX(enct_id), 0) FROM ENCOUNTER),
+                    (SELECT COALESCE(MAX(appt_id), 0) FROM APPOINTMENT);
+                """
+            )
+            db_now, max_enct_id, max_appt_id = cur.fetchone()
+
+        full = full or _needs_full_rebuild(manifest, db_now)
+        if full:
+            changed_months = {"e.encounter_at": None, "cs.date": None}
+        else:
+            changed_months = {
+                "e.encounter_at": _changed_encounter_months(conn, manifest["high_water"]),
+                "cs.date": _changed_appointment_months(conn, manifest["high_water"]),
+            }
+    disease_signature = DiagnosisRepository.disease_catalog_signature()
+
+    table_rows = {} if full else dict(manifest["tables"])
+    refreshed = {}
+    with duck_engine.cursor() as cur:
+        for table, (partition, order_by, sql) in SNAPSHOT_TABLES.items():
+            months = changed_months[partition] if partition else None
+            if partition and months is not None and not months:
+                continue
+            if table == "disease" and not full and manifest.get("disease_signature") == disease_signature:
+                continue
+            where = "TRUE" if months is None else _month_filter(partition, months)
+            # 整段查詢在 PostgreSQL 執行（postgres_query），只傳回需要的資料列
+            pg_sql = sql.format(where=where, desc_field=desc_field)
+            table_rows[table] = _publish_table(
+                cur,
+                table,
+                partition is not None,
+                order_by,
+                f"SELECT * FROM postgres_query('pgdb', {_sql_literal(pg_sql)})",
+                months,
+            )
+            refreshed[table] = "all" if months is None else sorted(months)
+
+        months = changed_months["e.encounter_at"]
+        if months is None or months:
+            where = "TRUE" if months is None else f"e.month IN ({', '.join(_sql_literal(m) for m in sorted(months))})"
+            for table, (order_by, sql) in SNAPSHOT_AGGREGATES.items():
+                table_rows[table] = _publish_table(
+                    cur,
+                    table,
+                    True,
+                    order_by,
+                    sql.format(
+                        where=where,
+                        encounter=_sql_literal(_table_pattern("encounter")),
+                        provider=_sql_literal(_table_pattern("provider")),
+                    ),
+                    months,
+                )
+                refreshed[table] = "all" if months is None else sorted(months)
+
+    new_manifest = {
+        "built_at": db_now.isoformat(),
+        "last_full_rebuild_at": db_now.isoformat() if full else manifest["last_full_rebuild_at"],
+        "high_water": {
+            "changed_at": (db_now - timedelta(seconds=ANALYTICS_SNAPSHOT_OVERLAP_SECONDS)).isoformat(),
+            "enct_id": max_enct_id,
+            "appt_id": max_appt_id,
+        },
+        "disease_signature": disease_signature,
+        "tables": table_rows,
+    }
+    tmp_path = f"{_manifest_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(new_manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, _manifest_path())
+
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    print(f"✅ 分析快照已{'完整重建' if full else '增量更新'}：{len(refreshed)} 個資料表（{duration_ms} ms）")
+    return {"full": full, "built_at": new_manifest["built_at"], "refreshed": refreshed, "duration_ms": duration_ms}
+
+
+def refresh_snapshot(full=False):
+    """
+    把 PostgreSQL 的就診、診斷、處方／用藥明細、檢驗、繳費、掛號同步到本機的 Parquet 快照（leader worker 定時執行）：
+    - 以 high-water mark（ENCOUNTER.updated_at、APPOINTMENT.status_changed_at、最大 enct_id / appt_id）找出有變更的月份，
+      只重抓這些月份；每個查詢整段在 PostgreSQL 執行（postgres_query），只傳回需要的資料列
+    - full=True、尚未建立過、或距上次完整重建超過 ANALYTICS_SNAPSHOT_FULL_REBUILD_HOURS 時整份重建
+    - 每個檔案以 os.replace 原子替換，所有 worker 透過 snap.* view 讀取同一份檔案
+    回傳 {"full", "built_at", "refreshed": {表名: 重抓的月份或 "all"}, "duration_ms"}。
+    """
+    with _build_lock:
+        return _refresh(full)
+
+
+def get_snapshot_status():
+    """快照目錄、是否已建立與 manifest 內容"""
+    return {
+        "directory": ANALYTICS_SNAPSHOT_DIR,
+        "ready": snapshot_ready(),
+        "manifest": read_snapshot_manifest(),
+    }
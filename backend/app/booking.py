@@ -0,0 +1,99 @@
+# booking.py
+import asyncio
+from collections import deque
+
+from .config import BOOKING_BATCH_MAX_SIZE
+from .repositories.aio import AsyncAppointmentRepository
+
+
+class BookingEngine:
+    """
+    建立掛號的引擎（每個 worker 一個，跑在 asyncio event loop 上）：
+    - 請求依 session_id 進入行程內佇列，每個 session 同時只有一個 drain task 寫入資料庫
+    - drain task 每次取出最多 batch_max_size 筆，交給
+      AsyncAppointmentRepository.create_appointments_batch 在單一交易中處理（整批只鎖定 CLINIC_SESSION 一次）
+    - 上一批 commit 期間抵達的請求自然累積成下一批；負載低時一批只有一筆，不額外等待
+    - 多個 worker 各有自己的佇列，跨 worker 仍由 CLINIC_SESSION 列鎖內的名額檢查保證不超賣
+    """
+
+    def __init__(self, batch_max_size=BOOKING_BATCH_MAX_SIZE):
+        self.batch_max_size = batch_max_size
+        # session_id -> deque[((patient_id, join_waitlist), future)]；佇列清空後移除
+        self._queues = {}
+        # 執行中的 drain task（保留參照，避免被回收）
+        self._tasks = set()
+        self._stats = {"requests": 0, "batches": 0, "max_batch_size": 0, "fallbacks": 0}
+
+    async def book(self, patient_id, session_id, join_waitlist=True):
+        """
+        排入該 session 的佇列並等待結果：成功回傳掛號 dict（額滿且 join_waitlist 時為候補，status = 6），
+        失敗拋出與 AppointmentRepository.create_appointment 相同訊息的 Exception。
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        queue = self._queues.get(session_id)
+        if queue is None:
+            queue = self._queues[session_id] = deque()
+            task = loop.create_task(self._drain(session_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append(((patient_id, join_waitlist), future))
+        self._stats["requests"] += 1
+        return await future
+
+    async def _drain(self, session_id, queue):
+        """依序處理佇列中的請求直到清空（清空與移除之間沒有 await，新請求不會遺漏）"""
+        batch = []
+        try:
+            while queue:
+                batch = [queue.popleft() for _ in range(min(len(queue), self.batch_max_size))]
+                await self._run_batch(session_id, batch)
+        finally:
+            self._queues.pop(session_id, None)
+            # 只有 task 本身被取消（例如關閉 event loop）時才會留下未處理的請求：
+            # 包含已從佇列取出、處理到一半的這一批，以及仍在佇列中的請求
+            for _request, future in [*batch, *queue]:
+                if not future.done():
+                    future.set_exception(Exception("Booking engine stopped"))
+            queue.clear()
+
+    async def _run_batch(self, session_id, batch):
+        requests = [request for request, _ in batch]
+        self._stats["batches"] += 1
+        self._stats["max_batch_size"] = max(self._stats["max_batch_size"], len(batch))
+        try:
+            results = await AsyncAppointmentRepository.create_appointments_batch(session_id, requests)
+        except Exception as e:
+            if len(batch) == 1:
+                results = [e]
+            else:
+                # 整批交易失敗（例如其中一位病人不存在而違反外鍵）：逐筆重試，避免一筆錯誤拖累整批
+                print(f"⚠️ 掛號批次失敗，改為逐筆處理（session_id={session_id}，{len(batch)} 筆）: {e}")
+                self._stats["fallbacks"] += 1
+                results = []
+                for request in requests:
+                    try:
+                        results.extend(
+                            await AsyncAppointmentRepository.create_appointments_batch(session_id, [request])
+                        )
+                    except Exception as one_error:
+                        results.append(one_error)
+
+        for (_request, future), result in zip(batch, results):
+            # 呼叫端已取消（client 斷線）時 future 已結束；掛號仍已建立，與交易開始後斷線的行為相同
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            **self._stats,
+            "queued_sessions": len(self._queues),
+            "queued_requests": sum(len(queue) for queue in self._queues.values()),
+        }
+
+
+booking_engine = BookingEngine()
@@ -0,0 +1,255 @@
+# cache.py
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .config import CACHE_MAX_ENTRIES
+
+# name -> TTLCache，方便統一失效或檢視
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class TTLCache:
+    """
+    行程內（per-worker）的 TTL 快取：
+    - get_or_load(key, loader, tags)：未命中或過期時呼叫 loader() 載入，同一 key 只會有一個執行緒在載入
+    - aget_or_load(key, loader, tags)：asyncio 版本（loader 為 async 函式），同一 key 只會有一個 task 在載入
+    - refresh(key, loader, tags)：不論是否過期都重新載入（供排程預熱使用，讀取端不會遇到過期）
+    - invalidate(key=None)：失效單一 key 或整個快取
+    - invalidate_tags(tags)：失效帶有任一實體鍵（例如 "session:12"、"department:3"）的項目，
+      由快取失效匯流排（見 app.events）在任何 worker 寫入後呼叫
+    載入期間若發生失效，載入結果照常回傳但不寫入快取，避免把失效前讀到的舊資料存回去。
+    寫入時先清掉已過期的項目，超過 max_entries 再淘汰最早寫入的項目（key 來自使用者輸入時不會無限成長）。
+    快取的值會直接回傳給呼叫端，呼叫端不應修改。
+    """
+
+    def __init__(self, name, ttl_seconds, max_entries=CACHE_MAX_ENTRIES):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # key -> (value, expires_at, tags)，依寫入順序排列（TTL 相同，所以也是過期順序）
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # key -> [載入中的鎖, 使用中的執行緒數]，避免同時過期時多個執行緒一起打資料庫；沒有人使用時移除
+        self._load_locks = {}
+        # key -> 載入中的 asyncio.Future（aget_or_load 用）
+        self._pending = {}
+        # 每次失效 +1；載入開始時記下當時的代數，寫入前比對載入期間是否有相關的失效
+        self._generation = 0
+        # 最後一次整個快取／單一 key 失效的代數，以及各實體鍵最後一次失效的代數（沒有載入中時清空）
+        self._cleared_at = 0
+        self._tag_invalidated_at = {}
+        self._loading = 0
+        # coalesced：未命中但等待其他 task 的載入結果（沒有另外查詢資料庫）
+        self._stats = {
+            "hits": 0, "misses": 0, "coalesced": 0, "loads": 0, "skipped_stores": 0, "invalidations": 0,
+            "evictions": 0,
+        }
+        with _caches_lock:
+            _caches[name] = self
+
+    def _get_fresh(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            return True, entry[0]
+        return False, None
+
+    def _lookup(self, key):
+        """查詢並記錄命中／未命中"""
+        with self._lock:
+            hit, value = self._get_fresh(key)
+            self._stats["hits" if hit else "misses"] += 1
+            return hit, value
+
+    @contextmanager
+    def _load_lock(self, key):
+        with self._lock:
+            entry = self._load_locks.get(key)
+            if entry is None:
+                entry = self._load_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._load_locks[key]
+
+    def _store(self, key, value, tags):
+        """寫入一筆（呼叫端需持有 self._lock）：先清掉已過期的項目，超過上限再淘汰最早寫入的項目"""
+        now = time.monotonic()
+        self._entries.pop(key, None)
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest[1] > now and len(self._entries) < self.max_entries:
+                break
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+        self._entries[key] = (value, now + self.ttl_seconds, frozenset(tags))
+
+    def _begin_load(self):
+        """開始載入，回傳目前的代數（之後交給 _finish_load）"""
+        with self._lock:
+            self._loading += 1
+            return self._generation
+
+    def _finish_load(self, key, value, tags, generation, loaded=True):
+        """
+        載入結束：loaded 為 True 時寫入快取，
+        但載入期間若整個快取被清空，或任一 tags 被失效，就不寫入（載入結果可能是失效前的舊資料）。
+        """
+        with self._lock:
+            self._loading -= 1
+            if loaded:
+                self._stats["loads"] += 1
+                stale = self._cleared_at > generation or any(
+                    self._tag_invalidated_at.get(tag, 0) > generation for tag in tags
+                )
+                if stale:
+                    self._stats["skipped_stores"] += 1
+                else:
+                    self._store(key, value, tags)
+            if self._loading == 0:
+                self._tag_invalidated_at.clear()
+
+    def _load(self, key, loader, tags):
+        generation = self._begin_load()
+        try:
+            value = loader()
+        except BaseException:
+            self._finish_load(key, None, tags, generation, loaded=False)
+            raise
+        self._finish_load(key, value, tags, generation)
+        return value
+
+    def get_or_load(self, key, loader, tags=()):
+        hit, value = self._lookup(key)
+        if hit:
+            return value
+
+        with self._load_lock(key):
+            # 等鎖期間可能已被其他執行緒載入
+            with self._lock:
+                hit, value = self._get_fresh(key)
+            if hit:
+                return value
+            return self._load(key, loader, tags)
+
+    async def aget_or_load(self, key, loader, tags=()):
+        hit, value = self._lookup(key)
+        if hit:
+            return value
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            # 其他 task 正在載入同一個 key：等它的結果；該 task 被取消（例如客戶端斷線）時自己載入
+            with self._lock:
+                self._stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        generation = self._begin_load()
+        loaded = False
+        value = None
+        try:
+            value = await loader()
+            loaded = True
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            # 沒有其他 task 等待時，避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        finally:
+            self._finish_load(key, value, tags, generation, loaded=loaded)
+            if not future.done():
+                future.cancel()
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def refresh(self, key, loader, tags=()):
+        with self._load_lock(key):
+            return self._load(key, loader, tags)
+
+    def invalidate(self, key=None):
+        with self._lock:
+            self._generation += 1
+            self._cleared_at = self._generation
+            if key is None:
+                self._stats["invalidations"] += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(key, None) is not None:
+                self._stats["invalidations"] += 1
+
+    def invalidate_tags(self, tags):
+        """失效帶有任一指定實體鍵的項目，回傳失效筆數"""
+        tags = set(tags)
+        with self._lock:
+            self._generation += 1
+            if self._loading:
+                for tag in tags:
+                    self._tag_invalidated_at[tag] = self._generation
+            stale = [key for key, entry in self._entries.items() if entry[2] & tags]
+            for key in stale:
+                del self._entries[key]
+            self._stats["invalidations"] += len(stale)
+            return len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "hit_rate": round(self._stats["hits"] / lookups, 3) if lookups else None,
+                "ttl_seconds": self.ttl_seconds,
+                "max_entries": self.max_entries,
+            }
+
+
+def get_cache(name):
+    """依名稱取得已建立的快取（不存在時回傳 None）"""
+    with _caches_lock:
+        return _caches.get(name)
+
+
+def invalidate_cache(name, key=None):
+    """失效指定名稱的快取；回傳是否找到該快取"""
+    cache = get_cache(name)
+    if cache is None:
+        return False
+    cache.invalidate(key)
+    return True
+
+
+def invalidate_tags(tags):
+    """在所有快取中失效帶有這些實體鍵的項目，回傳 {快取名稱: 失效筆數}"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.invalidate_tags(tags) for cache in caches}
+
+
+def invalidate_all_caches():
+    """清空所有快取（快取失效匯流排重新連線後呼叫，中斷期間的失效通知可能已遺失）"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.invalidate()
+
+
+def get_cache_stats():
+    """所有快取的命中／未命中、載入與失效統計"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    return {cache.name: cache.stats() for cache in caches}
@@ -18,8 +18,84 @@ PG_DSN = (
     f"host={PG_HOST} port={PG_PORT}"
 )
 
+# PostgreSQL 連線池設定（見 pg_base.PgConnectionPool）
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "2"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "20"))
+# 連線最長存活秒數，超過即汰換（避免長連線累積 backend 記憶體）
+PG_POOL_MAX_LIFETIME = float(os.getenv("PG_POOL_MAX_LIFETIME", "1800"))
+# 閒置超過此秒數的連線，checkout 時先 SELECT 1 檢查
+PG_POOL_HEALTHCHECK_IDLE = float(os.getenv("PG_POOL_HEALTHCHECK_IDLE", "30"))
+# 池滿時等待可用連線的秒數
+PG_POOL_CHECKOUT_TIMEOUT = float(os.getenv("PG_POOL_CHECKOUT_TIMEOUT", "10"))
+# asyncio 連線池（見 pg_async.py，async def 路由使用）的最大連線數，與同步連線池分開計算；
+# 每個 worker 最多使用 PG_POOL_MAX_SIZE + PG_ASYNC_POOL_MAX_SIZE + 2 條連線（另有 LISTEN 與排程 leader lock 各一條）
+PG_ASYNC_POOL_MAX_SIZE = int(os.getenv("PG_ASYNC_POOL_MAX_SIZE", "10"))
+
+# 背景排程：把已結束的門診時段設為停診的間隔秒數（見 app.jobs.session_expiry）
+SESSION_EXPIRY_INTERVAL_SECONDS = int(os.getenv("SESSION_EXPIRY_INTERVAL_SECONDS", "60"))
+# 背景排程：處理未報到掛號、累計爽約次數的間隔秒數（見 app.jobs.no_show）
+NO_SHOW_INTERVAL_SECONDS = int(os.getenv("NO_SHOW_INTERVAL_SECONDS", "300"))
+# 背景排程：檢查並修正 CLINIC_SESSION.booked_count 偏差的間隔秒數（見 app.jobs.booked_count_reconcile）
+BOOKED_COUNT_RECONCILE_INTERVAL_SECONDS = int(os.getenv("BOOKED_COUNT_RECONCILE_INTERVAL_SECONDS", "3600"))
+
+# 部門／分類目錄的行程內快取秒數（見 repositories/department_repo.py）
+DEPARTMENT_CACHE_TTL_SECONDS = int(os.getenv("DEPARTMENT_CACHE_TTL_SECONDS", "600"))
+# 瀏覽器端快取秒數（Cache-Control max-age），過期後以 ETag 重新驗證
+DEPARTMENT_HTTP_MAX_AGE_SECONDS = int(os.getenv("DEPARTMENT_HTTP_MAX_AGE_SECONDS", "60"))
+
+# 門診搜尋結果（SessionRepository.search_sessions）與醫師基本資料的行程內快取秒數；
+# 寫入後由快取失效匯流排（見 app.events）通知所有 worker 立即失效，TTL 只是上限
+SESSION_SEARCH_CACHE_TTL_SECONDS = int(os.getenv("SESSION_SEARCH_CACHE_TTL_SECONDS", "60"))
+PROVIDER_PROFILE_CACHE_TTL_SECONDS = int(os.getenv("PROVIDER_PROFILE_CACHE_TTL_SECONDS", "600"))
+# 每個行程內快取（app.cache.TTLCache）最多保存的項目數，超過時先淘汰最早寫入（最早過期）的項目
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+
+# 疾病搜尋索引：檢查 DISEASE 是否變更（變更才重建）的間隔秒數（見 app.search.disease_index）
+DISEASE_INDEX_CHECK_INTERVAL_SECONDS = int(os.getenv("DISEASE_INDEX_CHECK_INTERVAL_SECONDS", "300"))
+
+# 並行查詢（app.fanout）最多同時執行的工作數；每個工作各借一條連線，不應超過連線池大小
+FANOUT_MAX_WORKERS = int(os.getenv("FANOUT_MAX_WORKERS", str(min(16, PG_POOL_MAX_SIZE))))
+
+# 掛號引擎（見 app.booking.BookingEngine）：同一門診時段的掛號請求合併處理時，每批最多筆數
+BOOKING_BATCH_MAX_SIZE = int(os.getenv("BOOKING_BATCH_MAX_SIZE", "100"))
+# 每個門診時段最多候補人數（額滿時加入候補，超過則回傳已額滿）
+WAITLIST_MAX_SIZE = int(os.getenv("WAITLIST_MAX_SIZE", "50"))
+
+# 冪等鍵（見 services/shared/idempotency_service.py）：Idempotency-Key 的保存秒數、處理中的租約秒數
+# （第一次請求超過租約仍未寫回結果，視為已中斷，重送可重新佔用）與清除過期鍵的排程間隔
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_PROCESSING_LEASE_SECONDS = int(os.getenv("IDEMPOTENCY_PROCESSING_LEASE_SECONDS", "60"))
+IDEMPOTENCY_PURGE_INTERVAL_SECONDS = int(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "3600"))
+
+# 即時事件（見 app.events 與 /events 的 SSE 路由）：每個訂閱者最多暫存的事件數（滿了丟掉最舊的）、
+# LISTEN 連線中斷後的重連間隔秒數、SSE 沒有事件時送出心跳的間隔秒數
+EVENTS_SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_SUBSCRIBER_QUEUE_SIZE", "100"))
+EVENTS_LISTENER_RETRY_SECONDS = float(os.getenv("EVENTS_LISTENER_RETRY_SECONDS", "3"))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+# 病人歷史記錄分頁：預設每頁就診筆數與上限（見 PatientHistoryService.get_patient_history_page）
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_PAGE_SIZE_MAX = int(os.getenv("HISTORY_PAGE_SIZE_MAX", "100"))
+# 增量同步：回傳的 sync_token 比查詢時間提早的秒數，涵蓋查詢當下尚未 commit 的交易（重複收到的就診以新資料覆蓋即可）
+HISTORY_SYNC_OVERLAP_SECONDS = int(os.getenv("HISTORY_SYNC_OVERLAP_SECONDS", "60"))
+
 # DuckDB postgres_scanner 用的 URI
 PG_URI = f"postgresql://{PG_USER}:{PG_PWD}@{PG_HOST}:{PG_PORT}/{PG_DB}"
+# DuckDB 分析引擎的資料庫（見 db_duck.DuckDBEngine）；預設為記憶體資料庫，
+# 多個 uvicorn worker 各自持有，不會搶同一個檔案的寫入鎖
+DUCKDB_DATABASE = os.getenv("DUCKDB_DATABASE", ":memory:")
+
+# 分析用快照（見 app.analytics.snapshot）：PostgreSQL 資料表依月份輸出成 Parquet 的目錄，所有 worker 共用
+ANALYTICS_SNAPSHOT_DIR = os.getenv(
+    "ANALYTICS_SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "analytics_snapshot"),
+)
+# 增量更新快照的間隔秒數（leader worker 執行）
+ANALYTICS_SNAPSHOT_INTERVAL_SECONDS = int(os.getenv("ANALYTICS_SNAPSHOT_INTERVAL_SECONDS", "600"))
+# 距離上次完整重建超過此時數就整份重建（清掉已刪除的資料、搬移月份的就診）
+ANALYTICS_SNAPSHOT_FULL_REBUILD_HOURS = int(os.getenv("ANALYTICS_SNAPSHOT_FULL_REBUILD_HOURS", "24"))
+# high-water mark 比本次開始時間提早的秒數，涵蓋當下尚未 commit 的交易（重抓的月份整個覆蓋，不會重複）
+ANALYTICS_SNAPSHOT_OVERLAP_SECONDS = int(os.getenv("ANALYTICS_SNAPSHOT_OVERLAP_SECONDS", "300"))
 
 # 固定當前時間（用於開發/測試）
 # 設定為 2025-12-07 14:30
@@ -1,36 +1,167 @@
 # db_duck.py
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
 import duckdb
-from .config import PG_URI
+from .config import PG_URI, DUCKDB_DATABASE
+
+# 這些錯誤多半是 DuckDB 連線或附掛的 PostgreSQL 連線失效，重建連線後重試一次
+_RECONNECT_ERRORS = (duckdb.IOException, duckdb.ConnectionException, duckdb.InternalException)
+
+
+class DuckDBEngine:
+    """
+    長駐的 DuckDB 分析引擎（每個行程一個）：
+    - 第一次使用時開啟 DUCKDB_DATABASE（預設 :memory:）、載入 postgres_scanner、把 PostgreSQL 附掛成 pgdb（唯讀），之後重複使用
+    - 每個請求透過 cursor() 取得自己的 DuckDB cursor（DuckDB 連線不可跨執行緒共用，cursor 可以）
+    - 查詢遇到連線類錯誤時重建連線（重新 ATTACH）並重試一次
+    """
+
+    def __init__(self, database=DUCKDB_DATABASE, pg_uri=PG_URI):
+        self.database = database
+        self.pg_uri = pg_uri
+        self._con = None
+        # 每次重建連線 +1；只有失敗時仍是同一代的連線才重建，避免多個執行緒同時失敗時重複重建
+        self._generation = 0
+        self._lock = threading.Lock()
+        # 連線建立後要執行的設定（見 add_connect_hook）
+        self._connect_hooks = []
+        self._stats = {"connects": 0, "reconnects": 0, "queries": 0, "failures": 0, "last_connect_ms": None}
+
+    def _connect(self):
+        started = time.perf_counter()
+        con = duckdb.connect(self.database)
+        # INSTALL 只在第一次下載 extension，之後為 no-op
+        con.execute("INSTALL postgres_scanner")
+        con.execute("LOAD postgres_scanner")
+        # 同一行程內對同一檔案的連線共用資料庫實例，重連時先卸除舊的附掛
+        con.execute("DETACH DATABASE IF EXISTS pgdb")
+        con.execute(f"ATTACH '{self.pg_uri}' AS pgdb (TYPE POSTGRES, READ_ONLY)")
+        for hook in self._connect_hooks:
+            hook(con)
+        self._stats["connects"] += 1
+        self._stats["last_connect_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print(f"✅ DuckDB 分析引擎已連線（{self._stats['last_connect_ms']} ms）")
+        return con
+
+    def add_connect_hook(self, hook):
+        """註冊連線建立後要執行的設定 hook(con)（例如建立 view），重新連線時會再執行一次"""
+        self._connect_hooks.append(hook)
+
+    def _acquire(self):
+        """回傳 (連線代數, 新 cursor)；尚未連線時先連線"""
+        with self._lock:
+            if self._con is None:
+                self._con = self._connect()
+                self._generation += 1
+            return self._generation, self._con.cursor()
+
+    def _reset(self, generation):
+        """捨棄失效的連線（若已被其他執行緒重建則不動），下次使用時重新連線"""
+        with self._lock:
+            if self._con is not None and self._generation == generation:
+                old, self._con = self._con, None
+                self._stats["reconnects"] += 1
+                try:
+                    old.close()
+                except Exception:
+                    pass
+
+    @contextmanager
+    def cursor(self):
+        """
+        借用一個 DuckDB cursor（請求結束時關閉）：
+            with duck_engine.cursor() as cur:
+                cur.execute("SELECT ...", [param]).fetchall()
+        直接使用 cursor 不會自動重試；需要重試請用 fetch_dicts / fetch_df。
+        """
+        _generation, cur = self._acquire()
+        try:
+            yield cur
+        finally:
+            cur.close()
+
+    def _run(self, fn):
+        """以新的 cursor 執行 fn(cursor)，連線類錯誤時重建連線並重試一次"""
+        for attempt in (1, 2):
+            generation, cur = self._acquire()
+            try:
+                result = fn(cur)
+                self._stats["queries"] += 1
+                return result
+            except _RECONNECT_ERRORS as e:
+                self._stats["failures"] += 1
+                self._reset(generation)
+                if attempt == 2:
+                    raise
+                print(f"⚠️ DuckDB 查詢失敗，重新連線後重試: {e}")
+            finally:
+                cur.close()
 
-DUCKDB_FILE = "clinic_analytics.duckdb"
+    def fetch_dicts(self, sql, params=None):
+        """執行查詢並回傳 list of dict（不需要 pandas）"""
+        def run(cur):
+            cur.execute(sql, params or [])
+            columns = [column[0] for column in cur.description]
+            return [dict(zip(columns, row)) for row in cur.fetchall()]
+        return self._run(run)
+
+    def fetch_rows(self, sql, params=None):
+        """執行查詢並回傳 list of tuple"""
+        return self._run(lambda cur: cur.execute(sql, params or []).fetchall())
+
+    def fetch_arrow(self, sql, params=None):
+        """執行查詢並回傳 pyarrow Table（欄式資料，不逐列轉成 Python 物件）"""
+        return self._run(lambda cur: cur.execute(sql, params or []).fetch_arrow_table())
+
+    def fetch_df(self, sql, params=None):
+        """執行查詢並回傳 pandas DataFrame"""
+        return self._run(lambda cur: cur.execute(sql, params or []).df())
+
+    def close(self):
+        with self._lock:
+            if self._con is not None:
+                try:
+                    self._con.close()
+                except Exception:
+                    pass
+                self._con = None
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "connected": self._con is not None}
+
+
+duck_engine = DuckDBEngine()
 
 
 def get_duckdb_conn():
-    con = duckdb.connect(DUCKDB_FILE)
-    # 啟用 postgres_scanner extension
-    con.execute("INSTALL postgres_scanner")
-    con.execute("LOAD postgres_scanner")
-    # 把 PostgreSQL 附掛成 pgdb
-    con.execute(f"ATTACH '{PG_URI}' AS pgdb (TYPE POSTGRES)")
-    return con
+    """
+    向後相容：回傳共用引擎上的一個新 cursor（已載入 postgres_scanner 並附掛 pgdb）。
+    呼叫端用完請 close()；新程式請改用 duck_engine.cursor() / fetch_dicts()。
+    """
+    return duck_engine._acquire()[1]
+
 
+def close_duckdb_engine():
+    """關閉共用的 DuckDB 連線（應用程式 shutdown 時呼叫）"""
+    duck_engine.close()
 
-def get_daily_encounter_stats():
+
+def get_daily_encounter_stats(date_from=None, date_to=None):
     """
     例子：統計每天各醫師的看診次數
-    以 ENCOUNTER 為主。
-    """
-    con = get_duckdb_conn()
-    query = """
-        SELECT
-            date(e.encounter_at) AS visit_date,
-            pr.user_id           AS provider_id,
-            u_doc.name           AS provider_name,
-            COUNT(*)             AS encounter_count
-        FROM pgdb.public.ENCOUNTER e
-        JOIN pgdb.public.PROVIDER pr ON e.provider_id = pr.user_id
-        JOIN pgdb.public."USER" u_doc ON pr.user_id = u_doc.user_id
-        GROUP BY visit_date, provider_id, provider_name
-        ORDER BY visit_date DESC, provider_name;
+    讀取分析快照的每日彙總（見 analytics/clinic_stats.py），可指定日期區間（含兩端）。
     """
-    return con.execute(query).df()
+    from .analytics.clinic_stats import encounter_stats_query
+
+    sql, params = encounter_stats_query(
+        date_from or date(1900, 1, 1),
+        date_to or date(9999, 12, 31),
+        granularity="day",
+        group_by="provider",
+    )
+    df = duck_engine.fetch_df(sql, params)
+    return df.rename(columns={"period": "visit_date"})
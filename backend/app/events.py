@@ -0,0 +1,297 @@
+# events.py
+import asyncio
+import json
+from collections import deque
+
+from .cache import invalidate_tags, invalidate_all_caches
+from .config import PG_DSN, EVENTS_SUBSCRIBER_QUEUE_SIZE, EVENTS_LISTENER_RETRY_SECONDS
+from .pg_base import pg_conn
+
+# 門診時段變更的 NOTIFY channel（掛號、狀態變更、門診新增／修改／停診都會送出）；
+# 同時作為 session / department / provider 實體鍵的快取失效通知
+SESSION_EVENTS_CHANNEL = "session_events"
+# 其他實體的快取失效 channel：payload 為實體鍵的 JSON 陣列（見 publish_invalidation）
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+# 部門目錄（DEPARTMENT / DEPARTMENT_CATEGORY）的實體鍵
+DEPARTMENT_CATALOG_KEY = "department_catalog"
+# 疾病搜尋索引的實體鍵：收到時各 worker 檢查 DISEASE 是否變更並重建索引
+DISEASE_CATALOG_KEY = "disease_catalog"
+
+# 送出門診時段變更通知：payload 為該時段目前的名額與狀態（JSON）。
+# NOTIFY 隨交易 commit 才送出、rollback 即丟棄；同一交易內內容相同的通知只會送出一次。
+_NOTIFY_SESSIONS_SQL = f"""
+    SELECT pg_notify(
+        '{SESSION_EVENTS_CHANNEL}',
+        json_build_object(
+            'session_id', cs.session_id,
+            'provider_id', cs.provider_id,
+            'dept_id', pr.dept_id,
+            'date', cs.date,
+            'period', cs.period,
+            'capacity', cs.capacity,
+            'booked_count', cs.booked_count,
+            'status', cs.status
+        )::text
+    )
+    FROM CLINIC_SESSION cs
+    JOIN PROVIDER pr ON pr.user_id = cs.provider_id
+    WHERE cs.session_id = ANY(%s);
+"""
+
+
+def notify_session_changes(conn, session_ids):
+    """
+    在目前交易中送出門診時段變更通知（同步版，psycopg2 連線）。
+    必須在寫入之後、conn.commit() 之前呼叫，通知內容才會是寫入後的值。
+    """
+    session_ids = sorted({session_id for session_id in session_ids if session_id is not None})
+    if not session_ids:
+        return
+    with conn.cursor() as cur:
+        cur.execute(_NOTIFY_SESSIONS_SQL, (session_ids,))
+
+
+async def anotify_session_changes(conn, session_ids):
+    """notify_session_changes 的 asyncio 版本（psycopg 3 連線）"""
+    session_ids = sorted({session_id for session_id in session_ids if session_id is not None})
+    if not session_ids:
+        return
+    async with conn.cursor() as cur:
+        await cur.execute(_NOTIFY_SESSIONS_SQL, (session_ids,))
+
+
+def publish_invalidation(keys, conn=None):
+    """
+    廣播快取失效（所有 worker 的 LISTEN 連線收到後，失效帶有這些實體鍵的快取項目）：
+    keys 為實體鍵，例如 "provider:12"、"department:3"、"department_catalog"。
+    傳入 conn 時在該交易中送出（commit 後才送達，應在寫入之後、commit 之前呼叫）；
+    不傳 conn 時另借一條連線立即送出。
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return
+    if conn is None:
+        with pg_conn() as own_conn:
+            publish_invalidation(keys, own_conn)
+            own_conn.commit()
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_notify(%s, %s);", (CACHE_INVALIDATION_CHANNEL, json.dumps(keys)))
+
+
+def session_entity_keys(event):
+    """門診時段通知影響的快取實體鍵（快取門診資料時以這些鍵標記）"""
+    keys = [f"session:{event['session_id']}", f"provider:{event['provider_id']}", "sessions"]
+    if event.get("dept_id") is not None:
+        keys.append(f"department:{event['dept_id']}")
+    return keys
+
+
+def session_topic(session_id):
+    return f"session:{session_id}"
+
+
+def department_topic(dept_id):
+    return f"department:{dept_id}"
+
+
+class Subscription:
+    """一個訂閱者：有上限的事件佇列，佇列已滿時丟掉最舊的事件（客戶端只需要最新狀態）"""
+
+    def __init__(self, topic, queue_size):
+        self.topic = topic
+        self.events = deque(maxlen=queue_size)
+        self.dropped = 0
+        # 有新事件時喚醒等待中的 next_events
+        self._wakeup = asyncio.Event()
+
+    def put(self, event):
+        if len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+        self._wakeup.set()
+
+    async def next_events(self, timeout):
+        """等待並取出佇列中所有事件；timeout 秒內沒有事件時回傳空 list"""
+        if not self.events:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+
+class EventHub:
+    """
+    行程內的事件分送（只在 event loop 執行緒使用，不需要鎖）：
+    - subscribe(topic)：取得一個 Subscription，收到該 topic 的事件；用完呼叫 unsubscribe
+    - publish(topic, event)：放入該 topic 所有訂閱者的佇列
+    - broadcast(event)：送給所有訂閱者（例如 LISTEN 連線重建後通知客戶端重新載入）
+    """
+
+    def __init__(self, queue_size=EVENTS_SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        # topic -> set of Subscription
+        self._subscribers = {}
+        self._stats = {"published": 0, "delivered": 0, "dropped": 0}
+
+    def subscribe(self, topic):
+        subscription = Subscription(topic, self.queue_size)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscribers = self._subscribers.get(subscription.topic)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.topic]
+        self._stats["dropped"] += subscription.dropped
+
+    def publish(self, topic, event):
+        self._stats["published"] += 1
+        for subscription in self._subscribers.get(topic, ()):
+            subscription.put(event)
+            self._stats["delivered"] += 1
+
+    def broadcast(self, event):
+        for subscribers in self._subscribers.values():
+            for subscription in subscribers:
+                subscription.put(event)
+                self._stats["delivered"] += 1
+
+    def stats(self):
+        return {
+            **self._stats,
+            "topics": len(self._subscribers),
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+        }
+
+
+class PgListener:
+    """
+    每個行程一條 PostgreSQL LISTEN 連線（psycopg 3，autocommit），收到通知後交給該 channel 的 handler：
+    - add_handler(channel, handler)：handler(payload 字串) 在 event loop 中執行，不應阻塞
+    - start() / stop()：在 FastAPI startup / shutdown 事件中呼叫
+    - 連線中斷時每 EVENTS_LISTENER_RETRY_SECONDS 秒重連；重連成功後呼叫 on_reconnect 的 callback，
+      讓訂閱者知道中斷期間可能漏掉通知
+    """
+
+    def __init__(self, dsn=PG_DSN, retry_seconds=EVENTS_LISTENER_RETRY_SECONDS):
+        self.dsn = dsn
+        self.retry_seconds = retry_seconds
+        # channel -> list of handler
+        self._handlers = {}
+        self._reconnect_callbacks = []
+        self._task = None
+        self._stats = {"connects": 0, "notifications": 0, "handler_errors": 0, "connected": False}
+
+    def add_handler(self, channel, handler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def on_reconnect(self, callback):
+        self._reconnect_callbacks.append(callback)
+
+    async def _listen_once(self):
+        import psycopg
+
+        async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+            for channel in self._handlers:
+                await conn.execute(f"LISTEN {channel}")
+            self._stats["connects"] += 1
+            self._stats["connected"] = True
+            if self._stats["connects"] > 1:
+                for callback in self._reconnect_callbacks:
+                    callback()
+            print(f"✅ 事件監聽已連線（LISTEN {', '.join(self._handlers)}）")
+            async for notify in conn.notifies():
+                self._stats["notifications"] += 1
+                for handler in self._handlers.get(notify.channel, ()):
+                    try:
+                        handler(notify.payload)
+                    except Exception as e:
+                        self._stats["handler_errors"] += 1
+                        print(f"⚠️ 處理 {notify.channel} 通知失敗: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await self._listen_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ 事件監聽連線中斷，{self.retry_seconds} 秒後重連: {e}")
+            self._stats["connected"] = False
+            await asyncio.sleep(self.retry_seconds)
+
+    def start(self):
+        if self._task is None and self._handlers:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._stats["connected"] = False
+
+    def stats(self):
+        return dict(self._stats)
+
+
+event_hub = EventHub()
+pg_listener = PgListener()
+
+
+def _on_session_event(payload):
+    """門診時段通知：失效相關的快取，並分送給該時段與該科別的訂閱者"""
+    event = {"type": "session", **json.loads(payload)}
+    invalidate_tags(session_entity_keys(event))
+    event_hub.publish(session_topic(event["session_id"]), event)
+    if event.get("dept_id") is not None:
+        event_hub.publish(department_topic(event["dept_id"]), event)
+
+
+def _refresh_disease_index():
+    from .search import refresh_disease_index_if_changed
+    refresh_disease_index_if_changed()
+
+
+def _on_cache_invalidation(payload):
+    """快取失效通知：失效本 worker 帶有這些實體鍵的快取項目"""
+    keys = json.loads(payload)
+    invalidate_tags(keys)
+    if DISEASE_CATALOG_KEY in keys:
+        # 重建索引會查詢資料庫，不在 event loop 中執行
+        asyncio.get_running_loop().run_in_executor(None, _refresh_disease_index)
+
+
+def _on_reconnect():
+    # 重連前的通知可能已遺失：清空快取，並請客戶端重新載入一次
+    invalidate_all_caches()
+    event_hub.broadcast({"type": "resync"})
+
+
+pg_listener.add_handler(SESSION_EVENTS_CHANNEL, _on_session_event)
+pg_listener.add_handler(CACHE_INVALIDATION_CHANNEL, _on_cache_invalidation)
+pg_listener.on_reconnect(_on_reconnect)
+
+
+def start_event_listener():
+    """啟動本行程的 LISTEN 連線（FastAPI startup 事件中呼叫）"""
+    pg_listener.start()
+
+
+async def stop_event_listener():
+    """停止本行程的 LISTEN 連線（應用程式 shutdown 時呼叫）"""
+    await pg_listener.stop()
+
+
+def get_event_stats():
+    return {"listener": pg_listener.stats(), "hub": event_hub.stats()}
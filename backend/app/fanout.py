@@ -0,0 +1,106 @@
+# fanout.py
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+from .config import FANOUT_MAX_WORKERS
+from .pg_base import cancel_thread_queries
+
+_executor = None
+_executor_lock = threading.Lock()
+# 標記目前執行緒是否為 fan-out 工作執行緒（巢狀 fan_out 時改為依序執行，避免工作互相等待而卡死）
+_local = threading.local()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=FANOUT_MAX_WORKERS,
+                    thread_name_prefix="fanout",
+                )
+    return _executor
+
+
+def shutdown_fanout_executor():
+    """關閉 fan-out 執行緒池（應用程式 shutdown 時呼叫）"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+class _Task:
+    """
+    一個 fan-out 工作：記錄執行中的執行緒，取消時才知道要取消哪條連線上的查詢。
+    thread_id 的設定／清除與取消都在同一把鎖內，確保只在工作仍佔用該執行緒時送出取消，
+    不會誤取消同一條執行緒接著執行的其他請求的查詢。
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.thread_id = None
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        with self._lock:
+            if self.cancelled.is_set():
+                return None
+            self.thread_id = threading.get_ident()
+        _local.in_fanout = True
+        try:
+            return self.func()
+        finally:
+            _local.in_fanout = False
+            with self._lock:
+                self.thread_id = None
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            if self.thread_id is not None:
+                cancel_thread_queries(self.thread_id)
+
+
+def fan_out(calls, timeout=None):
+    """
+    並行執行互不相依的讀取，回傳 {名稱: 結果}：
+        results = fan_out({
+            "diagnoses": lambda: DiagnosisRepository.list_diagnoses_for_encounters(enct_ids),
+            "payments": lambda: PaymentRepository.list_payments_for_encounters(enct_ids),
+        })
+    - 每個工作在 fan-out 執行緒池中執行，各自透過 pg_conn() 借連線，總耗時約等於最慢的一個
+    - 任一工作失敗：取消尚未開始的工作、對執行中的工作送出 PostgreSQL 查詢取消，
+      等它們結束（連線歸還）後拋出第一個失敗工作的原始例外（HTTPException 等照常往上傳）
+    - 超過 timeout 秒：同樣取消全部工作後拋出 TimeoutError
+    在 fan-out 工作內再次呼叫 fan_out 時改為依序執行。
+    """
+    if not calls:
+        return {}
+    if getattr(_local, "in_fanout", False) or len(calls) == 1:
+        return {name: func() for name, func in calls.items()}
+
+    executor = _get_executor()
+    tasks = {name: _Task(func) for name, func in calls.items()}
+    futures = {name: executor.submit(task) for name, task in tasks.items()}
+
+    done, not_done = wait(futures.values(), timeout=timeout, return_when=FIRST_EXCEPTION)
+    failed = next((f for f in futures.values() if f in done and f.exception() is not None), None)
+
+    if failed is None and not not_done:
+        return {name: future.result() for name, future in futures.items()}
+
+    # 失敗或逾時：取消其餘工作，並等執行中的工作結束，確保連線都已歸還
+    for name, future in futures.items():
+        if future not in done:
+            future.cancel()
+            tasks[name].cancel()
+    wait(futures.values())
+
+    if failed is not None:
+        raise failed.exception()
+    pending = ", ".join(name for name, future in futures.items() if future in not_done)
+    raise TimeoutError(f"並行查詢逾時（{timeout} 秒）：{pending}")
@@ -0,0 +1,18 @@
+# jobs/__init__.py
+# 背景排程任務（由 app.scheduler 註冊執行）
+from .session_expiry import run_session_expiry
+from .no_show import run_no_show_processing
+from .cache_warm import run_department_cache_warm, run_disease_index_refresh
+from .analytics_snapshot import run_analytics_snapshot
+from .idempotency_purge import run_idempotency_purge
+from .booked_count_reconcile import run_booked_count_reconcile
+
+__all__ = [
+    "run_session_expiry",
+    "run_no_show_processing",
+    "run_department_cache_warm",
+    "run_disease_index_refresh",
+    "run_analytics_snapshot",
+    "run_idempotency_purge",
+    "run_booked_count_reconcile",
+]
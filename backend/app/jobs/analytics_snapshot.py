@@ -0,0 +1,12 @@
+# jobs/analytics_snapshot.py
+from ..analytics import refresh_snapshot, refresh_patient_stats
+
+
+def run_analytics_snapshot():
+    """
+    增量更新分析快照（PostgreSQL → Parquet），再重算受影響病人的統計 cube，
+    回傳重抓的資料表與月份、重算的病人數
+    """
+    summary = refresh_snapshot()
+    summary["patient_stats"] = refresh_patient_stats(summary)
+    return summary
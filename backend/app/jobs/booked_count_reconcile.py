@@ -0,0 +1,22 @@
+# jobs/booked_count_reconcile.py
+import time
+
+from ..repositories import SessionRepository
+
+
+def run_booked_count_reconcile():
+    """
+    比對 CLINIC_SESSION.booked_count 與實際佔用名額的掛號數，不一致時修正並通知。
+    正常情況下每次狀態變更都已同步維護 booked_count，這裡只是定期檢查偏差（例如手動修改資料）。
+    回傳 {"drifted": 修正的 session 數}。
+    """
+    started = time.perf_counter()
+    drifted = SessionRepository.reconcile_booked_counts(repair=True)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    for row in drifted:
+        print(
+            f"⚠️ 門診時段 {row['session_id']} 的 booked_count 偏差：{row['booked_count']} → {row['actual_count']}"
+        )
+    if drifted:
+        print(f"✅ 已修正 {len(drifted)} 個門診時段的 booked_count（{elapsed_ms:.1f} ms）")
+    return {"drifted": len(drifted)}
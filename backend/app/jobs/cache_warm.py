@@ -0,0 +1,17 @@
+# jobs/cache_warm.py
+from ..repositories import DepartmentRepository
+from ..search import refresh_disease_index_if_changed
+
+
+def run_department_cache_warm():
+    """重新載入本 worker 的部門／分類目錄快取，回傳部門與分類數量"""
+    catalog = DepartmentRepository.refresh_catalog()
+    return {
+        "departments": len(catalog["departments"]),
+        "categories": len(catalog["categories"]),
+    }
+
+
+def run_disease_index_refresh():
+    """DISEASE 內容有變時重建本 worker 的疾病搜尋索引，回傳是否重建"""
+    return {"rebuilt": refresh_disease_index_if_changed()}
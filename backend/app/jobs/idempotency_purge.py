@@ -0,0 +1,10 @@
+# jobs/idempotency_purge.py
+from ..repositories import IdempotencyRepository
+
+
+def run_idempotency_purge():
+    """刪除已過期的冪等鍵（IDEMPOTENCY_KEY）；回傳刪除筆數"""
+    deleted = IdempotencyRepository.delete_expired_keys()
+    if deleted > 0:
+        print(f"✅ 已刪除 {deleted} 個過期的冪等鍵")
+    return {"deleted": deleted}
@@ -0,0 +1,22 @@
+# jobs/no_show.py
+import time
+
+from ..repositories import AppointmentRepository
+
+
+def run_no_show_processing():
+    """
+    把已結束門診中仍為「已預約」且沒有就診紀錄的掛號標記為未報到，
+    累計爽約次數並設定禁止掛號（集合運算，見 AppointmentRepository._mark_expired_no_shows）。
+    可重複執行；回傳處理筆數與耗時。
+    """
+    started = time.perf_counter()
+    result = AppointmentRepository.process_expired_no_shows()
+    result["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    if result["marked"] > 0:
+        print(
+            f"✅ 已處理 {result['marked']} 個未報到的掛號"
+            f"（新增爽約紀錄 {result['no_show_events']} 筆、"
+            f"禁止掛號 {result['banned_patients']} 人，{result['duration_ms']} ms）"
+        )
+    return result
@@ -0,0 +1,19 @@
+# jobs/session_expiry.py
+import time
+
+from ..repositories import SessionRepository
+
+
+def run_session_expiry():
+    """
+    把已過結束時間但仍為開診（status = 1）的門診時段改為停診（status = 2）。
+    讀取路徑已用條件把這些 session 視為停診，這裡只負責讓資料表狀態跟上，
+    因此排程延遲不影響查詢結果。
+    回傳更新的 session 數量。
+    """
+    started = time.perf_counter()
+    updated_count = SessionRepository.update_expired_sessions()
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if updated_count > 0:
+        print(f"✅ 已將 {updated_count} 個已結束的門診時段設為停診（{elapsed_ms:.1f} ms）")
+    return updated_count
@@ -1,10 +1,13 @@
 # main.py
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
+from .config import DEPARTMENT_HTTP_MAX_AGE_SECONDS
+
 # 兩個子 router (專案拆分)
-from .routers import patient_router, provider_router
+from .routers import patient_router, provider_router, export_router, stats_router, events_router
 
 app = FastAPI(title="Clinic Digital System API")
 
@@ -36,162 +39,120 @@ app.include_router(provider_router, prefix="/provider", tags=["provider"])
 # 掛載 patient 專用路由
 app.include_router(patient_router, prefix="/patient", tags=["patient"])
 
+# 掛載大量匯出路由（NDJSON / CSV 串流）
+app.include_router(export_router, prefix="/export", tags=["export"])
+
+# 掛載全院營運統計路由（讀取分析快照）
+app.include_router(stats_router, prefix="/stats", tags=["stats"])
+
+# 掛載即時事件路由（門診時段變更的 Server-Sent Events）
+app.include_router(events_router, prefix="/events", tags=["events"])
+
 
 @app.on_event("startup")
 async def startup_event():
     """應用程式啟動時執行初始化任務"""
     try:
-        # 處理門診結束後未報到的病人，累計爽約次數
-        from .repositories import AppointmentRepository, PatientRepository, SessionRepository
-        from psycopg2.extras import RealDictCursor
-        from .pg_base import get_pg_conn
-        from datetime import datetime
-        
-        print("正在處理門診結束後未報到的掛號...")
-        
-        # 啟動定時任務調度器（優化版）
+        # 啟動定時任務調度器：門診停診、未報到掛號處理都在排程器執行緒中執行，不阻塞啟動
         print("初始化定時任務調度器...")
         try:
             from .scheduler import init_scheduler, start_scheduler
             init_scheduler()
             start_scheduler()
-            print("✅ 定時任務調度器已啟動（每 5 分鐘刷新物化視圖）")
+            print("✅ 定時任務調度器已啟動（門診停診、未報到掛號處理）")
         except ImportError:
             print("⚠️  APScheduler 未安裝，跳過定時任務")
         except Exception as e:
             print(f"⚠️  定時任務啟動失敗: {str(e)}")
-        conn = get_pg_conn()
+
+        # 建立疾病搜尋記憶體索引（失敗時第一次搜尋會再嘗試建立）
         try:
-            conn.autocommit = False
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # 找出所有已結束的門診時段中，狀態為「已預約」(1) 或「未報到」(5) 的掛號
-                cur.execute(
-                    """
-                    SELECT DISTINCT a.patient_id, a.appt_id, a.session_id
-                    FROM APPOINTMENT a
-                    JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
-                    WHERE COALESCE(ash_latest.to_status, 1) IN (1, 5)  -- 已預約或未報到
-                      AND (
-                          cs.date < CURRENT_DATE 
-                          OR (
-                              cs.date = CURRENT_DATE 
-                              AND (
-                                  (cs.period = 1 AND CURRENT_TIME >= TIME '12:00:00')
-                                  OR (cs.period = 2 AND CURRENT_TIME >= TIME '17:00:00')
-                                  OR (cs.period = 3 AND CURRENT_TIME >= TIME '21:00:00')
-                              )
-                          )
-                      )
-                      AND NOT EXISTS (
-                          -- 排除已經處理過的（已經有就診記錄的）
-                          SELECT 1 FROM ENCOUNTER e WHERE e.appt_id = a.appt_id
-                      );
-                    """,
-                )
-                
-                no_show_appointments = cur.fetchall()
-                
-                processed_count = 0
-                for row in no_show_appointments:
-                    patient_id = row["patient_id"]
-                    appt_id = row["appt_id"]
-                    session_id = row["session_id"]
-                    
-                    # 獲取 provider_id
-                    cur.execute(
-                        """
-                        SELECT provider_id FROM CLINIC_SESSION
-                        WHERE session_id = %s;
-                        """,
-                        (session_id,)
-                    )
-                    session_row = cur.fetchone()
-                    if not session_row:
-                        continue
-                    
-                    provider_id = session_row["provider_id"]
-                    
-                    # 檢查是否已經標記為未報到
-                    current_status = AppointmentRepository._get_latest_status(conn, appt_id)
-                    if current_status != 5:  # 如果還不是未報到狀態
-                        # 將掛號狀態更新為「未報到」(5)
-                        AppointmentRepository._insert_status_history(
-                            conn, appt_id, current_status, 5, provider_id
-                        )
-                        
-                        # 累計爽約次數：插入 no_show_event 記錄（避免重複）
-                        from datetime import date, timedelta, datetime
-                        # 檢查是否已經存在記錄
-                        cur.execute(
-                            """
-                            SELECT 1 FROM no_show_event
-                            WHERE patient_id = %s AND appt_id = %s;
-                            """,
-                            (patient_id, appt_id),
-                        )
-                        if not cur.fetchone():
-                            cur.execute(
-                                """
-                                INSERT INTO no_show_event (patient_id, appt_id, recorded_at)
-                                VALUES (%s, %s, %s);
-                                """,
-                                (patient_id, appt_id, datetime.now()),
-                            )
-                        
-                        # 檢查是否需要設置 banned_until
-                        cur.execute(
-                            """
-                            SELECT COUNT(*) AS no_show_count
-                            FROM no_show_event
-                            WHERE patient_id = %s;
-                            """,
-                            (patient_id,),
-                        )
-                        count_row = cur.fetchone()
-                        new_count = count_row["no_show_count"] if count_row else 0
-                        
-                        if new_count >= 3:
-                            banned_until = date.today() + timedelta(days=14)
-                            cur.execute(
-                                """
-                                UPDATE patient
-                                SET banned_until = %s
-                                WHERE user_id = %s
-                                  AND (banned_until IS NULL OR banned_until < %s);
-                                """,
-                                (banned_until, patient_id, banned_until),
-                            )
-                    
-                    processed_count += 1
-                
-                conn.commit()
-                if processed_count > 0:
-                    print(f"✅ 已處理 {processed_count} 個未報到的掛號")
+            from .search import reload_disease_index
+            reload_disease_index()
         except Exception as e:
-            if conn:
-                conn.rollback()
-            print(f"⚠️ 啟動時處理未報到掛號失敗: {e}")
-        finally:
-            if conn:
-                conn.close()
+            print(f"⚠️  疾病搜尋索引建立失敗: {str(e)}")
+
+        # 開啟 asyncio 連線池（供 async 路由使用）
+        from .pg_async import open_async_pool
+        await open_async_pool()
+
+        # 啟動本 worker 的 LISTEN 連線，把門診時段變更分送給 /events 訂閱者
+        from .events import start_event_listener
+        start_event_listener()
     except Exception as e:
         print(f"⚠️ 啟動事件執行失敗: {e}")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """應用程式結束時釋放資源"""
+    from .pg_base import close_pg_pool
+    from .pg_async import close_async_pool
+    from .fanout import shutdown_fanout_executor
+    from .events import stop_event_listener
+    await stop_event_listener()
+    try:
+        from .scheduler import shutdown_scheduler
+        shutdown_scheduler()
+    except ImportError:
+        pass
+    try:
+        from .db_duck import close_duckdb_engine
+        close_duckdb_engine()
+    except ImportError:
+        pass
+    shutdown_fanout_executor()
+    close_pg_pool()
+    await close_async_pool()
+
+
 @app.get("/")
 def root():
     return {"message": "Welcome to Clinic Digital System API"}
 
 
+@app.get("/scheduler/jobs")
+def api_scheduler_jobs():
+    """
+    列出本 worker 的定時任務與執行統計：
+    間隔秒數、下次執行時間、執行／失敗／非 leader 略過次數、平均與最大耗時、最後結果。
+    """
+    try:
+        from .scheduler import get_job_metrics
+    except ImportError:
+        raise HTTPException(status_code=503, detail="APScheduler 未安裝，定時任務未啟用")
+    return get_job_metrics()
+
+
+@app.get("/cache/stats")
+def api_cache_stats():
+    """
+    列出本 worker 各行程內快取的統計：命中／未命中次數與命中率、載入次數、
+    因載入期間被失效而未寫入的次數、失效筆數、目前項目數與 TTL。
+    """
+    from .cache import get_cache_stats
+    return get_cache_stats()
+
+
+def _etag_json_response(request: Request, content, etag: str):
+    """
+    回傳帶 ETag / Cache-Control 的 JSON；
+    瀏覽器帶 If-None-Match 且內容未變時回 304，不傳送內容。
+    """
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={DEPARTMENT_HTTP_MAX_AGE_SECONDS}, must-revalidate",
+    }
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if etag in candidates or "*" in candidates:
+            return Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+
 @app.get("/departments")
-def api_list_departments():
+def api_list_departments(request: Request):
     """
     列出所有部門，包含分類資訊。
     回傳格式：
@@ -205,14 +166,15 @@ def api_list_departments():
       },
       ...
     ]
+    資料來自行程內快取，回應帶 ETag，可用 If-None-Match 重新驗證。
     """
     from .repositories import DepartmentRepository
-    repo = DepartmentRepository()
-    return repo.list_all_departments()
+    catalog = DepartmentRepository.get_catalog()
+    return _etag_json_response(request, catalog["departments"], catalog["etag"])
 
 
 @app.get("/departments/categories")
-def api_list_categories():
+def api_list_categories(request: Request):
     """
     列出所有分類。
     回傳格式：
@@ -220,14 +182,15 @@ def api_list_categories():
       { "category_id": 1, "name": "內科系" },
       ...
     ]
+    資料來自行程內快取，回應帶 ETag，可用 If-None-Match 重新驗證。
     """
     from .repositories import DepartmentRepository
-    repo = DepartmentRepository()
-    return repo.list_all_categories()
+    catalog = DepartmentRepository.get_catalog()
+    return _etag_json_response(request, catalog["categories"], catalog["etag"])
 
 
 @app.get("/departments/by-name")
-def api_get_department_by_name(name: str = Query(...)):
+def api_get_department_by_name(request: Request, name: str = Query(...)):
     """
     根據部門名稱取得部門資訊。
     回傳格式：
@@ -235,11 +198,11 @@ def api_get_department_by_name(name: str = Query(...)):
     如果找不到則回傳 404。
     """
     from .repositories import DepartmentRepository
-    
-    repo = DepartmentRepository()
-    department = repo.get_department_by_name(name)
-    
+
+    catalog = DepartmentRepository.get_catalog()
+    department = catalog["by_name"].get(name)
+
     if department is None:
         raise HTTPException(status_code=404, detail="Department not found")
-    
-    return department
+
+    return _etag_json_response(request, department, catalog["etag"])
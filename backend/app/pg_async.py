@@ -0,0 +1,66 @@
+# pg_async.py
+from contextlib import asynccontextmanager
+
+from psycopg_pool import AsyncConnectionPool
+
+from .config import (
+    PG_DSN,
+    PG_POOL_MIN_SIZE,
+    PG_ASYNC_POOL_MAX_SIZE,
+    PG_POOL_MAX_LIFETIME,
+    PG_POOL_CHECKOUT_TIMEOUT,
+)
+
+_apool = None
+
+
+async def open_async_pool():
+    """
+    建立並開啟全域 asyncio 連線池（psycopg 3）。
+    在 FastAPI startup 事件中呼叫一次；最大連線數為 PG_ASYNC_POOL_MAX_SIZE（與同步連線池分開），
+    最小連線數與存活時間沿用同步連線池的設定。
+    """
+    global _apool
+    if _apool is None:
+        _apool = AsyncConnectionPool(
+            PG_DSN,
+            min_size=min(PG_POOL_MIN_SIZE, PG_ASYNC_POOL_MAX_SIZE),
+            max_size=PG_ASYNC_POOL_MAX_SIZE,
+            max_lifetime=PG_POOL_MAX_LIFETIME,
+            timeout=PG_POOL_CHECKOUT_TIMEOUT,
+            # checkout 時檢查連線是否仍可用
+            check=AsyncConnectionPool.check_connection,
+            open=False,
+        )
+        await _apool.open()
+    return _apool
+
+
+async def close_async_pool():
+    """關閉全域 asyncio 連線池（應用程式 shutdown 時呼叫）"""
+    global _apool
+    if _apool is not None:
+        await _apool.close()
+        _apool = None
+
+
+@asynccontextmanager
+async def pg_aconn():
+    """
+    從 asyncio 連線池借出一條連線：
+        async with pg_aconn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(...)
+            await conn.commit()
+    與 pg_base.pg_conn() 相同：發生例外時先 rollback，未 commit 的變更不會保留。
+    """
+    pool = await open_async_pool()
+    async with pool.connection() as conn:
+        try:
+            yield conn
+        except Exception:
+            await conn.rollback()
+            raise
+        else:
+            # 與同步版一致：只保留明確 commit 的變更
+            await conn.rollback()
@@ -1,13 +1,274 @@
 # pg_base.py
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
 import psycopg2
-from .config import PG_DSN
+from psycopg2 import extensions
+
+from .config import (
+    PG_DSN,
+    PG_POOL_MIN_SIZE,
+    PG_POOL_MAX_SIZE,
+    PG_POOL_MAX_LIFETIME,
+    PG_POOL_HEALTHCHECK_IDLE,
+    PG_POOL_CHECKOUT_TIMEOUT,
+)
 
 
 def get_pg_conn():
     """
-    建立並返回一個 PostgreSQL 連接物件。
+    建立並返回一個「未池化」的 PostgreSQL 連接物件。
+    僅供一次性腳本或需要獨佔連線的情境使用；一般資料存取請改用 pg_conn()。
     注意：如果需要在查詢中使用固定時間，請使用 app_current_date()、app_current_time() 和 app_now()
     而不是 CURRENT_DATE、CURRENT_TIME 和 NOW()
     """
     return psycopg2.connect(PG_DSN)
 
+
+class PoolTimeoutError(Exception):
+    """在 checkout_timeout 內取不到連線（連線池已滿）"""
+
+
+class PgConnectionPool:
+    """
+    執行緒安全的 PostgreSQL 連線池：
+    - min_size / max_size：常駐與上限連線數
+    - max_lifetime：連線存活超過此秒數後，歸還時直接關閉並補新連線
+    - healthcheck_idle：閒置超過此秒數的連線在 checkout 時會先跑 SELECT 1 確認可用
+    - checkout_timeout：池滿時最多等待秒數，超過拋出 PoolTimeoutError
+    """
+
+    def __init__(
+        self,
+        dsn,
+        min_size=1,
+        max_size=10,
+        max_lifetime=1800,
+        healthcheck_idle=30,
+        checkout_timeout=10,
+    ):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError(f"Invalid pool size: min={min_size}, max={max_size}")
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.healthcheck_idle = healthcheck_idle
+        self.checkout_timeout = checkout_timeout
+
+        # 閒置連線：(conn, created_at, last_used_at)，LIFO 取用讓冷連線自然過期
+        self._idle = deque()
+        # conn -> created_at，包含借出中的連線
+        self._created_at = {}
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+
+        for _ in range(min_size):
+            conn = self._connect()
+            self._idle.append((conn, self._created_at[conn], time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(self.dsn)
+        self._created_at[conn] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        self._created_at.pop(conn, None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, created_at):
+        return self.max_lifetime and time.monotonic() - created_at > self.max_lifetime
+
+    def _is_healthy(self, conn, last_used_at):
+        """checkout 時的健康檢查：已關閉或狀態異常直接淘汰，閒置太久則實際 ping 一次"""
+        if conn.closed:
+            return False
+        status = conn.info.transaction_status
+        if status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used_at < self.healthcheck_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1;")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self):
+        """從池中借出一條可用連線（必要時新建）"""
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeoutError("Connection pool is closed")
+                    if self._idle:
+                        candidate = self._idle.pop()
+                        break
+                    if len(self._created_at) < self.max_size:
+                        # 先佔位再連線，避免同時超開
+                        candidate = None
+                        placeholder = object()
+                        self._created_at[placeholder] = time.monotonic()
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeoutError(
+                            f"Timed out after {self.checkout_timeout}s waiting for a PostgreSQL connection "
+                            f"(max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+
+            if candidate is not None:
+                # 健康檢查在鎖外進行，避免 ping 卡住其他執行緒
+                conn, created_at, last_used_at = candidate
+                if self._is_expired(created_at) or not self._is_healthy(conn, last_used_at):
+                    with self._cond:
+                        self._discard(conn)
+                        self._cond.notify()
+                    continue
+                return conn
+
+            try:
+                conn = psycopg2.connect(self.dsn)
+            except Exception:
+                with self._cond:
+                    self._created_at.pop(placeholder, None)
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._created_at.pop(placeholder, None)
+                self._created_at[conn] = time.monotonic()
+            return conn
+
+    def putconn(self, conn):
+        """歸還連線：重置交易狀態，過期或損壞的連線直接關閉"""
+        broken = conn.closed
+        if not broken:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except Exception:
+                broken = True
+
+        with self._cond:
+            created_at = self._created_at.get(conn)
+            if broken or created_at is None or self._closed or self._is_expired(created_at):
+                self._discard(conn)
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """關閉所有閒置連線，並讓之後歸還的連線直接關閉"""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                conn, _, _ = self._idle.pop()
+                self._discard(conn)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": len(self._created_at),
+                "idle": len(self._idle),
+                "in_use": len(self._created_at) - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# thread id -> 該執行緒目前借出的連線（供 cancel_thread_queries 從其他執行緒取消查詢）
+_active_conns = {}
+_active_conns_lock = threading.Lock()
+
+
+def get_pg_pool():
+    """取得（必要時延遲建立）全域連線池"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PgConnectionPool(
+                    PG_DSN,
+                    min_size=PG_POOL_MIN_SIZE,
+                    max_size=PG_POOL_MAX_SIZE,
+                    max_lifetime=PG_POOL_MAX_LIFETIME,
+                    healthcheck_idle=PG_POOL_HEALTHCHECK_IDLE,
+                    checkout_timeout=PG_POOL_CHECKOUT_TIMEOUT,
+                )
+    return _pool
+
+
+def close_pg_pool():
+    """關閉全域連線池（應用程式 shutdown 時呼叫）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def pg_conn():
+    """
+    從連線池借出一條連線：
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                ...
+            conn.commit()
+    離開 with 區塊時自動歸還；發生例外時先 rollback，未 commit 的變更一律丟棄（與 close() 行為一致）。
+    """
+    pool = get_pg_pool()
+    conn = pool.getconn()
+    thread_id = threading.get_ident()
+    with _active_conns_lock:
+        _active_conns.setdefault(thread_id, []).append(conn)
+    try:
+        yield conn
+    except Exception:
+        if not conn.closed:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+        raise
+    finally:
+        with _active_conns_lock:
+            conns = _active_conns.get(thread_id)
+            if conns is not None:
+                conns.remove(conn)
+                if not conns:
+                    del _active_conns[thread_id]
+        pool.putconn(conn)
+
+
+def cancel_thread_queries(thread_id):
+    """
+    取消指定執行緒透過 pg_conn() 借出的連線上正在執行的查詢（psycopg2 connection.cancel，可跨執行緒呼叫）。
+    被取消的查詢會在原執行緒拋出 psycopg2.errors.QueryCanceled。回傳送出取消請求的連線數。
+    """
+    with _active_conns_lock:
+        conns = list(_active_conns.get(thread_id, ()))
+    cancelled = 0
+    for conn in conns:
+        try:
+            if not conn.closed:
+                conn.cancel()
+                cancelled += 1
+        except Exception:
+            pass
+    return cancelled
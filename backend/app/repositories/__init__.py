@@ -9,6 +9,11 @@ from .prescription_repo import PrescriptionRepository
 from .lab_result_repo import LabResultRepository
 from .payment_repo import PaymentRepository
 from .department_repo import DepartmentRepository
+from .history_repo import PatientHistoryRepository
+from .export_repo import ExportRepository
+from .patient_stats_repo import PatientStatsRepository
+from .idempotency_repo import IdempotencyRepository
+from .notification_repo import NotificationRepository
 
 __all__ = [
     "PatientRepository",
@@ -21,5 +26,10 @@ __all__ = [
     "LabResultRepository",
     "PaymentRepository",
     "DepartmentRepository",
+    "PatientHistoryRepository",
+    "ExportRepository",
+    "PatientStatsRepository",
+    "IdempotencyRepository",
+    "NotificationRepository",
 ]
 
@@ -0,0 +1,12 @@
+# repositories/aio：與同步 repository 相同契約的 asyncio 版本（psycopg 3 + AsyncConnectionPool）
+from .session_repo import AsyncSessionRepository
+from .appointment_repo import AsyncAppointmentRepository
+from .patient_repo import AsyncPatientRepository
+from .idempotency_repo import AsyncIdempotencyRepository
+
+__all__ = [
+    "AsyncSessionRepository",
+    "AsyncAppointmentRepository",
+    "AsyncPatientRepository",
+    "AsyncIdempotencyRepository",
+]
@@ -0,0 +1,200 @@
+# repositories/aio/appointment_repo.py
+from datetime import datetime
+
+from psycopg.rows import dict_row
+
+from ...config import WAITLIST_MAX_SIZE
+from ...events import anotify_session_changes
+from ...pg_async import pg_aconn
+from ...lib.period_utils import period_to_end_time
+
+
+class AsyncAppointmentRepository:
+    """AppointmentRepository 的 asyncio 版本（掛號寫入路徑），錯誤訊息與同步版相同"""
+
+    @staticmethod
+    async def create_appointment(patient_id, session_id, join_waitlist=True):
+        """
+        建立單筆掛號（一筆的 create_appointments_batch），失敗時拋出與同步版相同的錯誤。
+        熱門門診請改走 app.booking.booking_engine，同一 session 的請求會合併成一批。
+        """
+        result = (
+            await AsyncAppointmentRepository.create_appointments_batch(session_id, [(patient_id, join_waitlist)])
+        )[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    @staticmethod
+    async def create_appointments_batch(session_id, requests):
+        """
+        在單一交易中為同一門診時段建立一批掛號（見 app.booking.BookingEngine）：
+        - requests 為 [(patient_id, join_waitlist), ...]
+        - 整批只鎖定 CLINIC_SESSION 一次（FOR UPDATE），之後的檢查與寫入都在鎖內
+        - 依 requests 順序檢查重複掛號與剩餘名額；額滿後 join_waitlist 的請求加入候補（狀態 6，
+          最多 WAITLIST_MAX_SIZE 人），其餘回傳 "Session is full"
+        - slot_seq（含候補）從 CLINIC_SESSION.next_slot_seq 計數器連續配發，候補依 slot_seq 先來後到
+        - 以 UNNEST 批次寫入 APPOINTMENT 與狀態歷史，booked_count 一次加上已預約筆數
+        回傳與 requests 同順序的 list，元素為掛號 dict（含 status，候補另含 waitlist_position）
+        或 Exception（訊息與同步版相同）。
+        """
+        async with pg_aconn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(
+                    """
+                    SELECT capacity, booked_count, next_slot_seq, provider_id, date, period, status
+                    FROM CLINIC_SESSION
+                    WHERE session_id = %s
+                    FOR UPDATE;
+                    """,
+                    (session_id,),
+                )
+                session_row = await cur.fetchone()
+                if session_row is None:
+                    return [Exception("Session not found") for _ in requests]
+
+                # status: 1 = open, 2 = closed
+                if session_row["status"] == 2:
+                    return [Exception("Session is cancelled") for _ in requests]
+
+                # 檢查是否已過門診時間
+                end_time = period_to_end_time(session_row["period"])
+                if datetime.now() > datetime.combine(session_row["date"], end_time):
+                    return [Exception("Session has ended, cannot book appointment") for _ in requests]
+
+                # 這批病人在該 session 已有的掛號記錄（包括已取消的）；session 已鎖定，不會與其他批次交錯
+                await cur.execute(
+                    """
+                    SELECT a.appt_id, a.patient_id, a.current_status
+                    FROM APPOINTMENT a
+                    WHERE a.session_id = %s
+                      AND a.patient_id = ANY(%s);
+                    """,
+                    (session_id, list({patient_id for patient_id, _ in requests})),
+                )
+                existing = {row["patient_id"]: row for row in await cur.fetchall()}
+
+                results = [None] * len(requests)
+                # 已預約人數由狀態變更時維護（排除已取消、候補的掛號），不需再做 COUNT
+                remaining = session_row["capacity"] - session_row["booked_count"]
+                next_slot_seq = session_row["next_slot_seq"]
+                # 目前候補人數：第一次有請求需要候補時才查詢
+                waitlist_size = None
+                # patient_id -> (既有掛號 appt_id 或 None, slot_seq, 初始狀態, 候補順位)
+                accepted = {}
+                for i, (patient_id, join_waitlist) in enumerate(requests):
+                    existing_appt = existing.get(patient_id)
+                    # 已有非取消狀態的掛號（4 = cancelled，含候補中），或同一批內重複送出
+                    if patient_id in accepted or (
+                        existing_appt is not None and existing_appt["current_status"] != 4
+                    ):
+                        results[i] = Exception("無法重複預約同一門診")
+                        continue
+                    if remaining > 0:
+                        remaining -= 1
+                        to_status, waitlist_position = 1, None
+                    else:
+                        if join_waitlist and waitlist_size is None:
+                            await cur.execute(
+                                "SELECT COUNT(*) AS n FROM APPOINTMENT WHERE session_id = %s AND current_status = 6;",
+                                (session_id,),
+                            )
+                            waitlist_size = (await cur.fetchone())["n"]
+                        if not join_waitlist or waitlist_size >= WAITLIST_MAX_SIZE:
+                            results[i] = Exception("Session is full")
+                            continue
+                        waitlist_size += 1
+                        to_status, waitlist_position = 6, waitlist_size
+                    accepted[patient_id] = (
+                        existing_appt["appt_id"] if existing_appt is not None else None,
+                        next_slot_seq,
+                        to_status,
+                        waitlist_position,
+                    )
+                    next_slot_seq += 1
+
+                if not accepted:
+                    return results
+
+                # 重新啟用已取消的掛號 (appt_id, slot_seq) 與新掛號 (patient_id, slot_seq)
+                reactivated = [(appt_id, seq) for appt_id, seq, _, _ in accepted.values() if appt_id is not None]
+                created = [
+                    (patient_id, seq)
+                    for patient_id, (appt_id, seq, _, _) in accepted.items()
+                    if appt_id is None
+                ]
+                appts = []
+                if reactivated:
+                    await cur.execute(
+                        """
+                        UPDATE APPOINTMENT a
+                        SET slot_seq = t.slot_seq
+                        FROM UNNEST(%s::int[], %s::int[]) AS t(appt_id, slot_seq)
+                        WHERE a.appt_id = t.appt_id
+                        RETURNING a.appt_id, a.patient_id, a.session_id, a.slot_seq;
+                        """,
+                        ([appt_id for appt_id, _ in reactivated], [seq for _, seq in reactivated]),
+                    )
+                    appts.extend(await cur.fetchall())
+                if created:
+                    await cur.execute(
+                        """
+                        INSERT INTO APPOINTMENT (patient_id, session_id, slot_seq)
+                        SELECT t.patient_id, %s, t.slot_seq
+                        FROM UNNEST(%s::int[], %s::int[]) AS t(patient_id, slot_seq)
+                        RETURNING appt_id, patient_id, session_id, slot_seq;
+                        """,
+                        (session_id, [pid for pid, _ in created], [seq for _, seq in created]),
+                    )
+                    appts.extend(await cur.fetchall())
+
+                # 與 AppointmentRepository._bulk_insert_status_history 相同：寫入歷史並同步 current_status；
+                # 已取消（4）與新建立（None）的掛號改為 1（已預約）或 6（候補），
+                # 已預約的名額與計數器在同一個 statement 內一次更新
+                # changed_by 必須是 provider_id，因為外鍵約束指向 provider 表
+                appt_ids = [appt["appt_id"] for appt in appts]
+                from_statuses = [
+                    4 if accepted[appt["patient_id"]][0] is not None else None for appt in appts
+                ]
+                to_statuses = [accepted[appt["patient_id"]][2] for appt in appts]
+                await cur.execute(
+                    """
+                    WITH ins AS (
+                        INSERT INTO APPOINTMENT_STATUS_HISTORY (
+                            appt_id, from_status, to_status, changed_by, changed_at
+                        )
+                        SELECT t.appt_id, t.from_status, t.to_status, %s, NOW()
+                        FROM UNNEST(%s::int[], %s::int[], %s::int[]) AS t(appt_id, from_status, to_status)
+                        RETURNING appt_id, to_status, changed_at
+                    ), upd AS (
+                        UPDATE APPOINTMENT a
+                        SET current_status = ins.to_status,
+                            status_changed_at = ins.changed_at
+                        FROM ins
+                        WHERE a.appt_id = ins.appt_id
+                        RETURNING a.current_status
+                    )
+                    UPDATE CLINIC_SESSION cs
+                    SET booked_count = cs.booked_count + (SELECT COUNT(*) FROM upd WHERE upd.current_status = 1),
+                        next_slot_seq = %s
+                    WHERE cs.session_id = %s;
+                    """,
+                    (
+                        session_row["provider_id"], appt_ids, from_statuses, to_statuses,
+                        next_slot_seq, session_id,
+                    ),
+                )
+                # 與 _insert_status_history 相同：整批只送出一次門診時段變更通知
+                await anotify_session_changes(conn, [session_id])
+
+                await conn.commit()
+
+                by_patient = {appt["patient_id"]: appt for appt in appts}
+                for i, (patient_id, _) in enumerate(requests):
+                    if results[i] is None:
+                        _, _, to_status, waitlist_position = accepted[patient_id]
+                        appt = dict(by_patient[patient_id], status=to_status)
+                        if waitlist_position is not None:
+                            appt["waitlist_position"] = waitlist_position
+                        results[i] = appt
+                return results
@@ -0,0 +1,88 @@
+# repositories/aio/idempotency_repo.py
+import uuid
+
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+
+from ...pg_async import pg_aconn
+
+
+class AsyncIdempotencyRepository:
+    """IdempotencyRepository 的 asyncio 版本（建立掛號路徑），SQL 與同步版相同"""
+
+    @staticmethod
+    async def get_key(patient_id, idem_key):
+        """讀取未過期的冪等鍵（主鍵查詢），不存在或已過期時回傳 None"""
+        async with pg_aconn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(
+                    """
+                    SELECT operation, request_fingerprint, status_code, response
+                    FROM IDEMPOTENCY_KEY
+                    WHERE patient_id = %s
+                      AND idem_key = %s
+                      AND expires_at > NOW();
+                    """,
+                    (patient_id, idem_key),
+                )
+                return await cur.fetchone()
+
+    @staticmethod
+    async def claim_key(patient_id, idem_key, operation, request_fingerprint, ttl_seconds, lease_seconds):
+        """佔用冪等鍵：鍵不存在、已過期或處理中超過租約時回傳 claim_token，已被其他請求佔用回傳 None"""
+        claim_token = str(uuid.uuid4())
+        async with pg_aconn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO IDEMPOTENCY_KEY (
+                        patient_id, idem_key, operation, request_fingerprint, claim_token, expires_at
+                    )
+                    VALUES (%s, %s, %s, %s, %s::uuid, NOW() + %s * INTERVAL '1 second')
+                    ON CONFLICT (patient_id, idem_key) DO UPDATE SET
+                        operation = EXCLUDED.operation,
+                        request_fingerprint = EXCLUDED.request_fingerprint,
+                        status_code = NULL,
+                        response = NULL,
+                        claim_token = EXCLUDED.claim_token,
+                        created_at = NOW(),
+                        expires_at = EXCLUDED.expires_at
+                    WHERE IDEMPOTENCY_KEY.expires_at <= NOW()
+                       OR (
+                           IDEMPOTENCY_KEY.status_code IS NULL
+                           AND IDEMPOTENCY_KEY.created_at < NOW() - %s * INTERVAL '1 second'
+                       )
+                    RETURNING patient_id;
+                    """,
+                    (patient_id, idem_key, operation, request_fingerprint, claim_token, ttl_seconds, lease_seconds),
+                )
+                claimed = await cur.fetchone() is not None
+            await conn.commit()
+            return claim_token if claimed else None
+
+    @staticmethod
+    async def save_response(patient_id, idem_key, claim_token, status_code, response):
+        """記錄第一次請求的回應（response 須可轉成 JSON）；鍵已被其他請求接手時不寫入"""
+        async with pg_aconn() as conn:
+            await conn.execute(
+                """
+                UPDATE IDEMPOTENCY_KEY
+                SET status_code = %s, response = %s
+                WHERE patient_id = %s AND idem_key = %s AND claim_token = %s::uuid;
+                """,
+                (status_code, Jsonb(response), patient_id, idem_key, claim_token),
+            )
+            await conn.commit()
+
+    @staticmethod
+    async def release_key(patient_id, idem_key, claim_token):
+        """第一次請求發生非預期錯誤或被取消時釋放鍵，讓重送可以重新執行；鍵已被其他請求接手時不刪除"""
+        async with pg_aconn() as conn:
+            await conn.execute(
+                """
+                DELETE FROM IDEMPOTENCY_KEY
+                WHERE patient_id = %s AND idem_key = %s AND claim_token = %s::uuid AND status_code IS NULL;
+                """,
+                (patient_id, idem_key, claim_token),
+            )
+            await conn.commit()
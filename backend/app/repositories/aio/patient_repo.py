@@ -0,0 +1,64 @@
+# repositories/aio/patient_repo.py
+from datetime import date, timedelta
+
+from psycopg.rows import dict_row
+
+from ...pg_async import pg_aconn
+
+
+class AsyncPatientRepository:
+    """PatientRepository 的 asyncio 版本（掛號前的停權檢查）"""
+
+    @staticmethod
+    async def is_patient_banned(patient_id):
+        """
+        檢查病人是否被禁止掛號（達到三次爽約且在兩週內）。
+        從 no_show_event 表計算爽約次數。
+        回傳 (is_banned, banned_until) 元組。
+        """
+        async with pg_aconn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(
+                    """
+                    SELECT
+                        COUNT(*) AS no_show_count,
+                        p.banned_until
+                    FROM patient p
+                    LEFT JOIN no_show_event n ON n.patient_id = p.user_id
+                    WHERE p.user_id = %s
+                    GROUP BY p.user_id, p.banned_until;
+                    """,
+                    (patient_id,),
+                )
+                row = await cur.fetchone()
+                if row is None:
+                    return False, None
+
+                no_show_count = row["no_show_count"] or 0
+                banned_until = row["banned_until"]
+
+                # 如果未達到三次爽約，直接返回
+                if no_show_count < 3:
+                    return False, None
+
+                # 如果 banned_until 為空，設置為兩週後
+                if banned_until is None:
+                    banned_until = date.today() + timedelta(days=14)
+                    await cur.execute(
+                        "UPDATE patient SET banned_until = %s WHERE user_id = %s;",
+                        (banned_until, patient_id),
+                    )
+                    await conn.commit()
+                    return True, banned_until
+
+                # 檢查是否還在禁止期內
+                if date.today() <= banned_until:
+                    return True, banned_until
+
+                # 禁止期已過，清除禁止日期（但保留 no_show_event 記錄）
+                await cur.execute(
+                    "UPDATE patient SET banned_until = NULL WHERE user_id = %s;",
+                    (patient_id,),
+                )
+                await conn.commit()
+                return False, None
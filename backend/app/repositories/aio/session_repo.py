@@ -0,0 +1,162 @@
+# repositories/aio/session_repo.py
+from psycopg.rows import dict_row
+
+from ...pg_async import pg_aconn
+from ..session_repo import (
+    session_ended_sql,
+    effective_status_sql,
+    session_search_cache,
+    session_search_tags,
+)
+from ...lib.period_utils import period_to_start_time, period_to_end_time
+
+
+class AsyncSessionRepository:
+    """SessionRepository 的 asyncio 版本（查詢門診時段），回傳格式與同步版相同"""
+
+    @staticmethod
+    async def get_session_by_id(session_id):
+        """
+        根據 session_id 取得門診時段資訊，包含 provider 和 department 資訊。
+        已過結束時間的 session 以 status = 2（停診）回傳（依條件判斷，不在讀取時寫入）。
+        status: 1 = open (開診), 2 = closed (停診)
+        """
+        async with pg_aconn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                await cur.execute(
+                    f"""
+                    SELECT
+                        cs.session_id,
+                        cs.provider_id,
+                        cs.date,
+                        cs.period,
+                        cs.capacity,
+                        {effective_status_sql('cs')} AS status,
+                        pr.dept_id,
+                        u.name AS provider_name,
+                        pr.license_no,
+                        d.name AS dept_name,
+                        d.location AS department_location
+                    FROM CLINIC_SESSION cs
+                    JOIN PROVIDER pr ON cs.provider_id = pr.user_id
+                    JOIN "USER" u ON pr.user_id = u.user_id
+                    LEFT JOIN DEPARTMENT d ON pr.dept_id = d.dept_id
+                    WHERE cs.session_id = %s;
+                    """,
+                    (session_id,),
+                )
+                row = await cur.fetchone()
+                # 添加計算的 start_time 和 end_time（用於向後兼容）
+                if row:
+                    row["start_time"] = period_to_start_time(row["period"])
+                    row["end_time"] = period_to_end_time(row["period"])
+                return row
+
+    @staticmethod
+    async def get_booked_count(session_id):
+        """
+        取得某個門診時段的已預約數量（排除已取消的掛號），讀取 CLINIC_SESSION.booked_count。
+        如果 session 不存在，回傳 None。
+        """
+        async with pg_aconn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "SELECT booked_count FROM CLINIC_SESSION WHERE session_id = %s;",
+                    (session_id,),
+                )
+                row = await cur.fetchone()
+                return row[0] if row else None
+
+    @staticmethod
+    async def get_remaining_capacity(session_id):
+        """
+        取得某個門診時段的剩餘容量。
+        回傳：capacity - booked_count
+        """
+        async with pg_aconn() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    SELECT capacity, booked_count
+                    FROM CLINIC_SESSION
+                    WHERE session_id = %s;
+                    """,
+                    (session_id,),
+                )
+                row = await cur.fetchone()
+                if row:
+                    capacity = row[0]
+                    booked_count = row[1] if row[1] else 0
+                    return max(0, capacity - booked_count)
+                return None
+
+    @staticmethod
+    async def search_sessions(dept_id=None, provider_id=None, date_=None):
+        """
+        搜尋門診時段，可根據科別、醫師、日期過濾。
+        回傳每個 session 的資訊，包含 provider 和 department 資訊，以及已預約人數。
+        已過結束時間的 session 依條件排除（不在讀取時寫入，status 由背景排程更新）。
+        與同步版共用 session_search_cache，同一個 key 同時只有一個 task 查詢資料庫。
+        """
+        return await session_search_cache.aget_or_load(
+            (dept_id, provider_id, date_),
+            lambda: AsyncSessionRepository._load_search_sessions(dept_id, provider_id, date_),
+            tags=session_search_tags(dept_id, provider_id),
+        )
+
+    @staticmethod
+    async def _load_search_sessions(dept_id, provider_id, date_):
+        """search_sessions 的資料庫查詢（不經過快取）"""
+        async with pg_aconn() as conn:
+            async with conn.cursor(row_factory=dict_row) as cur:
+                conditions = []
+                params = []
+
+                # 只顯示正常狀態的門診（status = 1），不顯示已停診或已過結束時間的門診
+                conditions.append("cs.status = 1")
+                conditions.append(f"NOT {session_ended_sql('cs')}")
+
+                if dept_id is not None:
+                    conditions.append("pr.dept_id = %s")
+                    params.append(dept_id)
+
+                if provider_id is not None:
+                    conditions.append("cs.provider_id = %s")
+                    params.append(provider_id)
+
+                if date_ is not None:
+                    conditions.append("cs.date = %s")
+                    params.append(date_)
+
+                where_clause = " AND ".join(conditions)
+
+                await cur.execute(
+                    f"""
+                    SELECT
+                        cs.session_id,
+                        cs.provider_id,
+                        cs.date,
+                        cs.period,
+                        cs.capacity,
+                        cs.status,
+                        pr.dept_id,
+                        u.name AS provider_name,
+                        pr.license_no,
+                        d.name AS dept_name,
+                        COALESCE(d.location, '') AS department_location,
+                        cs.booked_count
+                    FROM CLINIC_SESSION cs
+                    JOIN PROVIDER pr ON cs.provider_id = pr.user_id
+                    JOIN "USER" u ON pr.user_id = u.user_id
+                    LEFT JOIN DEPARTMENT d ON pr.dept_id = d.dept_id
+                    WHERE {where_clause}
+                    ORDER BY cs.date, cs.period;
+                    """,
+                    params,
+                )
+                rows = await cur.fetchall()
+                # 為每個 session 添加計算的 start_time 和 end_time（用於向後兼容）
+                for row in rows:
+                    row["start_time"] = period_to_start_time(row["period"])
+                    row["end_time"] = period_to_end_time(row["period"])
+                return rows
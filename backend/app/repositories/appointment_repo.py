@@ -1,49 +1,333 @@
 # repositories/appointment_repo.py
 from psycopg2.extras import RealDictCursor
-from ..pg_base import get_pg_conn
+from ..config import WAITLIST_MAX_SIZE
+from ..events import notify_session_changes
+from ..pg_base import pg_conn
+
+# 不佔用門診名額的掛號狀態（4 = 已取消、6 = 候補）；CLINIC_SESSION.booked_count 只計算其他狀態
+NON_OCCUPYING_STATUSES = (4, 6)
 
 
 class AppointmentRepository:
     """處理掛號（APPOINTMENT）相關的資料庫操作"""
 
+    @staticmethod
+    def _occupies_slot(status):
+        """該狀態是否佔用門診名額（None 表示掛號尚未建立）"""
+        return status is not None and status not in NON_OCCUPYING_STATUSES
+
+    @staticmethod
+    def _frees_slot(from_status, to_status):
+        """狀態變更是否釋出門診名額（釋出後應在同一交易中呼叫 _promote_waitlist）"""
+        return (
+            AppointmentRepository._occupies_slot(from_status)
+            and not AppointmentRepository._occupies_slot(to_status)
+        )
+
+    @staticmethod
+    def _check_not_waitlisted(from_status, to_status):
+        """候補（6）只能由遞補改為已預約，不能直接報到、完成或過號"""
+        if from_status == 6 and AppointmentRepository._occupies_slot(to_status):
+            raise Exception("Appointment is waitlisted")
+
     @staticmethod
     def _get_latest_status(conn, appt_id):
-        """取得掛號的最新狀態（內部輔助方法）"""
+        """
+        取得掛號的最新狀態並鎖定（內部輔助方法，之後須在同一交易中呼叫 _insert_status_history）。
+        讀取 APPOINTMENT.current_status（由 _insert_status_history 維護），不再掃描狀態歷史表。
+        與 create／modify 相同的鎖序：先鎖該掛號的 CLINIC_SESSION，再鎖 APPOINTMENT（FOR UPDATE），
+        同一筆掛號的併行狀態變更（例如重複送出取消）會依序執行，後到的讀到前一筆 commit 後的狀態，
+        booked_count 不會被重複增減。
+        """
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
                 """
-                SELECT to_status
-                FROM APPOINTMENT_STATUS_HISTORY
+                SELECT cs.session_id
+                FROM CLINIC_SESSION cs
+                WHERE cs.session_id = (SELECT session_id FROM APPOINTMENT WHERE appt_id = %s)
+                FOR UPDATE;
+                """,
+                (appt_id,),
+            )
+            cur.execute(
+                """
+                SELECT current_status
+                FROM APPOINTMENT
                 WHERE appt_id = %s
-                ORDER BY changed_at DESC
-                LIMIT 1;
+                FOR UPDATE;
                 """,
                 (appt_id,),
             )
             row = cur.fetchone()
-            return row["to_status"] if row is not None else None
+            return row["current_status"] if row is not None else None
 
     @staticmethod
     def _insert_status_history(conn, appt_id, from_status, to_status, changed_by):
-        """插入狀態歷史記錄（內部輔助方法）"""
+        """
+        插入狀態歷史記錄（內部輔助方法）。
+        同一個 statement 內一併更新：
+        - APPOINTMENT.current_status / status_changed_at
+        - CLINIC_SESSION.booked_count（依 from_status → to_status 是否佔用名額增減）
+        讓反正規化欄位與歷史表在同一交易中保持一致，並送出門診時段變更通知（commit 後送達 /events 訂閱者）。
+        所有狀態變更都必須經過此方法，不可直接 INSERT 狀態歷史；
+        from_status 必須是掛號目前的狀態（在同一交易中鎖定後讀取），新建立的掛號傳 None。
+        掛號目前的狀態與 from_status 不符時（併行修改）拋出例外，呼叫端應 rollback。
+        """
+        delta = (
+            int(AppointmentRepository._occupies_slot(to_status))
+            - int(AppointmentRepository._occupies_slot(from_status))
+        )
+        # 只在掛號仍是 from_status 時更新（新建立的掛號 current_status 為欄位預設值，不檢查）
+        if from_status is None:
+            status_guard_sql = ""
+            guard_params = ()
+        else:
+            status_guard_sql = "AND a.current_status = %s"
+            guard_params = (from_status,)
+        with conn.cursor() as cur:
+            if delta == 0:
+                cur.execute(
+                    f"""
+                    WITH ins AS (
+                        INSERT INTO APPOINTMENT_STATUS_HISTORY (
+                            appt_id, from_status, to_status, changed_by, changed_at
+                        )
+                        VALUES (%s, %s, %s, %s, NOW())
+                        RETURNING appt_id, to_status, changed_at
+                    )
+                    UPDATE APPOINTMENT a
+                    SET current_status = ins.to_status,
+                        status_changed_at = ins.changed_at
+                    FROM ins
+                    WHERE a.appt_id = ins.appt_id
+                      {status_guard_sql}
+                    RETURNING a.session_id;
+                    """,
+                    (appt_id, from_status, to_status, changed_by, *guard_params),
+                )
+            else:
+                cur.execute(
+                    f"""
+                    WITH ins AS (
+                        INSERT INTO APPOINTMENT_STATUS_HISTORY (
+                            appt_id, from_status, to_status, changed_by, changed_at
+                        )
+                        VALUES (%s, %s, %s, %s, NOW())
+                        RETURNING appt_id, to_status, changed_at
+                    ), upd AS (
+                        UPDATE APPOINTMENT a
+                        SET current_status = ins.to_status,
+                            status_changed_at = ins.changed_at
+                        FROM ins
+                        WHERE a.appt_id = ins.appt_id
+                          {status_guard_sql}
+                        RETURNING a.session_id
+                    )
+                    UPDATE CLINIC_SESSION cs
+                    SET booked_count = cs.booked_count + %s
+                    FROM upd
+                    WHERE cs.session_id = upd.session_id
+                    RETURNING cs.session_id;
+                    """,
+                    (appt_id, from_status, to_status, changed_by, *guard_params, delta),
+                )
+            session_ids = [row[0] for row in cur.fetchall()]
+            if not session_ids:
+                raise Exception(f"Appointment {appt_id} status changed concurrently (expected {from_status})")
+            notify_session_changes(conn, session_ids)
+
+    @staticmethod
+    def _bulk_insert_status_history(conn, transitions, to_status, changed_by):
+        """
+        批次版 _insert_status_history（內部輔助方法）：
+        transitions 為 [(appt_id, from_status), ...]，全部改為 to_status。
+        單一 statement 寫入所有狀態歷史、同步 current_status，並依 session 彙總調整 booked_count；
+        涉及的每個門診時段各送出一次變更通知。
+        """
+        if not transitions:
+            return
+        appt_ids = [appt_id for appt_id, _ in transitions]
+        from_statuses = [from_status for _, from_status in transitions]
+        deltas = [
+            int(AppointmentRepository._occupies_slot(to_status))
+            - int(AppointmentRepository._occupies_slot(from_status))
+            for _, from_status in transitions
+        ]
         with conn.cursor() as cur:
             cur.execute(
                 """
-                INSERT INTO APPOINTMENT_STATUS_HISTORY (
-                    appt_id, from_status, to_status, changed_by, changed_at
+                WITH t AS (
+                    SELECT *
+                    FROM UNNEST(%s::int[], %s::int[], %s::int[]) AS t(appt_id, from_status, delta)
+                ), ins AS (
+                    INSERT INTO APPOINTMENT_STATUS_HISTORY (
+                        appt_id, from_status, to_status, changed_by, changed_at
+                    )
+                    SELECT t.appt_id, t.from_status, %s, %s, NOW()
+                    FROM t
+                    RETURNING appt_id, to_status, changed_at
+                ), upd AS (
+                    UPDATE APPOINTMENT a
+                    SET current_status = ins.to_status,
+                        status_changed_at = ins.changed_at
+                    FROM ins
+                    WHERE a.appt_id = ins.appt_id
+                    RETURNING a.appt_id, a.session_id
+                ), counted AS (
+                    UPDATE CLINIC_SESSION cs
+                    SET booked_count = cs.booked_count + moved.delta
+                    FROM (
+                        SELECT upd.session_id, SUM(t.delta) AS delta
+                        FROM upd
+                        JOIN t ON t.appt_id = upd.appt_id
+                        GROUP BY upd.session_id
+                        HAVING SUM(t.delta) <> 0
+                    ) AS moved
+                    WHERE cs.session_id = moved.session_id
                 )
-                VALUES (%s, %s, %s, %s, NOW());
+                SELECT DISTINCT upd.session_id
+                FROM upd;
+                """,
+                (appt_ids, from_statuses, deltas, to_status, changed_by),
+            )
+            notify_session_changes(conn, [row[0] for row in cur.fetchall()])
+
+    @staticmethod
+    def _move_booked_count(conn, from_session_id, to_session_id):
+        """
+        佔用名額的掛號從一個 session 移到另一個 session 時，
+        同步調整兩邊的 CLINIC_SESSION.booked_count（內部輔助方法）。
+        呼叫前兩個 session 應已依 session_id 順序鎖定。
+        """
+        if from_session_id == to_session_id:
+            return
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE CLINIC_SESSION
+                SET booked_count = booked_count + CASE WHEN session_id = %s THEN 1 ELSE -1 END
+                WHERE session_id IN (%s, %s);
+                """,
+                (to_session_id, from_session_id, to_session_id),
+            )
+
+    @staticmethod
+    def _take_slot_seq(conn, session_id):
+        """
+        從 CLINIC_SESSION.next_slot_seq 計數器取一個 slot_seq（內部輔助方法）。
+        計數器只增不減，取消後再掛號不會拿到與既有掛號相同的序號；
+        呼叫前該 session 應已鎖定（FOR UPDATE）。
+        """
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE CLINIC_SESSION
+                SET next_slot_seq = next_slot_seq + 1
+                WHERE session_id = %s
+                RETURNING next_slot_seq - 1;
+                """,
+                (session_id,),
+            )
+            return cur.fetchone()[0]
+
+    @staticmethod
+    def _promote_waitlist(conn, session_id):
+        """
+        候補遞補（內部輔助方法，不 commit）：
+        門診時段有空出的名額時，依 slot_seq（加入候補的順序）把最前面的候補（6）改為已預約（1），
+        並為每位遞補的病人寫入一筆通知事件（PATIENT_NOTIFICATION，event_type = 'waitlist_promoted'）。
+        在釋出名額的同一交易中呼叫，回傳遞補的掛號 [{appt_id, patient_id, slot_seq}]。
+        """
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT capacity - booked_count AS free_slots, provider_id, status
+                FROM CLINIC_SESSION
+                WHERE session_id = %s
+                FOR UPDATE;
+                """,
+                (session_id,),
+            )
+            session_row = cur.fetchone()
+            # status: 1 = open, 2 = closed
+            if session_row is None or session_row["status"] == 2 or session_row["free_slots"] <= 0:
+                return []
+
+            cur.execute(
+                """
+                SELECT appt_id, patient_id, slot_seq
+                FROM APPOINTMENT
+                WHERE session_id = %s
+                  AND current_status = 6
+                ORDER BY slot_seq, appt_id
+                LIMIT %s
+                FOR UPDATE;
+                """,
+                (session_id, session_row["free_slots"]),
+            )
+            promoted = cur.fetchall()
+            if not promoted:
+                return []
+
+            # 6 → 1 由 _bulk_insert_status_history 一併增加 booked_count
+            AppointmentRepository._bulk_insert_status_history(
+                conn, [(appt["appt_id"], 6) for appt in promoted], 1, session_row["provider_id"]
+            )
+            cur.execute(
+                """
+                INSERT INTO PATIENT_NOTIFICATION (patient_id, appt_id, event_type, payload)
+                SELECT
+                    t.patient_id, t.appt_id, 'waitlist_promoted',
+                    jsonb_build_object('session_id', %s, 'slot_seq', t.slot_seq)
+                FROM UNNEST(%s::bigint[], %s::int[], %s::int[]) AS t(patient_id, appt_id, slot_seq);
+                """,
+                (
+                    session_id,
+                    [appt["patient_id"] for appt in promoted],
+                    [appt["appt_id"] for appt in promoted],
+                    [appt["slot_seq"] for appt in promoted],
+                ),
+            )
+        return promoted
+
+    @staticmethod
+    def _count_waitlist(conn, session_id):
+        """門診時段目前的候補人數（內部輔助方法）"""
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT COUNT(*)
+                FROM APPOINTMENT
+                WHERE session_id = %s AND current_status = 6;
+                """,
+                (session_id,),
+            )
+            return cur.fetchone()[0]
+
+    @staticmethod
+    def _get_appointment_session(conn, appt_id):
+        """
+        在既有連線上取得掛號所屬的 session_id 與該 session 的 provider_id（內部輔助方法）。
+        交易中請使用此方法，避免再向連線池借第二條連線。
+        """
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """
+                SELECT a.session_id, cs.provider_id
+                FROM APPOINTMENT a
+                JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+                WHERE a.appt_id = %s;
                 """,
-                (appt_id, from_status, to_status, changed_by),
+                (appt_id,),
             )
+            return cur.fetchone()
 
     @staticmethod
     def get_appointment_by_id(appt_id):
         """
         根據 appt_id 取得掛號資訊，包含 patient_id。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -51,26 +335,24 @@ class AppointmentRepository:
                         a.appt_id,
                         a.slot_seq,
                         a.patient_id,
-                        a.session_id
+                        a.session_id,
+                        a.current_status
                     FROM APPOINTMENT a
                     WHERE a.appt_id = %s;
                     """,
                     (appt_id,),
                 )
                 return cur.fetchone()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_appointments_for_session(provider_user_id, session_id):
         """
         列出某個門診時段的掛號清單（只允許看自己的 session）。
         包含：病人姓名、slot_seq、目前掛號狀態、是否有就診記錄。
-        狀態來自 APPOINTMENT_STATUS_HISTORY 最新一筆 to_status。
-        過濾掉已取消的掛號（狀態 4）。
+        狀態來自 APPOINTMENT.current_status（即 APPOINTMENT_STATUS_HISTORY 最新一筆 to_status）。
+        過濾掉已取消（狀態 4）與候補中（狀態 6，尚未取得名額）的掛號。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -79,32 +361,23 @@ class AppointmentRepository:
                         a.slot_seq,
                         a.patient_id,
                         u_pt.name AS patient_name,
-                        COALESCE(ash_latest.to_status, 1) AS status,
-                        ash_latest.changed_at AS status_changed_at,
+                        a.current_status AS status,
+                        a.status_changed_at,
                         CASE WHEN e.enct_id IS NOT NULL THEN 1 ELSE 0 END AS has_encounter,
                         e.status AS encounter_status
                     FROM CLINIC_SESSION cs
                     JOIN APPOINTMENT a ON a.session_id = cs.session_id
                     JOIN PATIENT p ON a.patient_id = p.user_id
                     JOIN "USER" u_pt ON p.user_id = u_pt.user_id
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status, ash.changed_at
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
                     LEFT JOIN ENCOUNTER e ON e.appt_id = a.appt_id
                     WHERE cs.session_id = %s
                       AND cs.provider_id = %s
-                      AND COALESCE(ash_latest.to_status, 1) != 4  -- 過濾掉已取消的掛號
+                      AND a.current_status NOT IN (4, 6)  -- 過濾掉已取消與候補中的掛號
                     ORDER BY a.slot_seq;
                     """,
                     (session_id, provider_user_id),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def _get_appointments_with_status_for_session(conn, session_id):
@@ -118,15 +391,8 @@ class AppointmentRepository:
                 SELECT
                     a.appt_id,
                     a.slot_seq,
-                    COALESCE(ash_latest.to_status, 1) AS status
+                    a.current_status AS status
                 FROM APPOINTMENT a
-                LEFT JOIN LATERAL (
-                    SELECT ash.to_status
-                    FROM APPOINTMENT_STATUS_HISTORY ash
-                    WHERE ash.appt_id = a.appt_id
-                    ORDER BY ash.changed_at DESC
-                    LIMIT 1
-                ) AS ash_latest ON TRUE
                 WHERE a.session_id = %s
                 ORDER BY a.slot_seq;
                 """,
@@ -141,42 +407,38 @@ class AppointmentRepository:
         - 對於 slot_seq > 1 且狀態為「已預約」(1) 的掛號
         - 如果所有 slot_seq < n 的掛號狀態都是「已完成」(3)、「已取消」(4) 或「已過號」(5)
         - 則自動將該掛號設為「已過號」(5)
+
+        依 slot_seq 排序後單次掃描：維護「目前為止所有較小 slot_seq 都已處理完畢」的前綴旗標，
+        相同 slot_seq 的掛號視為同一組（彼此不算「前面」）。
+        判斷一律使用讀取時的狀態（本次標記的過號不會再影響後面的掛號），
+        符合條件的掛號以一次批次寫入狀態歷史。
         """
         appointments = AppointmentRepository._get_appointments_with_status_for_session(conn, session_id)
-        
-        # 狀態定義：3=已完成, 4=已取消, 5=已過號
-        # 這些狀態表示該掛號已經處理完畢，不會再被叫號
-        completed_statuses = {3, 4, 5}
-        
-        auto_marked_count = 0
-        
-        for appt in appointments:
-            appt_id = appt["appt_id"]
-            slot_seq = appt["slot_seq"]
-            current_status = appt["status"]
-            
-            # 只處理 slot_seq > 1 且狀態為「已預約」(1) 的掛號
-            if slot_seq <= 1 or current_status != 1:
-                continue
-            
-            # 檢查所有 slot_seq < n 的掛號狀態
-            all_previous_completed = True
-            for prev_appt in appointments:
-                if prev_appt["slot_seq"] < slot_seq:
-                    prev_status = prev_appt["status"]
-                    if prev_status not in completed_statuses:
-                        all_previous_completed = False
-                        break
-            
-            # 如果所有前面的掛號都已完成/取消/過號，則自動設為過號
-            if all_previous_completed:
-                from_status = AppointmentRepository._get_latest_status(conn, appt_id)
-                AppointmentRepository._insert_status_history(
-                    conn, appt_id, from_status, 5, changed_by
-                )
-                auto_marked_count += 1
-        
-        return auto_marked_count
+
+        # 狀態定義：3=已完成, 4=已取消, 5=已過號, 6=候補
+        # 這些狀態表示該掛號已經處理完畢（或尚未遞補），不會再被叫號
+        completed_statuses = {3, 4, 5, 6}
+
+        to_mark = []
+        # 所有 slot_seq 小於目前這一組的掛號是否都已處理完畢
+        all_previous_completed = True
+        i = 0
+        n = len(appointments)
+        while i < n:
+            slot_seq = appointments[i]["slot_seq"]
+            group_completed = True
+            # 同一個 slot_seq 的掛號一起處理
+            while i < n and appointments[i]["slot_seq"] == slot_seq:
+                appt = appointments[i]
+                if appt["status"] not in completed_statuses:
+                    group_completed = False
+                if slot_seq > 1 and appt["status"] == 1 and all_previous_completed:
+                    to_mark.append((appt["appt_id"], appt["status"]))
+                i += 1
+            all_previous_completed = all_previous_completed and group_completed
+
+        AppointmentRepository._bulk_insert_status_history(conn, to_mark, 5, changed_by)
+        return len(to_mark)
 
     @staticmethod
     def update_appointment_status(provider_user_id, appt_id, new_status):
@@ -186,8 +448,7 @@ class AppointmentRepository:
         - 寫一筆新的 APPOINTMENT_STATUS_HISTORY
         - 更新狀態後自動檢查並設置過號
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             conn.autocommit = False
             # 先獲取掛號資訊以取得 session_id（在同一個連接中）
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -207,162 +468,146 @@ class AppointmentRepository:
                 session_id = appt_info["session_id"]
             
             from_status = AppointmentRepository._get_latest_status(conn, appt_id)
+            AppointmentRepository._check_not_waitlisted(from_status, new_status)
             AppointmentRepository._insert_status_history(
                 conn, appt_id, from_status, new_status, provider_user_id
             )
             
             # 狀態更新後，自動檢查並設置過號
             AppointmentRepository._auto_mark_no_show(conn, session_id, provider_user_id)
+
+            # 釋出名額（例如取消）時由候補遞補
+            if AppointmentRepository._frees_slot(from_status, new_status):
+                AppointmentRepository._promote_waitlist(conn, session_id)
             
             conn.commit()
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                conn.close()
+
+    @staticmethod
+    def _mark_expired_no_shows(conn, patient_id=None):
+        """
+        以集合運算處理「已預約(1)、門診已結束且沒有就診紀錄」的掛號（內部輔助方法，不 commit）：
+        1. 一個 statement 內：鎖定目標掛號 → 批次寫入狀態歷史 1 → 5 → 同步 current_status
+           → 批次插入 no_show_event（已存在則略過）
+        2. 一個 UPDATE 為爽約達三次的病人設定 banned_until（兩週）
+        只挑 current_status = 1 的掛號，因此可重複執行（idempotent）；
+        被其他交易鎖住的掛號會略過（SKIP LOCKED），留待下次執行。
+        1 → 5 都佔用名額，不影響 CLINIC_SESSION.booked_count；涉及的門診時段仍會送出變更通知。
+        patient_id 不為 None 時只處理該病人的掛號。
+        回傳 {"marked": 標記未報到數, "no_show_events": 新增爽約紀錄數, "banned_patients": 新設禁止掛號的病人數}
+        """
+        from datetime import date, timedelta
+        from .session_repo import session_ended_sql
+
+        conditions = [
+            "a.current_status = 1",
+            session_ended_sql("cs"),
+            "NOT EXISTS (SELECT 1 FROM ENCOUNTER e WHERE e.appt_id = a.appt_id)",
+        ]
+        params = []
+        if patient_id is not None:
+            conditions.append("a.patient_id = %s")
+            params.append(patient_id)
+        where_clause = " AND ".join(conditions)
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"""
+                WITH expired AS (
+                    SELECT a.appt_id, a.patient_id, cs.provider_id
+                    FROM APPOINTMENT a
+                    JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+                    WHERE {where_clause}
+                    FOR UPDATE OF a SKIP LOCKED
+                ), ins_history AS (
+                    -- changed_by 必須是 provider_id，因為外鍵約束指向 provider 表
+                    INSERT INTO APPOINTMENT_STATUS_HISTORY (
+                        appt_id, from_status, to_status, changed_by, changed_at
+                    )
+                    SELECT appt_id, 1, 5, provider_id, NOW()
+                    FROM expired
+                    RETURNING appt_id, changed_at
+                ), upd AS (
+                    UPDATE APPOINTMENT a
+                    SET current_status = 5,
+                        status_changed_at = h.changed_at
+                    FROM ins_history h
+                    WHERE a.appt_id = h.appt_id
+                    RETURNING a.appt_id, a.patient_id, a.session_id
+                ), ins_event AS (
+                    INSERT INTO no_show_event (patient_id, appt_id, recorded_at)
+                    SELECT upd.patient_id, upd.appt_id, NOW()
+                    FROM upd
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM no_show_event n
+                        WHERE n.patient_id = upd.patient_id AND n.appt_id = upd.appt_id
+                    )
+                    RETURNING patient_id
+                )
+                SELECT
+                    (SELECT COUNT(*) FROM upd) AS marked,
+                    (SELECT COUNT(*) FROM ins_event) AS no_show_events,
+                    ARRAY(SELECT DISTINCT patient_id FROM upd) AS patient_ids,
+                    ARRAY(SELECT DISTINCT session_id FROM upd) AS session_ids;
+                """,
+                params,
+            )
+            row = cur.fetchone()
+            notify_session_changes(conn, row["session_ids"])
+            result = {
+                "marked": row["marked"],
+                "no_show_events": row["no_show_events"],
+                "banned_patients": 0,
+            }
+            if not row["patient_ids"]:
+                return result
+
+            # 爽約累計達三次：禁止掛號兩週（已在更晚日期前被禁止的不覆蓋）
+            banned_until = date.today() + timedelta(days=14)
+            cur.execute(
+                """
+                UPDATE patient p
+                SET banned_until = %s
+                FROM (
+                    SELECT n.patient_id
+                    FROM no_show_event n
+                    WHERE n.patient_id = ANY(%s)
+                    GROUP BY n.patient_id
+                    HAVING COUNT(*) >= 3
+                ) AS over_limit
+                WHERE p.user_id = over_limit.patient_id
+                  AND (p.banned_until IS NULL OR p.banned_until < %s);
+                """,
+                (banned_until, row["patient_ids"], banned_until),
+            )
+            result["banned_patients"] = cur.rowcount
+            return result
+
+    @staticmethod
+    def process_expired_no_shows():
+        """
+        處理所有已結束門診中未報到的掛號（排程任務用），在單一交易中完成。
+        回傳值同 _mark_expired_no_shows。
+        """
+        with pg_conn() as conn:
+            result = AppointmentRepository._mark_expired_no_shows(conn)
+            conn.commit()
+            return result
 
     @staticmethod
     def _auto_update_expired_appointments_for_patient(conn, patient_id):
         """
         自動將該病人「已預約但已過門診時間、且沒有就診紀錄」的掛號，
         統一轉為「未報到」(5)，並累計 no_show_count。
-        
-        設計重點（可寫進報告）：
-        - 利用 CTE + DISTINCT ON 在資料庫端一次計算最新狀態（latest_status）
-        - 查詢一次就拿到 appt_id / session_id / provider_id / latest_status
-        - 應用層只負責寫入 status history；患者 no_show_count 用單一 UPDATE 完成
-        - 符合 set-based 思維，避免 N+1 查詢問題
+
+        直接使用 _mark_expired_no_shows(conn, patient_id)：
+        - 先以 APPOINTMENT(patient_id, current_status) 索引縮小到該病人的已預約掛號，
+          不再對整張 APPOINTMENT_STATUS_HISTORY 做 DISTINCT ON
+        - 狀態歷史與 no_show_event 都以單一 INSERT ... SELECT 批次寫入
+        成本只與該病人的掛號數有關，不隨歷史表成長（見 benchmarks/bench_patient_expiry.py）。
+        回傳標記為未報到的掛號數。
         """
-        from datetime import date, timedelta
         try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # 1. 找出「該病人、目前仍為已預約(1)、且門診已結束但沒有就診紀錄」的掛號
-                cur.execute(
-                    """
-                    WITH latest_status AS (
-                        -- 每個 appt 只取最後一筆狀態（使用 DISTINCT ON 避免 LATERAL）
-                        SELECT DISTINCT ON (ash.appt_id)
-                               ash.appt_id,
-                               ash.to_status AS latest_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        ORDER BY ash.appt_id, ash.changed_at DESC
-                    )
-                    SELECT 
-                        a.appt_id,
-                        a.session_id,
-                        cs.provider_id,
-                        COALESCE(ls.latest_status, 1) AS latest_status
-                    FROM APPOINTMENT a
-                    JOIN CLINIC_SESSION cs 
-                        ON a.session_id = cs.session_id
-                    LEFT JOIN latest_status ls
-                        ON ls.appt_id = a.appt_id
-                    WHERE a.patient_id = %s
-                      -- 只處理目前最新狀態仍為「已預約」(1) 的掛號
-                      AND COALESCE(ls.latest_status, 1) = 1
-                      -- 門診已經結束
-                      AND (
-                            cs.date < CURRENT_DATE
-                            OR (
-                                cs.date = CURRENT_DATE
-                                AND (
-                                    (cs.period = 1 AND CURRENT_TIME >= TIME '12:00:00')
-                                    OR (cs.period = 2 AND CURRENT_TIME >= TIME '17:00:00')
-                                    OR (cs.period = 3 AND CURRENT_TIME >= TIME '21:00:00')
-                                )
-                            )
-                      )
-                      -- 沒有就診紀錄（沒有 ENCOUNTER）
-                      AND NOT EXISTS (
-                          SELECT 1 
-                          FROM ENCOUNTER e 
-                          WHERE e.appt_id = a.appt_id
-                      );
-                    """,
-                    (patient_id,),
-                )
-                
-                expired_rows = cur.fetchall()
-                
-                if not expired_rows:
-                    return 0
-                
-                updated_count = 0
-                # 統一算好 banned_until（業務規則：連續 14 天）
-                banned_until = date.today() + timedelta(days=14)
-                
-                # 2. 對每一筆過期掛號寫入「狀態變更紀錄」
-                for row in expired_rows:
-                    appt_id = row["appt_id"]
-                    provider_id = row["provider_id"]
-                    current_status = row["latest_status"] or 1  # 沒有 history 就視為 1
-                    
-                    # 保險起見，如果已是 5 就不用再寫一次（理論上不會抓到）
-                    if current_status == 5:
-                        continue
-                    
-                    # 寫入 APPOINTMENT_STATUS_HISTORY（沿用現有 repository）
-                    AppointmentRepository._insert_status_history(
-                        conn,
-                        appt_id=appt_id,
-                        from_status=current_status,
-                        to_status=5,
-                        changed_by=provider_id,
-                    )
-                    updated_count += 1
-                
-                # 3. 為每個未報到的掛號插入 no_show_event 記錄（避免重複）
-                if updated_count > 0:
-                    try:
-                        from datetime import datetime
-                        for row in expired_rows:
-                            appt_id = row["appt_id"]
-                            # 檢查是否已經存在記錄
-                            cur.execute(
-                                """
-                                SELECT 1 FROM no_show_event
-                                WHERE patient_id = %s AND appt_id = %s;
-                                """,
-                                (patient_id, appt_id),
-                            )
-                            if not cur.fetchone():
-                                cur.execute(
-                                    """
-                                    INSERT INTO no_show_event (patient_id, appt_id, recorded_at)
-                                    VALUES (%s, %s, %s);
-                                    """,
-                                    (patient_id, appt_id, datetime.now()),
-                                )
-                        
-                        # 檢查是否需要設置 banned_until
-                        cur.execute(
-                            """
-                            SELECT COUNT(*) AS no_show_count
-                            FROM no_show_event
-                            WHERE patient_id = %s;
-                            """,
-                            (patient_id,),
-                        )
-                        count_row = cur.fetchone()
-                        new_count = count_row["no_show_count"] if count_row else 0
-                        
-                        if new_count >= 3:
-                            cur.execute(
-                                """
-                                UPDATE patient
-                                SET banned_until = %s
-                                WHERE user_id = %s
-                                  AND (banned_until IS NULL OR banned_until < %s);
-                                """,
-                                (banned_until, patient_id, banned_until),
-                            )
-                    except Exception as e:
-                        # 不讓這段影響主要邏輯（但期末報告可以提：這是「部分失敗」的處理策略）
-                        print(f"⚠️ 累計爽約次數失敗 (patient_id={patient_id}): {e}")
-                
-                return updated_count
+            return AppointmentRepository._mark_expired_no_shows(conn, patient_id)["marked"]
         except Exception as e:
             print(f"⚠️ 自動更新過期掛號狀態失敗: {e}")
             return 0
@@ -372,13 +617,12 @@ class AppointmentRepository:
         """
         列出某位病人的所有掛號。
         包含：掛號 ID、門診時段資訊、slot_seq、目前掛號狀態。
-        狀態來自 APPOINTMENT_STATUS_HISTORY 最新一筆 to_status。
+        狀態來自 APPOINTMENT.current_status（即 APPOINTMENT_STATUS_HISTORY 最新一筆 to_status）。
         
         優化：在查詢前自動更新已結束但未報到的掛號狀態，確保狀態即時更新。
         """
         from ..lib.period_utils import period_to_start_time, period_to_end_time
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             # 先自動更新已結束但未報到的掛號狀態
             conn.autocommit = False
             try:
@@ -406,24 +650,17 @@ class AppointmentRepository:
                         u_provider.name AS provider_name,
                         pr.dept_id,
                         COALESCE(d.name, '') AS dept_name,
-                        COALESCE(ash_latest.to_status, 1) AS status,
-                        ash_latest.changed_at AS status_changed_at
+                        a.current_status AS status,
+                        a.status_changed_at
                     FROM APPOINTMENT a
                     JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
                     JOIN PROVIDER pr ON cs.provider_id = pr.user_id
                     JOIN "USER" u_provider ON pr.user_id = u_provider.user_id
                     LEFT JOIN DEPARTMENT d ON pr.dept_id = d.dept_id
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status, ash.changed_at
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
                     WHERE a.patient_id = %s
                     ORDER BY 
                         -- 已取消的項目排最後
-                        (COALESCE(ash_latest.to_status, 1) = 4)::int,
+                        (a.current_status = 4)::int,
                         -- 未來和今天的門診按日期時間由近到遠 (ASC)
                         -- 過去的門診按日期時間由近到遠 (DESC)
                         CASE WHEN cs.date >= CURRENT_DATE THEN cs.date END ASC NULLS LAST,
@@ -439,8 +676,6 @@ class AppointmentRepository:
                     row["session_start_time"] = period_to_start_time(row["session_period"])
                     row["session_end_time"] = period_to_end_time(row["session_period"])
                 return rows
-        finally:
-            conn.close()
 
     @staticmethod
     def update_appointment_status_by_patient(patient_id, appt_id, new_status):
@@ -450,8 +685,7 @@ class AppointmentRepository:
         - 查目前最新狀態作為 from_status
         - 寫一筆新的 APPOINTMENT_STATUS_HISTORY
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             conn.autocommit = False
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 驗證 appt_id 和 patient_id 是否匹配，並獲取對應的 provider_id 和 session_id
@@ -479,6 +713,7 @@ class AppointmentRepository:
             # 如果沒有狀態歷史，假設初始狀態為 1（已預約）
             if from_status is None:
                 from_status = 1
+            AppointmentRepository._check_not_waitlisted(from_status, new_status)
             AppointmentRepository._insert_status_history(
                 conn, appt_id, from_status, new_status, provider_id
             )
@@ -486,192 +721,152 @@ class AppointmentRepository:
             # 狀態更新後，自動檢查並設置過號
             AppointmentRepository._auto_mark_no_show(conn, session_id, provider_id)
 
+            # 釋出名額時由候補遞補
+            if AppointmentRepository._frees_slot(from_status, new_status):
+                AppointmentRepository._promote_waitlist(conn, session_id)
+
             conn.commit()
             return {"appt_id": appt_id, "status_updated": True}
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                conn.close()
 
     @staticmethod
-    def create_appointment(patient_id, session_id):
+    def create_appointment(patient_id, session_id, join_waitlist=True):
         """
         建立掛號：
         - 檢查是否已在該 session 重複掛號
-        - 檢查 session 容量是否已滿
+        - 檢查 session 容量是否已滿；已滿且 join_waitlist 時加入候補（狀態 6，最多 WAITLIST_MAX_SIZE 人）
         - 使用 transaction + FOR UPDATE 避免併行衝突
-        - slot_seq = 已掛號人數 + 1
+        - slot_seq 由 CLINIC_SESSION.next_slot_seq 計數器配發
         - 寫入 APPOINTMENT_STATUS_HISTORY（初始狀態）
+        熱門門診的併發掛號請改走 app.booking.booking_engine（整批處理，只鎖一次）。
         """
-        conn = get_pg_conn()
-        try:
-            # 確保使用事務
-            conn.autocommit = False
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # 檢查是否已在該 session 有掛號記錄（包括已取消的）
-                cur.execute(
-                    """
-                    SELECT a.appt_id, 
-                           COALESCE(ash_latest.to_status, 1) AS current_status
-                    FROM APPOINTMENT a
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
-                    WHERE a.patient_id = %s 
-                      AND a.session_id = %s;
-                    """,
-                    (patient_id, session_id),
-                )
-                existing_appt = cur.fetchone()
+        with pg_conn() as conn:
+            try:
+                # 確保使用事務
+                conn.autocommit = False
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    # 檢查是否已在該 session 有掛號記錄（包括已取消的）
+                    cur.execute(
+                        """
+                        SELECT a.appt_id, a.current_status
+                        FROM APPOINTMENT a
+                        WHERE a.patient_id = %s 
+                          AND a.session_id = %s;
+                        """,
+                        (patient_id, session_id),
+                    )
+                    existing_appt = cur.fetchone()
                 
-                # 如果存在非取消狀態的掛號，則不允許重複預約
-                # 取消狀態代碼：4 = cancelled
-                if existing_appt is not None and existing_appt["current_status"] != 4:
-                    conn.rollback()
-                    raise Exception("無法重複預約同一門診")
+                    # 如果存在非取消狀態的掛號，則不允許重複預約
+                    # 取消狀態代碼：4 = cancelled
+                    if existing_appt is not None and existing_appt["current_status"] != 4:
+                        conn.rollback()
+                        raise Exception("無法重複預約同一門診")
 
-                # 檢查 session 容量並鎖定 session 記錄，避免併行衝突
-                cur.execute(
-                    """
-                    SELECT capacity, provider_id, date, period, status
-                    FROM CLINIC_SESSION
-                    WHERE session_id = %s
-                    FOR UPDATE;
-                    """,
-                    (session_id,),
-                )
-                session_row = cur.fetchone()
-                if session_row is None:
-                    conn.rollback()
-                    raise Exception("Session not found")
-
-                capacity = session_row["capacity"]
-                provider_id = session_row["provider_id"]
-                session_date = session_row["date"]
-                session_period = session_row["period"]
-                session_status = session_row["status"]
-
-                # 檢查 session 狀態
-                if session_status == 2:  # status: 1 = open, 2 = closed
-                    conn.rollback()
-                    raise Exception("Session is cancelled")
-
-                # 檢查是否已過門診時間，如果已過則自動更新 status 為 2（停診）
-                # status: 1 = open (開診), 2 = closed (停診)
-                from datetime import datetime, date, time
-                from ..lib.period_utils import period_to_end_time, is_period_time_valid
-                now = datetime.now()
-                end_time = period_to_end_time(session_period)
-                session_datetime = datetime.combine(session_date, end_time)
-                if now > session_datetime:
-                    # 自動將 status 更新為 2（停診）
+                    # 檢查 session 容量並鎖定 session 記錄，避免併行衝突
                     cur.execute(
                         """
-                        UPDATE CLINIC_SESSION
-                        SET status = 2
-                        WHERE session_id = %s;
+                        SELECT capacity, booked_count, provider_id, date, period, status
+                        FROM CLINIC_SESSION
+                        WHERE session_id = %s
+                        FOR UPDATE;
                         """,
                         (session_id,),
                     )
-                    conn.rollback()
-                    raise Exception("Session has ended, cannot book appointment")
+                    session_row = cur.fetchone()
+                    if session_row is None:
+                        conn.rollback()
+                        raise Exception("Session not found")
 
-                # 計算已預約人數（在鎖定 session 後，排除已取消的掛號；4 = cancelled）
-                cur.execute(
-                    """
-                    SELECT COUNT(*) AS booked_count
-                    FROM APPOINTMENT a
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
-                    WHERE a.session_id = %s
-                      AND COALESCE(ash_latest.to_status, 1) != 4;
-                    """,
-                    (session_id,),
-                )
-                row = cur.fetchone()
-                booked_count = row["booked_count"] if row else 0
+                    capacity = session_row["capacity"]
+                    provider_id = session_row["provider_id"]
+                    session_date = session_row["date"]
+                    session_period = session_row["period"]
+                    session_status = session_row["status"]
 
-                if booked_count >= capacity:
-                    conn.rollback()
-                    raise Exception("Session is full")
+                    # 檢查 session 狀態
+                    if session_status == 2:  # status: 1 = open, 2 = closed
+                        conn.rollback()
+                        raise Exception("Session is cancelled")
 
-                slot_seq = booked_count + 1
+                    # 檢查是否已過門診時間（status 改為 2 由背景排程負責，這裡只拒絕掛號）
+                    from datetime import datetime
+                    from ..lib.period_utils import period_to_end_time
+                    now = datetime.now()
+                    end_time = period_to_end_time(session_period)
+                    session_datetime = datetime.combine(session_date, end_time)
+                    if now > session_datetime:
+                        conn.rollback()
+                        raise Exception("Session has ended, cannot book appointment")
 
-                # 如果存在已取消的掛號（4 = cancelled），更新該記錄；否則創建新記錄
-                if existing_appt is not None and existing_appt["current_status"] == 4:
-                    # 更新已取消的掛號記錄
-                    existing_appt_id = existing_appt["appt_id"]
-                    cur.execute(
-                        """
-                        UPDATE APPOINTMENT
-                        SET slot_seq = %s
-                        WHERE appt_id = %s
-                        RETURNING appt_id, patient_id, session_id, slot_seq;
-                        """,
-                        (slot_seq, existing_appt_id),
-                    )
-                    appt = cur.fetchone()
-                    appt_id = existing_appt_id
-                    
-                    # 寫入狀態歷史：從 4（已取消）變更為 1（已預約）
-                    cur.execute(
-                        """
-                        INSERT INTO APPOINTMENT_STATUS_HISTORY (
-                            appt_id, from_status, to_status, changed_by, changed_at
+                    # 已預約人數由 _insert_status_history 維護（排除已取消的掛號），不需再做 COUNT
+                    booked_count = session_row["booked_count"]
+
+                    # 初始狀態：1 = 已預約；額滿時 6 = 候補
+                    to_status = 1
+                    waitlist_position = None
+                    if booked_count >= capacity:
+                        waitlist_size = (
+                            AppointmentRepository._count_waitlist(conn, session_id) if join_waitlist else None
                         )
-                        VALUES (%s, 4, 1, %s, NOW());
-                        """,
-                        (appt_id, provider_id),
-                    )
-                else:
-                    # 插入新的 APPOINTMENT 記錄
-                    cur.execute(
-                        """
-                        INSERT INTO APPOINTMENT (patient_id, session_id, slot_seq)
-                        VALUES (%s, %s, %s)
-                        RETURNING appt_id, patient_id, session_id, slot_seq;
-                        """,
-                        (patient_id, session_id, slot_seq),
-                    )
-                    appt = cur.fetchone()
-                    appt_id = appt["appt_id"]
+                        if waitlist_size is None or waitlist_size >= WAITLIST_MAX_SIZE:
+                            conn.rollback()
+                            raise Exception("Session is full")
+                        to_status = 6
+                        waitlist_position = waitlist_size + 1
 
-                    # 寫入 APPOINTMENT_STATUS_HISTORY（初始狀態，假設狀態 1 為「已預約」）
-                    # 注意：changed_by 必須是 provider_id，因為外鍵約束指向 provider 表
-                    cur.execute(
-                        """
-                        INSERT INTO APPOINTMENT_STATUS_HISTORY (
-                            appt_id, from_status, to_status, changed_by, changed_at
+                    # 候補也配發 slot_seq：同一時段的候補依 slot_seq 先來後到
+                    slot_seq = AppointmentRepository._take_slot_seq(conn, session_id)
+
+                    # 如果存在已取消的掛號（4 = cancelled），更新該記錄；否則創建新記錄
+                    if existing_appt is not None and existing_appt["current_status"] == 4:
+                        # 更新已取消的掛號記錄
+                        existing_appt_id = existing_appt["appt_id"]
+                        cur.execute(
+                            """
+                            UPDATE APPOINTMENT
+                            SET slot_seq = %s
+                            WHERE appt_id = %s
+                            RETURNING appt_id, patient_id, session_id, slot_seq;
+                            """,
+                            (slot_seq, existing_appt_id),
                         )
-                        VALUES (%s, NULL, 1, %s, NOW());
-                        """,
-                        (appt_id, provider_id),
+                        appt = cur.fetchone()
+                        appt_id = existing_appt_id
+                        # 從 4（已取消）變更為 1（已預約）
+                        from_status = 4
+                    else:
+                        # 插入新的 APPOINTMENT 記錄
+                        cur.execute(
+                            """
+                            INSERT INTO APPOINTMENT (patient_id, session_id, slot_seq)
+                            VALUES (%s, %s, %s)
+                            RETURNING appt_id, patient_id, session_id, slot_seq;
+                            """,
+                            (patient_id, session_id, slot_seq),
+                        )
+                        appt = cur.fetchone()
+                        appt_id = appt["appt_id"]
+                        # 初始狀態（1 = 已預約）
+                        from_status = None
+
+                    # 寫入 APPOINTMENT_STATUS_HISTORY 並同步 current_status
+                    # 注意：changed_by 必須是 provider_id，因為外鍵約束指向 provider 表
+                    AppointmentRepository._insert_status_history(
+                        conn, appt_id, from_status, to_status, provider_id
                     )
 
-                conn.commit()
-                return appt
-        except Exception as e:
-            import traceback
-            print(f"❌ AppointmentRepository.create_appointment 錯誤:")
-            print(f"   patient_id: {patient_id}, session_id: {session_id}")
-            print(f"   錯誤訊息: {str(e)}")
-            print(f"   錯誤堆疊:\n{traceback.format_exc()}")
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+                    conn.commit()
+                    appt = dict(appt, status=to_status)
+                    if waitlist_position is not None:
+                        appt["waitlist_position"] = waitlist_position
+                    return appt
+            except Exception as e:
+                import traceback
+                print(f"❌ AppointmentRepository.create_appointment 錯誤:")
+                print(f"   patient_id: {patient_id}, session_id: {session_id}")
+                print(f"   錯誤訊息: {str(e)}")
+                print(f"   錯誤堆疊:\n{traceback.format_exc()}")
+                raise e
 
     @staticmethod
     def cancel_appointment(appt_id, patient_id):
@@ -680,9 +875,9 @@ class AppointmentRepository:
         - 驗證 patient_id 是否匹配
         - 更新狀態為「已取消」（狀態 4 = cancelled）
         - 寫入 APPOINTMENT_STATUS_HISTORY
+        - 釋出的名額由該時段最前面的候補遞補
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             conn.autocommit = False
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 驗證 appt_id 和 patient_id 是否匹配，並獲取對應的 provider_id
@@ -726,80 +921,73 @@ class AppointmentRepository:
                     conn, appt_id, from_status, 4, provider_id
                 )
                 
-                # 驗證狀態歷史是否正確寫入（在同一個事務中查詢）
+                # 驗證狀態是否正確寫入（在同一個事務中查詢）
                 cur.execute(
                     """
-                    SELECT to_status
-                    FROM APPOINTMENT_STATUS_HISTORY
-                    WHERE appt_id = %s
-                    ORDER BY changed_at DESC
-                    LIMIT 1;
+                    SELECT current_status
+                    FROM APPOINTMENT
+                    WHERE appt_id = %s;
                     """,
                     (appt_id,),
                 )
                 verify_row = cur.fetchone()
-                if verify_row is None or verify_row["to_status"] != 4:
+                if verify_row is None or verify_row["current_status"] != 4:
                     conn.rollback()
-                    raise Exception(f"Failed to update status: expected 4, got {verify_row['to_status'] if verify_row else 'None'}")
+                    raise Exception(f"Failed to update status: expected 4, got {verify_row['current_status'] if verify_row else 'None'}")
                 
                 # 取消掛號後，自動檢查並設置過號
                 if session_id:
                     AppointmentRepository._auto_mark_no_show(conn, session_id, provider_id)
 
+                # 釋出的名額在同一交易中由候補遞補（過號檢查之後，剛遞補的掛號不會立刻被標記過號）
+                promoted = []
+                if session_id and AppointmentRepository._frees_slot(from_status, 4):
+                    promoted = AppointmentRepository._promote_waitlist(conn, session_id)
+
                 conn.commit()
-                return {"appt_id": appt_id, "cancelled": True, "status": 4}
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                conn.close()
+                return {
+                    "appt_id": appt_id,
+                    "cancelled": True,
+                    "status": 4,
+                    "waitlist_promoted": len(promoted),
+                }
 
     @staticmethod
     def modify_appointment(appt_id, old_session_id, new_session_id):
         """
         修改掛號（更換門診時段）：
-        - 使用固定鎖序（按照 session_id 大小順序）避免死鎖
-        - 更新 session_id 和 slot_seq
-        - 寫入 APPOINTMENT_STATUS_HISTORY
+        - 使用固定鎖序（按照 session_id 大小順序）鎖定兩個 CLINIC_SESSION，避免死鎖
+        - 以 CLINIC_SESSION.booked_count 檢查新 session 容量
+        - 更新 session_id 和 slot_seq，並把名額從舊 session 移到新 session
+        - 舊 session 空出的名額由候補遞補；候補中的掛號不能改期
+        - 寫入 APPOINTMENT_STATUS_HISTORY，並送出兩個 session 的變更通知
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 固定鎖序：按照 session_id 大小順序鎖定，避免死鎖
-                first_session_id = min(old_session_id, new_session_id)
-                second_session_id = max(old_session_id, new_session_id)
-
-                # 先鎖定較小的 session_id
                 cur.execute(
                     """
-                    SELECT COUNT(*) AS booked_count
-                    FROM APPOINTMENT
-                    WHERE session_id = %s
+                    SELECT session_id, capacity, booked_count, provider_id
+                    FROM CLINIC_SESSION
+                    WHERE session_id IN (%s, %s)
+                    ORDER BY session_id
                     FOR UPDATE;
                     """,
-                    (first_session_id,),
+                    (old_session_id, new_session_id),
                 )
-
-                # 再鎖定較大的 session_id（如果不同）
-                if first_session_id != second_session_id:
-                    cur.execute(
-                        """
-                        SELECT COUNT(*) AS booked_count
-                        FROM APPOINTMENT
-                        WHERE session_id = %s
-                        FOR UPDATE;
-                        """,
-                        (second_session_id,),
-                    )
+                sessions = {row["session_id"]: row for row in cur.fetchall()}
+                new_session = sessions.get(new_session_id)
+                if new_session is None:
+                    conn.rollback()
+                    raise Exception("Session not found")
 
                 # 驗證 appt_id 是否存在且屬於 old_session_id
                 cur.execute(
                     """
-                    SELECT appt_id, patient_id, session_id, slot_seq
+                    SELECT appt_id, patient_id, session_id, slot_seq, current_status
                     FROM APPOINTMENT
-                    WHERE appt_id = %s AND session_id = %s;
+                    WHERE appt_id = %s AND session_id = %s
+                    FOR UPDATE;
                     """,
                     (appt_id, old_session_id),
                 )
@@ -808,18 +996,21 @@ class AppointmentRepository:
                     conn.rollback()
                     return None
 
-                # 計算新 session 的 slot_seq
-                cur.execute(
-                    """
-                    SELECT COUNT(*) AS booked_count
-                    FROM APPOINTMENT
-                    WHERE session_id = %s;
-                    """,
-                    (new_session_id,),
+                from_status = appt_row["current_status"]
+                # 候補中的掛號不能改期（取消後重新掛號即可）
+                if from_status == 6:
+                    conn.rollback()
+                    raise Exception("Appointment is waitlisted")
+                moves_slot = (
+                    old_session_id != new_session_id
+                    and AppointmentRepository._occupies_slot(from_status)
                 )
-                new_count_row = cur.fetchone()
-                new_booked_count = new_count_row["booked_count"] if new_count_row else 0
-                new_slot_seq = new_booked_count + 1
+                if moves_slot and new_session["booked_count"] >= new_session["capacity"]:
+                    conn.rollback()
+                    raise Exception("Session is full")
+
+                # 新 session 的 slot_seq（與 create_appointment 相同：從計數器配發）
+                new_slot_seq = AppointmentRepository._take_slot_seq(conn, new_session_id)
 
                 # 更新 APPOINTMENT
                 cur.execute(
@@ -833,18 +1024,19 @@ class AppointmentRepository:
                 )
                 updated_appt = cur.fetchone()
 
+                if moves_slot:
+                    AppointmentRepository._move_booked_count(conn, old_session_id, new_session_id)
+                    # 舊 session 空出的名額由候補遞補
+                    AppointmentRepository._promote_waitlist(conn, old_session_id)
+
                 # 使用統一的狀態更新邏輯
                 # 修改掛號不改變狀態，只記錄一次狀態歷史（from_status -> from_status）
-                from_status = AppointmentRepository._get_latest_status(conn, appt_id)
+                # changed_by 必須是 provider_id，因為外鍵約束指向 provider 表
                 AppointmentRepository._insert_status_history(
-                    conn, appt_id, from_status, from_status, appt_row["patient_id"]
+                    conn, appt_id, from_status, from_status, new_session["provider_id"]
                 )
+                # 狀態歷史只通知新 session，舊 session 少了一筆掛號也要通知
+                notify_session_changes(conn, [old_session_id])
 
                 conn.commit()
                 return updated_appt
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
-
@@ -1,46 +1,45 @@
 # repositories/department_repo.py
+import hashlib
+import json
 from typing import List, Dict, Optional
-from ..pg_base import get_pg_conn
+from ..pg_base import pg_conn
+from ..cache import TTLCache
+from ..config import DEPARTMENT_CACHE_TTL_SECONDS
+from ..events import DEPARTMENT_CATALOG_KEY, publish_invalidation
+
+# 部門與分類一年只會改幾次：整份目錄一起快取在行程內
+_catalog_cache = TTLCache("department_catalog", DEPARTMENT_CACHE_TTL_SECONDS)
+_CATALOG_KEY = "catalog"
 
 
 class DepartmentRepository:
-    """部門資料存取層"""
+    """部門資料存取層（讀取走行程內快取，見 get_catalog）"""
 
-    def list_all_departments(self) -> List[Dict]:
+    @staticmethod
+    def _load_catalog() -> Dict:
         """
-        列出所有部門，包含分類資訊。
-        回傳格式：
-        [
-          { 
-            "dept_id": 1, 
-            "name": "內科", 
-            "location": "...",
-            "category_id": 1,
-            "category_name": "內科系"
-          },
-          ...
-        ]
+        從資料庫載入部門與分類，並預先建立：
+        - by_name：部門名稱 → 部門
+        - etag：整份目錄內容的雜湊，供 HTTP ETag 使用
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT 
-                        d.dept_id, 
-                        d.name, 
+                    SELECT
+                        d.dept_id,
+                        d.name,
                         d.location,
                         d.category_id,
                         dc.name AS category_name
                     FROM DEPARTMENT d
                     LEFT JOIN DEPARTMENT_CATEGORY dc ON d.category_id = dc.category_id
-                    ORDER BY 
+                    ORDER BY
                         COALESCE(dc.category_id, 999999),
                         d.dept_id
                     """
                 )
-                rows = cur.fetchall()
-                return [
+                departments = [
                     {
                         "dept_id": row[0],
                         "name": row[1],
@@ -48,23 +47,9 @@ class DepartmentRepository:
                         "category_id": row[3],
                         "category_name": row[4],
                     }
-                    for row in rows
+                    for row in cur.fetchall()
                 ]
-        finally:
-            conn.close()
 
-    def list_all_categories(self) -> List[Dict]:
-        """
-        列出所有分類。
-        回傳格式：
-        [
-          { "category_id": 1, "name": "內科系" },
-          ...
-        ]
-        """
-        conn = get_pg_conn()
-        try:
-            with conn.cursor() as cur:
                 cur.execute(
                     """
                     SELECT category_id, name
@@ -72,56 +57,86 @@ class DepartmentRepository:
                     ORDER BY category_id
                     """
                 )
-                rows = cur.fetchall()
-                return [
+                categories = [
                     {
                         "category_id": row[0],
                         "name": row[1],
                     }
-                    for row in rows
+                    for row in cur.fetchall()
                 ]
-        finally:
-            conn.close()
 
-    def get_department_by_name(self, name: str) -> Dict | None:
+        digest = hashlib.sha1(
+            json.dumps([departments, categories], ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        return {
+            "departments": departments,
+            "categories": categories,
+            "by_name": {dept["name"]: dept for dept in departments},
+            "etag": f'"{digest}"',
+        }
+
+    @staticmethod
+    def get_catalog() -> Dict:
+        """取得（必要時載入）快取中的部門目錄：departments / categories / by_name / etag"""
+        return _catalog_cache.get_or_load(
+            _CATALOG_KEY, DepartmentRepository._load_catalog, tags=(DEPARTMENT_CATALOG_KEY,)
+        )
+
+    @staticmethod
+    def refresh_catalog() -> Dict:
+        """重新載入部門目錄（排程預熱用，讓讀取端不會遇到過期）"""
+        return _catalog_cache.refresh(
+            _CATALOG_KEY, DepartmentRepository._load_catalog, tags=(DEPARTMENT_CATALOG_KEY,)
+        )
+
+    @staticmethod
+    def invalidate_cache():
+        """
+        修改 DEPARTMENT / DEPARTMENT_CATEGORY 後呼叫：本 worker 立即失效，
+        並廣播給其他 worker（連同快取中的醫師基本資料），下次讀取時重新載入
+        """
+        _catalog_cache.invalidate()
+        publish_invalidation([DEPARTMENT_CATALOG_KEY])
+
+    def list_all_departments(self) -> List[Dict]:
+        """
+        列出所有部門，包含分類資訊。
+        回傳格式：
+        [
+          {
+            "dept_id": 1,
+            "name": "內科",
+            "location": "...",
+            "category_id": 1,
+            "category_name": "內科系"
+          },
+          ...
+        ]
+        """
+        return self.get_catalog()["departments"]
+
+    def list_all_categories(self) -> List[Dict]:
+        """
+        列出所有分類。
+        回傳格式：
+        [
+          { "category_id": 1, "name": "內科系" },
+          ...
+        ]
+        """
+        return self.get_catalog()["categories"]
+
+    def get_department_by_name(self, name: str) -> Optional[Dict]:
         """
         根據部門名稱取得部門資訊，包含分類資訊。
         回傳格式：
-        { 
-            "dept_id": 1, 
-            "name": "內科", 
+        {
+            "dept_id": 1,
+            "name": "內科",
             "location": "...",
             "category_id": 1,
             "category_name": "內科系"
         }
         如果找不到則回傳 None。
         """
-        conn = get_pg_conn()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    SELECT 
-                        d.dept_id, 
-                        d.name, 
-                        d.location,
-                        d.category_id,
-                        dc.name AS category_name
-                    FROM DEPARTMENT d
-                    LEFT JOIN DEPARTMENT_CATEGORY dc ON d.category_id = dc.category_id
-                    WHERE d.name = %s
-                    """,
-                    (name,),
-                )
-                row = cur.fetchone()
-                if row is None:
-                    return None
-                return {
-                    "dept_id": row[0],
-                    "name": row[1],
-                    "location": row[2],
-                    "category_id": row[3],
-                    "category_name": row[4],
-                }
-        finally:
-            conn.close()
+        return self.get_catalog()["by_name"].get(name)
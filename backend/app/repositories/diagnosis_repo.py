@@ -1,6 +1,6 @@
 # repositories/diagnosis_repo.py
 from psycopg2.extras import RealDictCursor
-from ..pg_base import get_pg_conn
+from ..pg_base import pg_conn
 
 
 class DiagnosisRepository:
@@ -44,8 +44,7 @@ class DiagnosisRepository:
         """
         查詢一個就診紀錄的所有診斷。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 desc_field = DiagnosisRepository._get_disease_desc_field(conn)
                 
@@ -64,8 +63,6 @@ class DiagnosisRepository:
                     (enct_id,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_diagnoses_for_patient(patient_id):
@@ -73,8 +70,7 @@ class DiagnosisRepository:
         查詢某位病人的所有診斷（不限就診記錄）。
         包含：就診 ID、ICD 代碼、疾病描述、是否主要診斷、就診時間等。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 desc_field = DiagnosisRepository._get_disease_desc_field(conn)
                 
@@ -103,8 +99,6 @@ class DiagnosisRepository:
                     (patient_id,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_diagnoses_for_encounters(enct_ids):
@@ -115,8 +109,7 @@ class DiagnosisRepository:
         if not enct_ids:
             return []
         
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 desc_field = DiagnosisRepository._get_disease_desc_field(conn)
                 
@@ -136,17 +129,13 @@ class DiagnosisRepository:
                     (enct_ids,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def upsert_diagnosis(enct_id, code_icd, is_primary):
         """
         新增或更新診斷（以 enct_id + code_icd 為 key）。
         """
-        import psycopg2
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
                 # 先驗證 enct_id 是否存在
                 cur.execute(
@@ -179,15 +168,6 @@ class DiagnosisRepository:
                     (enct_id, code_icd, is_primary),
                 )
                 conn.commit()
-        except psycopg2.IntegrityError as e:
-            conn.rollback()
-            # 重新拋出 IntegrityError，讓 service 層處理
-            raise e
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
 
     @staticmethod
     def set_primary_diagnosis(enct_id, code_icd):
@@ -195,8 +175,7 @@ class DiagnosisRepository:
         將某一個診斷標為主要診斷，同時把同一 enct_id 其他診斷 is_primary 設為 FALSE。
         使用 transaction 確保原子性。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
                 # 先確認該診斷是否存在
                 cur.execute(
@@ -228,59 +207,44 @@ class DiagnosisRepository:
                     (enct_id, code_icd),
                 )
                 conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
 
     @staticmethod
-    def search_diseases(query: str = None, limit: int = 50):
+    def list_disease_catalog():
         """
-        搜尋疾病（ICD 代碼和描述）。
-        如果提供 query，則搜尋 code_icd 或描述欄位包含該字串的疾病。
+        讀出整份 DISEASE 目錄（code_icd, description），依 code_icd 排序。
+        供 app.search.disease_index 建立記憶體索引；沒有描述欄位時 description 為 code_icd。
         """
-        conn = get_pg_conn()
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
                 desc_field = DiagnosisRepository._get_disease_desc_field(conn)
-                
-                if query:
-                    if desc_field == 'code_icd':
-                        # 只有 code_icd 欄位，只搜尋 code_icd
-                        cur.execute(
-                            """
-                            SELECT code_icd, code_icd AS description
-                            FROM DISEASE
-                            WHERE code_icd ILIKE %s
-                            ORDER BY code_icd
-                            LIMIT %s;
-                            """,
-                            (f"%{query}%", limit),
-                        )
-                    else:
-                        # 有描述欄位，可以搜尋 code_icd 或描述
-                        cur.execute(
-                            f"""
-                            SELECT code_icd, {desc_field} AS description
-                            FROM DISEASE
-                            WHERE code_icd ILIKE %s OR {desc_field} ILIKE %s
-                            ORDER BY code_icd
-                            LIMIT %s;
-                            """,
-                            (f"%{query}%", f"%{query}%", limit),
-                        )
-                else:
-                    cur.execute(
-                        f"""
-                        SELECT code_icd, {desc_field} AS description
-                        FROM DISEASE
-                        ORDER BY code_icd
-                        LIMIT %s;
-                        """,
-                        (limit,),
-                    )
+                cur.execute(
+                    f"""
+                    SELECT code_icd, {desc_field} AS description
+                    FROM DISEASE
+                    ORDER BY code_icd;
+                    """
+                )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
+    @staticmethod
+    def disease_catalog_signature():
+        """
+        回傳 DISEASE 目錄內容的簽章（筆數 + md5），用來判斷記憶體索引是否需要重建。
+        只在資料庫端計算，不傳回整份目錄。
+        """
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                desc_field = DiagnosisRepository._get_disease_desc_field(conn)
+                cur.execute(
+                    f"""
+                    SELECT
+                        COUNT(*),
+                        md5(COALESCE(
+                            string_agg(code_icd || E'\\t' || COALESCE({desc_field}::text, ''), E'\\n' ORDER BY code_icd),
+                            ''
+                        ))
+                    FROM DISEASE;
+                    """
+                )
+                count, digest = cur.fetchone()
+                return f"{count}:{digest}"
@@ -1,8 +1,7 @@
 # repositories/encounter_repo.py
 from psycopg2.extras import RealDictCursor
-from ..pg_base import get_pg_conn
+from ..pg_base import pg_conn
 from .appointment_repo import AppointmentRepository
-from .session_repo import SessionRepository
 
 
 class EncounterRepository:
@@ -13,8 +12,7 @@ class EncounterRepository:
         """
         查詢某筆掛號對應的就診紀錄（只看自己的 encounter）。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -39,8 +37,6 @@ class EncounterRepository:
                     (appt_id, provider_user_id),
                 )
                 return cur.fetchone()
-        finally:
-            conn.close()
 
     @staticmethod
     def upsert_encounter(
@@ -57,8 +53,7 @@ class EncounterRepository:
         - 若該 provider + appt 還沒有 ENCOUNTER，就插入一筆
         - 否則更新內容（支援草稿 / 定稿）
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             # 確保使用事務
             conn.autocommit = False
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -106,7 +101,7 @@ class EncounterRepository:
                     )
                     
                     # 獲取 session_id 用於自動過號檢查
-                    appointment = AppointmentRepository.get_appointment_by_id(appt_id)
+                    appointment = AppointmentRepository._get_appointment_session(conn, appt_id)
                     if appointment:
                         session_id = appointment["session_id"]
                         AppointmentRepository._auto_mark_no_show(conn, session_id, provider_user_id)
@@ -117,10 +112,9 @@ class EncounterRepository:
                     
                     if existing_provider_id != provider_user_id:
                         # Provider 不匹配，檢查 appointment 的 session 是否屬於當前 provider
-                        appointment = AppointmentRepository.get_appointment_by_id(appt_id)
+                        appointment = AppointmentRepository._get_appointment_session(conn, appt_id)
                         if appointment:
-                            session = SessionRepository.get_session_by_id(appointment["session_id"])
-                            if session and session["provider_id"] == provider_user_id:
+                            if appointment["provider_id"] == provider_user_id:
                                 # Appointment 屬於當前 provider 的 session，但 encounter 由另一個 provider 創建
                                 # 這可能是數據不一致的情況，允許當前 provider 更新並修正 provider_id
                                 cur.execute(
@@ -222,16 +216,16 @@ class EncounterRepository:
                         )
                     
                     # 當更新現有 encounter 時，檢查並更新 appointment 狀態為 completed (3)
-                    # 但不要更新已取消的 appointment (status 4)
+                    # 但不要更新已取消 (status 4) 或候補中 (status 6，尚未取得名額) 的 appointment
                     current_appt_status = AppointmentRepository._get_latest_status(conn, appt_id)
-                    if current_appt_status is not None and current_appt_status != 3 and current_appt_status != 4:
+                    if current_appt_status is not None and current_appt_status not in (3, 4, 6):
                         # 如果當前狀態不是 "completed" 且不是 "cancelled"，更新為 "completed"
                         AppointmentRepository._insert_status_history(
                             conn, appt_id, current_appt_status, 3, provider_user_id
                         )
                         
                         # 獲取 session_id 用於自動過號檢查
-                        appointment = AppointmentRepository.get_appointment_by_id(appt_id)
+                        appointment = AppointmentRepository._get_appointment_session(conn, appt_id)
                         if appointment:
                             session_id = appointment["session_id"]
                             AppointmentRepository._auto_mark_no_show(conn, session_id, provider_user_id)
@@ -239,11 +233,6 @@ class EncounterRepository:
                 result = cur.fetchone()
                 conn.commit()
                 return result
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
 
     @staticmethod
     def list_encounters_for_patient(patient_id, provider_id=None):
@@ -253,8 +242,7 @@ class EncounterRepository:
         包含：就診 ID、掛號資訊、門診時段資訊、醫師資訊等。
         優化版本：使用輕量查詢先取得就診列表，然後一次性查詢所有相關資料。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 conditions = ["a.patient_id = %s"]
                 params = [patient_id]
@@ -304,8 +292,87 @@ class EncounterRepository:
                         row["session_end_time"] = period_to_end_time(row["session_period"])
                 return rows
                 return cur.fetchall()
-        finally:
-            conn.close()
+
+    @staticmethod
+    def list_encounters_for_patient_page(
+        patient_id,
+        limit,
+        before=None,
+        updated_since=None,
+        sync_overlap_seconds=0,
+    ):
+        """
+        以 keyset 分頁查詢某位病人的就診紀錄，依 (encounter_at, enct_id) 由新到舊。
+        - before：上一頁最後一筆的 (encounter_at, enct_id)，只回傳比它更舊的紀錄
+        - updated_since：只回傳 updated_at 晚於此時間的就診
+          （就診本身或其診斷、處方、檢驗、繳費有變更都會更新 ENCOUNTER.updated_at，
+          需先執行 migrate_history_sync.sql）
+        多查一筆判斷是否還有下一頁。
+        回傳 (rows, has_more, sync_watermark)：sync_watermark 為本次查詢的資料庫時間
+        往前 sync_overlap_seconds 秒，作為下次 updated_since 的起點。
+        """
+        with pg_conn() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                conditions = ["a.patient_id = %(patient_id)s"]
+                params = {
+                    "patient_id": patient_id,
+                    "limit": limit + 1,
+                    "overlap": sync_overlap_seconds,
+                }
+                if before is not None:
+                    conditions.append("(e.encounter_at, e.enct_id) < (%(before_at)s, %(before_id)s)")
+                    params["before_at"], params["before_id"] = before
+                if updated_since is not None:
+                    conditions.append("e.updated_at > %(updated_since)s")
+                    params["updated_since"] = updated_since
+                where_clause = " AND ".join(conditions)
+
+                # 與下方查詢在同一交易內，NOW() 相同
+                cur.execute("SELECT NOW() - make_interval(secs => %(overlap)s) AS watermark;", params)
+                sync_watermark = cur.fetchone()["watermark"]
+
+                updated_at_column = ",\n                        e.updated_at" if updated_since is not None else ""
+                cur.execute(
+                    f"""
+                    SELECT
+                        e.enct_id,
+                        e.appt_id,
+                        e.provider_id,
+                        e.encounter_at,
+                        e.status,
+                        e.chief_complaint,
+                        e.subjective,
+                        e.assessment,
+                        e.plan,
+                        a.patient_id,
+                        a.session_id,
+                        cs.date AS session_date,
+                        cs.period AS session_period,
+                        u_provider.name AS provider_name,
+                        pr.dept_id,
+                        d.name AS department_name{updated_at_column}
+                    FROM ENCOUNTER e
+                    JOIN APPOINTMENT a ON e.appt_id = a.appt_id
+                    JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+                    JOIN PROVIDER pr ON e.provider_id = pr.user_id
+                    JOIN "USER" u_provider ON pr.user_id = u_provider.user_id
+                    LEFT JOIN DEPARTMENT d ON pr.dept_id = d.dept_id
+                    WHERE {where_clause}
+                    ORDER BY e.encounter_at DESC, e.enct_id DESC
+                    LIMIT %(limit)s;
+                    """,
+                    params,
+                )
+                rows = cur.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        from ..lib.period_utils import period_to_start_time, period_to_end_time
+        for row in rows:
+            if row.get("session_period"):
+                row["session_start_time"] = period_to_start_time(row["session_period"])
+                row["session_end_time"] = period_to_end_time(row["session_period"])
+        return rows, has_more, sync_watermark
 
     @staticmethod
     def list_encounters_for_patient_by_provider(provider_user_id, patient_user_id):
@@ -326,8 +393,7 @@ class EncounterRepository:
         返回 True 如果成功獲取鎖定，False 如果已被其他用戶鎖定
         """
         from datetime import datetime, timedelta
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             conn.autocommit = False
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 檢查當前鎖定狀態
@@ -409,13 +475,6 @@ class EncounterRepository:
                     )
                     conn.commit()
                     return True
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                conn.close()
 
     @staticmethod
     def unlock_encounter(enct_id, provider_user_id):
@@ -423,8 +482,7 @@ class EncounterRepository:
         釋放 encounter 的鎖定（只有鎖定者才能釋放）。
         返回 True 如果成功釋放，False 如果不是鎖定者
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             conn.autocommit = False
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
@@ -440,13 +498,6 @@ class EncounterRepository:
                 row = cur.fetchone()
                 conn.commit()
                 return row is not None
-        except Exception as e:
-            if conn:
-                conn.rollback()
-            raise e
-        finally:
-            if conn:
-                conn.close()
 
     @staticmethod
     def check_encounter_lock(enct_id, provider_user_id):
@@ -454,8 +505,7 @@ class EncounterRepository:
         檢查 encounter 是否被鎖定。
         返回 (is_locked, locked_by, locked_at) 元組
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -484,6 +534,4 @@ class EncounterRepository:
                         return (False, locked_by, locked_at)  # 鎖定已過期
                 
                 return (locked_by is not None, locked_by, locked_at)
-        finally:
-            conn.close()
 
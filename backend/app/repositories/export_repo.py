@@ -0,0 +1,171 @@
+# repositories/export_repo.py
+from ..pg_base import pg_conn
+from .diagnosis_repo import DiagnosisRepository
+
+# 每次從 server-side cursor 取回的列數
+EXPORT_ITERSIZE = 2000
+
+# 匯出的就診共用欄位與 JOIN（依就診時間篩選日期區間）
+_ENCOUNTER_JOINS = """
+    JOIN APPOINTMENT a ON e.appt_id = a.appt_id
+"""
+
+# dataset -> (SELECT 欄位, FROM 子句（必須帶出 e = ENCOUNTER、a = APPOINTMENT）, ORDER BY)
+# 每個 dataset 都是一列一筆的平面資料，NDJSON 與 CSV 共用
+_DATASETS = {
+    "encounters": (
+        """
+        e.enct_id,
+        e.appt_id,
+        a.patient_id,
+        e.provider_id,
+        pr.dept_id,
+        e.encounter_at,
+        e.status,
+        e.chief_complaint,
+        e.subjective,
+        e.assessment,
+        e.plan
+        """,
+        """
+        FROM ENCOUNTER e
+        """ + _ENCOUNTER_JOINS + """
+        JOIN PROVIDER pr ON e.provider_id = pr.user_id
+        """,
+        "e.encounter_at, e.enct_id",
+    ),
+    "diagnoses": (
+        """
+        dx.enct_id,
+        a.patient_id,
+        e.provider_id,
+        e.encounter_at,
+        dx.code_icd,
+        NULLIF(TRIM(dis.{desc_field}), '') AS description,
+        dx.is_primary
+        """,
+        """
+        FROM DIAGNOSIS dx
+        JOIN ENCOUNTER e ON dx.enct_id = e.enct_id
+        """ + _ENCOUNTER_JOINS + """
+        JOIN DISEASE dis ON dx.code_icd = dis.code_icd
+        """,
+        "e.encounter_at, dx.enct_id, dx.is_primary DESC, dx.code_icd",
+    ),
+    # 處方展開為一列一個用藥明細（沒有明細的處方也輸出一列，用藥欄位為空）
+    "prescriptions": (
+        """
+        rx.rx_id,
+        rx.enct_id,
+        a.patient_id,
+        e.provider_id,
+        e.encounter_at,
+        inc.med_id,
+        m.name AS med_name,
+        m.spec,
+        m.unit,
+        inc.dosage,
+        inc.frequency,
+        inc.days,
+        inc.quantity
+        """,
+        """
+        FROM PRESCRIPTION rx
+        JOIN ENCOUNTER e ON rx.enct_id = e.enct_id
+        """ + _ENCOUNTER_JOINS + """
+        LEFT JOIN INCLUDE inc ON inc.rx_id = rx.rx_id
+        LEFT JOIN MEDICATION m ON inc.med_id = m.med_id
+        """,
+        "e.encounter_at, rx.rx_id, m.name",
+    ),
+    "lab_results": (
+        """
+        lab.lab_id,
+        lab.enct_id,
+        a.patient_id,
+        e.provider_id,
+        e.encounter_at,
+        lab.loinc_code,
+        lab.item_name,
+        lab.value,
+        lab.unit,
+        lab.ref_low,
+        lab.ref_high,
+        lab.abnormal_flag,
+        lab.reported_at
+        """,
+        """
+        FROM LAB_RESULT lab
+        JOIN ENCOUNTER e ON lab.enct_id = e.enct_id
+        """ + _ENCOUNTER_JOINS,
+        "e.encounter_at, lab.enct_id, lab.reported_at NULLS LAST, lab.lab_id",
+    ),
+    "payments": (
+        """
+        pay.payment_id,
+        pay.enct_id,
+        a.patient_id,
+        e.provider_id,
+        e.encounter_at,
+        pay.amount,
+        pay.method,
+        pay.invoice_no,
+        pay.paid_at
+        """,
+        """
+        FROM PAYMENT pay
+        JOIN ENCOUNTER e ON pay.enct_id = e.enct_id
+        """ + _ENCOUNTER_JOINS,
+        "e.encounter_at, pay.enct_id, pay.paid_at",
+    ),
+}
+
+EXPORT_DATASETS = tuple(_DATASETS)
+
+
+class ExportRepository:
+    """大量匯出：以 server-side（named）cursor 分批讀取，記憶體用量與結果筆數無關"""
+
+    @staticmethod
+    def stream_rows(dataset, date_from, date_to, patient_id=None, provider_id=None, itersize=EXPORT_ITERSIZE):
+        """
+        依就診日期區間 [date_from, date_to]（含兩端）匯出一個 dataset，
+        可再以 patient_id / provider_id 篩選。
+        generator：第一個產出值為欄位名稱 list，之後每次產出一批（最多 itersize 列）tuple。
+        整個匯出借用同一條連線；呼叫端中途停止時連線會在 generator 關閉時歸還。
+        """
+        select_sql, from_sql, order_sql = _DATASETS[dataset]
+
+        conditions = [
+            "e.encounter_at >= %(date_from)s",
+            "e.encounter_at < %(date_to)s::date + 1",
+        ]
+        params = {"date_from": date_from, "date_to": date_to}
+        if patient_id is not None:
+            conditions.append("a.patient_id = %(patient_id)s")
+            params["patient_id"] = patient_id
+        if provider_id is not None:
+            conditions.append("e.provider_id = %(provider_id)s")
+            params["provider_id"] = provider_id
+
+        with pg_conn() as conn:
+            if "{desc_field}" in select_sql:
+                select_sql = select_sql.format(desc_field=DiagnosisRepository._get_disease_desc_field(conn))
+
+            with conn.cursor(name=f"export_{dataset}") as cur:
+                cur.itersize = itersize
+                cur.execute(
+                    f"""
+                    SELECT {select_sql}
+                    {from_sql}
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY {order_sql};
+                    """,
+                    params,
+                )
+                rows = cur.fetchmany(itersize)
+                # named cursor 在第一次 fetch 之後才有 description
+                yield [column[0] for column in cur.description]
+                while rows:
+                    yield rows
+                    rows = cur.fetchmany(itersize)
@@ -0,0 +1,198 @@
+# repositories/history_repo.py
+from ..pg_base import pg_conn
+from ..lib.period_utils import period_to_start_time, period_to_end_time
+from .diagnosis_repo import DiagnosisRepository
+
+# 歷史記錄 JSON 的各區段，順序即輸出順序（section 編號 = 索引）
+HISTORY_SECTIONS = ("encounters", "prescriptions", "lab_results", "payments", "diagnoses")
+
+# 每次從 server-side cursor 取回的列數
+HISTORY_STREAM_ITERSIZE = 500
+
+
+def _period_time_sql(column, to_time):
+    """把 period 轉成時間的 SQL CASE（時間來自 period_utils，與 Python 端計算一致）"""
+    cases = " ".join(
+        f"WHEN {period} THEN TIME '{to_time(period).strftime('%H:%M:%S')}'"
+        for period in (1, 2, 3)
+    )
+    return f"CASE {column} {cases} END"
+
+
+class PatientHistoryRepository:
+    """病人完整歷史記錄：整份 JSON 在 PostgreSQL 端組好，單一查詢、單一連線串流輸出"""
+
+    @staticmethod
+    def _history_sql(desc_field):
+        return f"""
+            WITH enc AS MATERIALIZED (
+                SELECT
+                    e.enct_id,
+                    e.appt_id,
+                    e.provider_id,
+                    e.encounter_at,
+                    e.status,
+                    e.chief_complaint,
+                    e.subjective,
+                    e.assessment,
+                    e.plan,
+                    a.patient_id,
+                    a.session_id,
+                    cs.date AS session_date,
+                    cs.period AS session_period,
+                    u_provider.name AS provider_name,
+                    pr.dept_id,
+                    d.name AS department_name,
+                    row_number() OVER (ORDER BY e.encounter_at DESC, e.enct_id DESC) AS ord
+                FROM ENCOUNTER e
+                JOIN APPOINTMENT a ON e.appt_id = a.appt_id
+                JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+                JOIN PROVIDER pr ON e.provider_id = pr.user_id
+                JOIN "USER" u_provider ON pr.user_id = u_provider.user_id
+                LEFT JOIN DEPARTMENT d ON pr.dept_id = d.dept_id
+                WHERE a.patient_id = %(patient_id)s
+            )
+            SELECT 0 AS section, enc.ord, json_build_object(
+                'enct_id', enc.enct_id,
+                'appt_id', enc.appt_id,
+                'provider_id', enc.provider_id,
+                'encounter_at', enc.encounter_at,
+                'status', enc.status,
+                'chief_complaint', enc.chief_complaint,
+                'subjective', enc.subjective,
+                'assessment', enc.assessment,
+                'plan', enc.plan,
+                'patient_id', enc.patient_id,
+                'session_id', enc.session_id,
+                'session_date', enc.session_date,
+                'session_period', enc.session_period,
+                'provider_name', enc.provider_name,
+                'dept_id', enc.dept_id,
+                'department_name', enc.department_name,
+                'session_start_time', {_period_time_sql("enc.session_period", period_to_start_time)},
+                'session_end_time', {_period_time_sql("enc.session_period", period_to_end_time)}
+            )::text AS doc
+            FROM enc
+
+            UNION ALL
+
+            SELECT 1, row_number() OVER (ORDER BY rx.enct_id, rx.rx_id), json_build_object(
+                'rx_id', rx.rx_id,
+                'enct_id', rx.enct_id,
+                'items', COALESCE(
+                    (
+                        SELECT json_agg(json_build_object(
+                            'rx_id', inc.rx_id,
+                            'med_id', inc.med_id,
+                            'med_name', m.name,
+                            'spec', m.spec,
+                            'unit', m.unit,
+                            'dosage', inc.dosage,
+                            'frequency', inc.frequency,
+                            'days', inc.days,
+                            'quantity', inc.quantity
+                        ) ORDER BY m.name)
+                        FROM INCLUDE inc
+                        JOIN MEDICATION m ON inc.med_id = m.med_id
+                        WHERE inc.rx_id = rx.rx_id
+                    ),
+                    '[]'::json
+                )
+            )::text
+            FROM PRESCRIPTION rx
+            JOIN enc ON enc.enct_id = rx.enct_id
+
+            UNION ALL
+
+            SELECT 2, row_number() OVER (ORDER BY lab.enct_id, lab.reported_at NULLS LAST, lab.lab_id), json_build_object(
+                'lab_id', lab.lab_id,
+                'enct_id', lab.enct_id,
+                'loinc_code', lab.loinc_code,
+                'item_name', lab.item_name,
+                'value', lab.value,
+                'unit', lab.unit,
+                'ref_low', lab.ref_low,
+                'ref_high', lab.ref_high,
+                'abnormal_flag', lab.abnormal_flag,
+                'reported_at', lab.reported_at
+            )::text
+            FROM LAB_RESULT lab
+            JOIN enc ON enc.enct_id = lab.enct_id
+
+            UNION ALL
+
+            SELECT 3, row_number() OVER (ORDER BY pay.enct_id, pay.paid_at DESC), json_build_object(
+                'payment_id', pay.payment_id,
+                'enct_id', pay.enct_id,
+                'amount', pay.amount,
+                'method', pay.method,
+                'invoice_no', pay.invoice_no,
+                'paid_at', pay.paid_at
+            )::text
+            FROM PAYMENT pay
+            JOIN enc ON enc.enct_id = pay.enct_id
+
+            UNION ALL
+
+            SELECT 4, row_number() OVER (ORDER BY dx.enct_id, dx.is_primary DESC, dx.code_icd), json_build_object(
+                'enct_id', dx.enct_id,
+                'code_icd', dx.code_icd,
+                'description', NULLIF(TRIM(dis.{desc_field}), ''),
+                'is_primary', dx.is_primary
+            )::text
+            FROM DIAGNOSIS dx
+            JOIN enc ON enc.enct_id = dx.enct_id
+            JOIN DISEASE dis ON dx.code_icd = dis.code_icd
+
+            ORDER BY section, ord;
+        """
+
+    @staticmethod
+    def stream_patient_history(patient_id, itersize=HISTORY_STREAM_ITERSIZE):
+        """
+        產生病人完整歷史記錄的 JSON 文字片段（generator），格式與
+        PatientHistoryService.get_patient_history 相同：
+        { "encounters": [...], "prescriptions": [...], "lab_results": [...], "payments": [...], "diagnoses": [...] }
+        - 每筆記錄由 PostgreSQL 以 json_build_object 組成文字，Python 端只做字串串接，不建立 dict
+        - 五個區段以 UNION ALL 合成一個查詢，透過 server-side cursor 每次取 itersize 列，記憶體用量固定
+        - 整個過程只借用一條連線；呼叫端中途停止（例如用戶端斷線）時連線會在 generator 關閉時歸還
+        """
+        with pg_conn() as conn:
+            desc_field = DiagnosisRepository._get_disease_desc_field(conn)
+            with conn.cursor(name="patient_history_stream") as cur:
+                cur.itersize = itersize
+                cur.execute(
+                    PatientHistoryRepository._history_sql(desc_field),
+                    {"patient_id": patient_id},
+                )
+
+                # current：目前輸出中的區段；first：該區段是否還沒有輸出任何記錄
+                current = -1
+                first = True
+                parts = ["{"]
+                while True:
+                    rows = cur.fetchmany(itersize)
+                    if not rows:
+                        break
+                    for section, _ord, doc in rows:
+                        while current < section:
+                            current += 1
+                            if current > 0:
+                                parts.append("],")
+                            parts.append(f'"{HISTORY_SECTIONS[current]}":[')
+                            first = True
+                        if not first:
+                            parts.append(",")
+                        parts.append(doc)
+                        first = False
+                    yield "".join(parts)
+                    parts = []
+
+                # 補上沒有任何記錄的區段
+                while current < len(HISTORY_SECTIONS) - 1:
+                    current += 1
+                    if current > 0:
+                        parts.append("],")
+                    parts.append(f'"{HISTORY_SECTIONS[current]}":[')
+                parts.append("]}")
+                yield "".join(parts)
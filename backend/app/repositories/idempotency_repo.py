@@ -0,0 +1,105 @@
+# repositories/idempotency_repo.py
+import uuid
+
+from psycopg2.extras import Json, RealDictCursor
+
+from ..pg_base import pg_conn
+
+
+class IdempotencyRepository:
+    """冪等鍵（IDEMPOTENCY_KEY）：(patient_id, idem_key) 對應第一次請求的回應"""
+
+    @staticmethod
+    def get_key(patient_id, idem_key):
+        """讀取未過期的冪等鍵（主鍵查詢），不存在或已過期時回傳 None"""
+        with pg_conn() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    """
+                    SELECT operation, request_fingerprint, status_code, response
+                    FROM IDEMPOTENCY_KEY
+                    WHERE patient_id = %s
+                      AND idem_key = %s
+                      AND expires_at > NOW();
+                    """,
+                    (patient_id, idem_key),
+                )
+                return cur.fetchone()
+
+    @staticmethod
+    def claim_key(patient_id, idem_key, operation, request_fingerprint, ttl_seconds, lease_seconds):
+        """
+        佔用冪等鍵（status_code 為 NULL 表示處理中，created_at 為租約起點）：
+        鍵不存在、已過期，或處理中超過 lease_seconds 秒（第一次請求已中斷）時佔用成功，
+        回傳這次佔用的 claim_token；已被其他請求佔用回傳 None。
+        save_response / release_key 須帶 claim_token：租約過期被重送接手後，
+        原本較慢的請求無法覆蓋或刪除接手者的鍵。
+        """
+        claim_token = str(uuid.uuid4())
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO IDEMPOTENCY_KEY (
+                        patient_id, idem_key, operation, request_fingerprint, claim_token, expires_at
+                    )
+                    VALUES (%s, %s, %s, %s, %s::uuid, NOW() + %s * INTERVAL '1 second')
+                    ON CONFLICT (patient_id, idem_key) DO UPDATE SET
+                        operation = EXCLUDED.operation,
+                        request_fingerprint = EXCLUDED.request_fingerprint,
+                        status_code = NULL,
+                        response = NULL,
+                        claim_token = EXCLUDED.claim_token,
+                        created_at = NOW(),
+                        expires_at = EXCLUDED.expires_at
+                    WHERE IDEMPOTENCY_KEY.expires_at <= NOW()
+                       OR (
+                           IDEMPOTENCY_KEY.status_code IS NULL
+                           AND IDEMPOTENCY_KEY.created_at < NOW() - %s * INTERVAL '1 second'
+                       )
+                    RETURNING patient_id;
+                    """,
+                    (patient_id, idem_key, operation, request_fingerprint, claim_token, ttl_seconds, lease_seconds),
+                )
+                claimed = cur.fetchone() is not None
+            conn.commit()
+            return claim_token if claimed else None
+
+    @staticmethod
+    def save_response(patient_id, idem_key, claim_token, status_code, response):
+        """記錄第一次請求的回應（response 須可轉成 JSON）；鍵已被其他請求接手時不寫入"""
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE IDEMPOTENCY_KEY
+                    SET status_code = %s, response = %s
+                    WHERE patient_id = %s AND idem_key = %s AND claim_token = %s::uuid;
+                    """,
+                    (status_code, Json(response), patient_id, idem_key, claim_token),
+                )
+            conn.commit()
+
+    @staticmethod
+    def release_key(patient_id, idem_key, claim_token):
+        """第一次請求發生非預期錯誤或被取消時釋放鍵，讓重送可以重新執行；鍵已被其他請求接手時不刪除"""
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    DELETE FROM IDEMPOTENCY_KEY
+                    WHERE patient_id = %s AND idem_key = %s AND claim_token = %s::uuid AND status_code IS NULL;
+                    """,
+                    (patient_id, idem_key, claim_token),
+                )
+            conn.commit()
+
+    @staticmethod
+    def delete_expired_keys():
+        """刪除已過期的冪等鍵，回傳刪除筆數"""
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM IDEMPOTENCY_KEY WHERE expires_at <= NOW();")
+                deleted = cur.rowcount
+            conn.commit()
+            return deleted
@@ -1,6 +1,6 @@
 # repositories/lab_result_repo.py
 from psycopg2.extras import RealDictCursor
-from ..pg_base import get_pg_conn
+from ..pg_base import pg_conn
 
 
 class LabResultRepository:
@@ -11,8 +11,7 @@ class LabResultRepository:
         """
         查詢某次就診的所有檢驗結果。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -34,8 +33,6 @@ class LabResultRepository:
                     (enct_id,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_lab_results_for_patient(patient_id):
@@ -43,8 +40,7 @@ class LabResultRepository:
         查詢某位病人的所有檢驗結果。
         包含：檢驗 ID、就診 ID、檢驗項目、數值等。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -76,8 +72,6 @@ class LabResultRepository:
                     (patient_id,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_lab_results_for_encounters(enct_ids):
@@ -88,8 +82,7 @@ class LabResultRepository:
         if not enct_ids:
             return []
         
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -111,8 +104,6 @@ class LabResultRepository:
                     (enct_ids,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def add_lab_result(
@@ -130,8 +121,7 @@ class LabResultRepository:
         新增一筆檢驗結果。
         abnormal_flag: 'H' (高), 'L' (低), 'N' (正常), None
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -158,6 +148,4 @@ class LabResultRepository:
                 )
                 conn.commit()
                 return cur.fetchone()
-        finally:
-            conn.close()
 
@@ -0,0 +1,26 @@
+# repositories/notification_repo.py
+from psycopg2.extras import RealDictCursor
+
+from ..pg_base import pg_conn
+
+
+class NotificationRepository:
+    """病人通知事件（PATIENT_NOTIFICATION），例如候補遞補（由 AppointmentRepository._promote_waitlist 寫入）"""
+
+    @staticmethod
+    def list_notifications(patient_id, after_id=0, limit=100):
+        """依 notification_id 由舊到新取出 after_id 之後的通知（用回傳的最後一筆 id 增量讀取）"""
+        with pg_conn() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    """
+                    SELECT notification_id, appt_id, event_type, payload, created_at
+                    FROM PATIENT_NOTIFICATION
+                    WHERE patient_id = %s
+                      AND notification_id > %s
+                    ORDER BY notification_id
+                    LIMIT %s;
+                    """,
+                    (patient_id, after_id, limit),
+                )
+                return cur.fetchall()
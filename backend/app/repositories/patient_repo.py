@@ -1,7 +1,6 @@
 # repositories/patient_repo.py
 from psycopg2.extras import RealDictCursor
-import psycopg2
-from ..pg_base import get_pg_conn
+from ..pg_base import pg_conn
 
 
 class PatientRepository:
@@ -15,8 +14,7 @@ class PatientRepository:
         - 在 PATIENT 新增一筆
         回傳：{ user_id, name, national_id, birth_date, sex, phone }
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 步驟 1: 在 USER 表中創建記錄（type = 'patient'）
                 cur.execute(
@@ -60,15 +58,6 @@ class PatientRepository:
                 # 添加 name 到返回結果
                 patient_row["name"] = name
                 return patient_row
-        except psycopg2.IntegrityError as e:
-            # 重新拋出 IntegrityError，讓 service 層處理
-            conn.rollback()
-            raise e
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
 
     @staticmethod
     def authenticate_patient_by_national_id(national_id, hash_pwd):
@@ -76,8 +65,7 @@ class PatientRepository:
         用 national_id + hash_pwd 驗證病患身份。
         成功回傳 patient + user 資訊，失敗回傳 None。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -98,16 +86,21 @@ class PatientRepository:
                     (national_id, hash_pwd),
                 )
                 return cur.fetchone()
-        finally:
-            conn.close()
+
+    @staticmethod
+    def patient_exists(patient_user_id):
+        """病患是否存在（主鍵查詢）"""
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 FROM patient WHERE user_id = %s;", (patient_user_id,))
+                return cur.fetchone() is not None
 
     @staticmethod
     def get_patient_profile(patient_user_id):
         """
         取得某位病患的基本資料（姓名、身分證字號、生日、電話）。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -129,8 +122,6 @@ class PatientRepository:
                     (patient_user_id,),
                 )
                 return cur.fetchone()
-        finally:
-            conn.close()
 
     @staticmethod
     def is_patient_banned(patient_id):
@@ -140,8 +131,7 @@ class PatientRepository:
         回傳 (is_banned, banned_until) 元組。
         """
         from datetime import date, timedelta
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 從 no_show_event 表計算爽約次數
                 cur.execute(
@@ -196,8 +186,6 @@ class PatientRepository:
                 )
                 conn.commit()
                 return False, None
-        finally:
-            conn.close()
 
     @staticmethod
     def increment_no_show_count(patient_id, appt_id):
@@ -206,8 +194,7 @@ class PatientRepository:
         在 no_show_event 表中插入一筆記錄，並檢查是否需要設置 banned_until。
         """
         from datetime import date, timedelta, datetime
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 檢查是否已經存在記錄，避免重複插入
                 cur.execute(
@@ -256,8 +243,3 @@ class PatientRepository:
                     )
                 
                 conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
@@ -0,0 +1,85 @@
+# repositories/patient_stats_repo.py
+from psycopg2.extras import RealDictCursor
+
+from ..pg_base import pg_conn
+
+# 每批寫入的病人數
+PATIENT_STATS_UPSERT_BATCH = 1000
+
+
+class PatientStatsRepository:
+    """病人統計 cube（PATIENT_STATS）：一位病人一列，內容由分析快照計算後寫入"""
+
+    @staticmethod
+    def get_patient_stats(patient_id):
+        """讀取一位病人的統計列，不存在時回傳 None"""
+        with pg_conn() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    """
+                    SELECT
+                        patient_id,
+                        total_visits,
+                        annual_visits,
+                        department_distribution,
+                        diagnosis_frequency,
+                        snapshot_built_at
+                    FROM PATIENT_STATS
+                    WHERE patient_id = %s;
+                    """,
+                    (patient_id,),
+                )
+                return cur.fetchone()
+
+    @staticmethod
+    def upsert_patient_stats(rows, snapshot_built_at):
+        """
+        寫入（覆蓋）多位病人的統計列：
+        rows 為 (patient_id, total_visits, annual_visits, department_distribution, diagnosis_frequency)，
+        後三者為 JSON 字串。每批以 unnest 一次寫入，回傳寫入筆數。
+        """
+        written = 0
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                for start in range(0, len(rows), PATIENT_STATS_UPSERT_BATCH):
+                    batch = rows[start:start + PATIENT_STATS_UPSERT_BATCH]
+                    patient_ids, totals, annual, departments, diagnoses = (list(column) for column in zip(*batch))
+                    cur.execute(
+                        """
+                        INSERT INTO PATIENT_STATS (
+                            patient_id, total_visits, annual_visits,
+                            department_distribution, diagnosis_frequency,
+                            snapshot_built_at, updated_at
+                        )
+                        SELECT
+                            t.patient_id, t.total_visits, t.annual_visits::jsonb,
+                            t.department_distribution::jsonb, t.diagnosis_frequency::jsonb,
+                            %s, NOW()
+                        FROM unnest(%s::bigint[], %s::int[], %s::text[], %s::text[], %s::text[])
+                            AS t(patient_id, total_visits, annual_visits, department_distribution, diagnosis_frequency)
+                        ON CONFLICT (patient_id) DO UPDATE SET
+                            total_visits = EXCLUDED.total_visits,
+                            annual_visits = EXCLUDED.annual_visits,
+                            department_distribution = EXCLUDED.department_distribution,
+                            diagnosis_frequency = EXCLUDED.diagnosis_frequency,
+                            snapshot_built_at = EXCLUDED.snapshot_built_at,
+                            updated_at = EXCLUDED.updated_at;
+                        """,
+                        (snapshot_built_at, patient_ids, totals, annual, departments, diagnoses),
+                    )
+                    written += len(batch)
+            conn.commit()
+        return written
+
+    @staticmethod
+    def delete_stale_patient_stats(snapshot_built_at):
+        """刪除早於該快照時間計算的列（完整重建後：已沒有任何就診的病人），回傳刪除筆數"""
+        with pg_conn() as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "DELETE FROM PATIENT_STATS WHERE snapshot_built_at < %s;",
+                    (snapshot_built_at,),
+                )
+                deleted = cur.rowcount
+            conn.commit()
+        return deleted
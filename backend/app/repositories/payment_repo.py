@@ -1,6 +1,6 @@
 # repositories/payment_repo.py
 from psycopg2.extras import RealDictCursor
-from ..pg_base import get_pg_conn
+from ..pg_base import pg_conn
 
 
 class PaymentRepository:
@@ -11,8 +11,7 @@ class PaymentRepository:
         """
         查詢某次就診的繳費資訊。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -29,8 +28,6 @@ class PaymentRepository:
                     (enct_id,),
                 )
                 return cur.fetchone()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_payments_for_patient(patient_id):
@@ -38,8 +35,7 @@ class PaymentRepository:
         查詢某位病人的所有繳費記錄。
         包含：繳費 ID、就診 ID、金額、付款方式、發票號碼等。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -67,8 +63,6 @@ class PaymentRepository:
                     (patient_id,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_payments_for_encounters(enct_ids):
@@ -79,8 +73,7 @@ class PaymentRepository:
         if not enct_ids:
             return []
         
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -98,16 +91,13 @@ class PaymentRepository:
                     (enct_ids,),
                 )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
     @staticmethod
     def upsert_payment_for_encounter(enct_id, amount, method, invoice_no):
         """
         建立或更新某次就診的費用資料（假設一個 encounter 只會有一筆 PAYMENT）。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             # 確保使用事務
             conn.autocommit = False
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
@@ -144,9 +134,4 @@ class PaymentRepository:
                 result = cur.fetchone()
                 conn.commit()
                 return result
-        except Exception as e:
-            conn.rollback()
-            raise
-        finally:
-            conn.close()
 
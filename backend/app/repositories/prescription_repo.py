@@ -1,18 +1,20 @@
 # repositories/prescription_repo.py
 from psycopg2.extras import RealDictCursor
-from ..pg_base import get_pg_conn
+from ..pg_base import pg_conn
 
 
 class PrescriptionRepository:
     """處理處方與用藥（PRESCRIPTION + INCLUDE）相關的資料庫操作"""
 
+    # 緩存資料庫是否已安裝 pg_trgm
+    _has_pg_trgm = None
+
     @staticmethod
     def get_prescription_for_encounter(enct_id):
         """
         查詢某次就診的處方箋（若有的話，包含用藥明細）。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -50,8 +52,6 @@ class PrescriptionRepository:
                 items = cur.fetchall()
                 header["items"] = items
                 return header
-        finally:
-            conn.close()
 
     @staticmethod
     def upsert_prescription_for_encounter(enct_id, status=1):
@@ -59,8 +59,7 @@ class PrescriptionRepository:
         建立或更新某次就診的處方箋（只管 PRESCRIPTION；INCLUDE 由 replace_prescription_items 負責）。
         注意：PRESCRIPTION 表沒有 status 欄位，此參數保留用於向後兼容但不會使用。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     "SELECT rx_id FROM PRESCRIPTION WHERE enct_id = %s;",
@@ -91,8 +90,6 @@ class PrescriptionRepository:
                 result = cur.fetchone()
                 conn.commit()
                 return result
-        finally:
-            conn.close()
 
     @staticmethod
     def replace_prescription_items(rx_id, items):
@@ -103,8 +100,7 @@ class PrescriptionRepository:
         items 每個元素預期包含：
             med_id, dosage, frequency, days, quantity
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute("DELETE FROM INCLUDE WHERE rx_id = %s;", (rx_id,))
 
@@ -127,8 +123,6 @@ class PrescriptionRepository:
                     )
 
                 conn.commit()
-        finally:
-            conn.close()
 
     @staticmethod
     def list_prescriptions_for_patient(patient_id):
@@ -137,8 +131,7 @@ class PrescriptionRepository:
         包含：處方 ID、就診 ID、用藥明細等。
         使用批量查詢避免 N+1 問題。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 查詢所有處方摘要
                 cur.execute(
@@ -205,8 +198,6 @@ class PrescriptionRepository:
                     rx["items"] = items_map.get(rx["rx_id"], [])
 
                 return prescriptions
-        finally:
-            conn.close()
 
     @staticmethod
     def list_prescriptions_for_encounters(enct_ids):
@@ -218,8 +209,7 @@ class PrescriptionRepository:
         if not enct_ids:
             return []
         
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 一次查詢所有處方摘要
                 cur.execute(
@@ -277,40 +267,132 @@ class PrescriptionRepository:
                     rx["items"] = items_map.get(rx_id, [])
                 
                 return prescriptions
-        finally:
-            conn.close()
 
     @staticmethod
-    def search_medications(query: str = None, limit: int = 50):
+    def _pg_trgm_available(conn):
+        """檢查資料庫是否已安裝 pg_trgm（緩存結果；安裝方式見 create_search_indexes.sql）"""
+        if PrescriptionRepository._has_pg_trgm is not None:
+            return PrescriptionRepository._has_pg_trgm
+
+        with conn.cursor() as cur:
+            cur.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm');")
+            PrescriptionRepository._has_pg_trgm = cur.fetchone()[0]
+        return PrescriptionRepository._has_pg_trgm
+
+    @staticmethod
+    def search_medications(
+        query: str = None,
+        limit: int = 50,
+        offset: int = 0,
+        spec: str = None,
+        unit: str = None,
+    ):
         """
-        搜尋藥品（med_id 和 name）。
-        如果提供 query，則搜尋 med_id 或 name 包含該字串的藥品。
+        搜尋藥品（med_id 和 name），依相符程度排序並支援分頁。
+        - query 為純數字且剛好是某個 med_id：該藥品排第一，其餘依下列規則排序
+        - query 少於 3 個字：藥名或 med_id 以 query 開頭（走 lower(name) 前綴索引）
+        - 其他：藥名或 med_id 包含 query，或藥名與 query 相似（pg_trgm），
+          排序為 藥名完全相同 > 藥名開頭 > 藥名包含 > med_id 包含 > 相似，同等級依相似度、med_id
+        - spec：規格包含該字串；unit：單位完全相同（不分大小寫）
+        未安裝 pg_trgm 時不做相似比對，其餘規則相同。
         """
-        conn = get_pg_conn()
-        try:
+        params = {"limit": limit, "offset": offset}
+        filters = []
+        if spec:
+            filters.append("AND m.spec ILIKE %(spec_pattern)s")
+            params["spec_pattern"] = f"%{_escape_like(spec)}%"
+        if unit:
+            filters.append("AND lower(m.unit) = lower(%(unit)s)")
+            params["unit"] = unit
+        filter_sql = "\n".join(filters)
+
+        query = (query or "").strip()
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                if query:
+                if not query:
                     cur.execute(
-                        """
-                        SELECT med_id, name, spec, unit
-                        FROM MEDICATION
-                        WHERE CAST(med_id AS TEXT) ILIKE %s OR name ILIKE %s
-                        ORDER BY med_id
-                        LIMIT %s;
+                        f"""
+                        SELECT m.med_id, m.name, m.spec, m.unit
+                        FROM MEDICATION m
+                        WHERE TRUE
+                        {filter_sql}
+                        ORDER BY m.med_id
+                        LIMIT %(limit)s OFFSET %(offset)s;
                         """,
-                        (f"%{query}%", f"%{query}%", limit),
+                        params,
                     )
+                    return cur.fetchall()
+
+                # 輸入完整 med_id 時該藥品排在最前面（其餘結果照常排序，分頁才能連續）
+                # isdigit() 也接受「²」等 int() 無法轉換的字元，所以同時要求 ASCII
+                if query.isascii() and query.isdigit():
+                    exact_id_sql = "(m.med_id = %(med_id)s) DESC,"
+                    params["med_id"] = int(query)
                 else:
+                    exact_id_sql = ""
+
+                escaped = _escape_like(query)
+                params.update(
+                    {
+                        "q": query,
+                        "prefix": f"{escaped}%",
+                        "pattern": f"%{escaped}%",
+                    }
+                )
+
+                if len(query) < 3:
+                    # 少於 3 個字無法使用 trigram 索引，只做前綴比對
                     cur.execute(
-                        """
-                        SELECT med_id, name, spec, unit
-                        FROM MEDICATION
-                        ORDER BY med_id
-                        LIMIT %s;
+                        f"""
+                        SELECT m.med_id, m.name, m.spec, m.unit
+                        FROM MEDICATION m
+                        WHERE (lower(m.name) LIKE lower(%(prefix)s)
+                               OR CAST(m.med_id AS TEXT) LIKE %(prefix)s)
+                        {filter_sql}
+                        ORDER BY
+                            {exact_id_sql}
+                            (lower(m.name) = lower(%(q)s)) DESC,
+                            (lower(m.name) LIKE lower(%(prefix)s)) DESC,
+                            m.med_id
+                        LIMIT %(limit)s OFFSET %(offset)s;
                         """,
-                        (limit,),
+                        params,
                     )
+                    return cur.fetchall()
+
+                if PrescriptionRepository._pg_trgm_available(conn):
+                    match_sql = "OR m.name %% %(q)s"
+                    similarity_sql = "similarity(m.name, %(q)s) DESC,"
+                else:
+                    match_sql = ""
+                    similarity_sql = ""
+
+                cur.execute(
+                    f"""
+                    SELECT m.med_id, m.name, m.spec, m.unit
+                    FROM MEDICATION m
+                    WHERE (m.name ILIKE %(pattern)s
+                           OR CAST(m.med_id AS TEXT) ILIKE %(pattern)s
+                           {match_sql})
+                    {filter_sql}
+                    ORDER BY
+                        {exact_id_sql}
+                        CASE
+                            WHEN lower(m.name) = lower(%(q)s) THEN 0
+                            WHEN m.name ILIKE %(prefix)s THEN 1
+                            WHEN m.name ILIKE %(pattern)s THEN 2
+                            WHEN CAST(m.med_id AS TEXT) ILIKE %(pattern)s THEN 3
+                            ELSE 4
+                        END,
+                        {similarity_sql}
+                        m.med_id
+                    LIMIT %(limit)s OFFSET %(offset)s;
+                    """,
+                    params,
+                )
                 return cur.fetchall()
-        finally:
-            conn.close()
 
+
+def _escape_like(text):
+    """跳脫 LIKE / ILIKE 的萬用字元，讓使用者輸入的 % 和 _ 視為一般字元"""
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
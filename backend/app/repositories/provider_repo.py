@@ -1,7 +1,12 @@
 # repositories/provider_repo.py
 from psycopg2.extras import RealDictCursor
-import psycopg2
-from ..pg_base import get_pg_conn
+from ..cache import TTLCache
+from ..config import PROVIDER_PROFILE_CACHE_TTL_SECONDS
+from ..events import DEPARTMENT_CATALOG_KEY, publish_invalidation
+from ..pg_base import pg_conn
+
+# 醫師基本資料：以 "provider:{user_id}" 標記，新增醫師或部門目錄變更時由 app.events 失效
+_profile_cache = TTLCache("provider_profile", PROVIDER_PROFILE_CACHE_TTL_SECONDS)
 
 
 class ProviderRepository:
@@ -13,10 +18,10 @@ class ProviderRepository:
         建立一個新的醫師帳號：
         - 在 USER 新增一筆 type = 'provider'
         - 在 PROVIDER 新增一筆
+        - 廣播快取失效（該醫師、該科別），所有 worker 的快取不會留著舊資料
         回傳：{ user_id, name, license_no, dept_id, active }
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 # 步驟 1: 在 USER 表中創建記錄（type = 'provider'）
                 cur.execute(
@@ -54,21 +59,16 @@ class ProviderRepository:
                 if not provider_row:
                     raise Exception(f"Failed to create PROVIDER record with user_id={new_user_id}")
                 
+                publish_invalidation(
+                    [f"provider:{new_user_id}", f"department:{provider_row['dept_id']}"], conn
+                )
+
                 # 提交事務（確保 USER 和 PROVIDER 記錄都成功創建）
                 conn.commit()
 
                 # 添加 name 到返回結果
                 provider_row["name"] = name
                 return provider_row
-        except psycopg2.IntegrityError as e:
-            # 重新拋出 IntegrityError，讓 service 層處理
-            conn.rollback()
-            raise e
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
 
     @staticmethod
     def authenticate_provider_by_license(license_no, hash_pwd):
@@ -76,8 +76,7 @@ class ProviderRepository:
         用 license_no + hash_pwd 驗證醫師身份。
         成功回傳 provider + user 資訊，失敗回傳 None。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -98,16 +97,22 @@ class ProviderRepository:
                     (license_no, hash_pwd),
                 )
                 return cur.fetchone()
-        finally:
-            conn.close()
 
     @staticmethod
     def get_provider_profile(provider_user_id):
         """
-        取得某位醫師的基本資料（姓名、科別）。
+        取得某位醫師的基本資料（姓名、科別），讀取行程內快取。
         """
-        conn = get_pg_conn()
-        try:
+        return _profile_cache.get_or_load(
+            provider_user_id,
+            lambda: ProviderRepository._load_provider_profile(provider_user_id),
+            tags=(f"provider:{provider_user_id}", DEPARTMENT_CATALOG_KEY),
+        )
+
+    @staticmethod
+    def _load_provider_profile(provider_user_id):
+        """get_provider_profile 的資料庫查詢（不經過快取）"""
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -127,6 +132,4 @@ class ProviderRepository:
                     (provider_user_id,),
                 )
                 return cur.fetchone()
-        finally:
-            conn.close()
 
@@ -1,8 +1,51 @@
 # repositories/session_repo.py
 from psycopg2.extras import RealDictCursor
-from ..pg_base import get_pg_conn
+from ..cache import TTLCache
+from ..config import SESSION_SEARCH_CACHE_TTL_SECONDS
+from ..events import notify_session_changes
+from ..pg_base import pg_conn
+from .appointment_repo import NON_OCCUPYING_STATUSES
 from ..lib.period_utils import period_to_start_time, period_to_end_time, is_period_time_valid
 
+# 門診搜尋結果（同步版與 asyncio 版共用）：門診時段有變更時由 app.events 依實體鍵失效
+session_search_cache = TTLCache("session_search", SESSION_SEARCH_CACHE_TTL_SECONDS)
+
+
+def session_search_tags(dept_id=None, provider_id=None):
+    """
+    門診搜尋結果的實體鍵（見 app.events.session_entity_keys）：
+    以最窄的條件標記，科別內任一門診變更只失效該科別的搜尋結果
+    """
+    if dept_id is not None:
+        return (f"department:{dept_id}",)
+    if provider_id is not None:
+        return (f"provider:{provider_id}",)
+    return ("sessions",)
+
+
+def session_ended_sql(alias="cs"):
+    """
+    門診時段已結束的 SQL 條件（依 period 的結束時間：1 → 12:00、2 → 17:00、3 → 21:00）。
+    讀取路徑以此條件把「仍為開診但已過結束時間」的 session 視為停診，
+    實際把 status 改成 2 由背景排程（app.jobs.session_expiry）負責。
+    """
+    return f"""(
+        {alias}.date < CURRENT_DATE
+        OR (
+            {alias}.date = CURRENT_DATE
+            AND (
+                ({alias}.period = 1 AND CURRENT_TIME >= TIME '12:00:00')
+                OR ({alias}.period = 2 AND CURRENT_TIME >= TIME '17:00:00')
+                OR ({alias}.period = 3 AND CURRENT_TIME >= TIME '21:00:00')
+            )
+        )
+    )"""
+
+
+def effective_status_sql(alias="cs"):
+    """門診時段的實際狀態：已過結束時間的開診 session 視為 2（停診）"""
+    return f"(CASE WHEN {alias}.status = 1 AND {session_ended_sql(alias)} THEN 2 ELSE {alias}.status END)"
+
 
 class SessionRepository:
     """處理門診時段（CLINIC_SESSION）相關的資料庫操作"""
@@ -12,36 +55,11 @@ class SessionRepository:
         """
         列出某位醫師的門診時段，可用日期區間與門診狀態過濾。
         回傳每個 session 目前已掛號人數 booked_count。
-        自動將已過期的 session status 更新為 2（停診）。
+        已過結束時間的 session 以 status = 2（停診）回傳（依條件判斷，不在讀取時寫入）。
         status: 1 = open (開診), 2 = closed (停診)
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # 先自動更新已過期的 session status（使用 period 計算結束時間）
-                # status: 1 = open (開診), 2 = closed (停診)
-                cur.execute(
-                    """
-                    UPDATE CLINIC_SESSION
-                    SET status = 2
-                    WHERE provider_id = %s
-                      AND status = 1
-                      AND (
-                          date < CURRENT_DATE 
-                          OR (
-                              date = CURRENT_DATE 
-                              AND (
-                                  (period = 1 AND CURRENT_TIME >= TIME '12:00:00')
-                                  OR (period = 2 AND CURRENT_TIME >= TIME '17:00:00')
-                                  OR (period = 3 AND CURRENT_TIME >= TIME '21:00:00')
-                              )
-                          )
-                      );
-                    """,
-                    (provider_user_id,)
-                )
-                conn.commit()
-
                 params = [provider_user_id]
                 conditions = ["cs.provider_id = %s"]
 
@@ -52,7 +70,7 @@ class SessionRepository:
                     conditions.append("cs.date <= %s")
                     params.append(to_date)
                 if status is not None:
-                    conditions.append("cs.status = %s")
+                    conditions.append(f"{effective_status_sql('cs')} = %s")
                     params.append(status)
 
                 where_clause = " AND ".join(conditions)
@@ -65,24 +83,10 @@ class SessionRepository:
                         cs.date,
                         cs.period,
                         cs.capacity,
-                        cs.status,
-                        COUNT(CASE WHEN COALESCE(ash_latest.to_status, 1) != 0 THEN a.appt_id END) AS booked_count
+                        {effective_status_sql('cs')} AS status,
+                        cs.booked_count
                     FROM CLINIC_SESSION cs
-                    LEFT JOIN APPOINTMENT a ON a.session_id = cs.session_id
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
                     WHERE {where_clause}
-                    GROUP BY cs.session_id,
-                             cs.provider_id,
-                             cs.date,
-                             cs.period,
-                             cs.capacity,
-                             cs.status
                     ORDER BY cs.date, cs.period;
                     """,
                     params,
@@ -93,8 +97,6 @@ class SessionRepository:
                     row["start_time"] = period_to_start_time(row["period"])
                     row["end_time"] = period_to_end_time(row["period"])
                 return rows
-        finally:
-            conn.close()
 
     @staticmethod
     def create_clinic_session(provider_user_id, date_, period, capacity):
@@ -102,8 +104,7 @@ class SessionRepository:
         醫師新增門診時段。
         status 預設為 1（開診）。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -116,22 +117,20 @@ class SessionRepository:
                     (provider_user_id, date_, period, capacity),
                 )
                 row = cur.fetchone()
+                notify_session_changes(conn, [row["session_id"]] if row else [])
                 conn.commit()
                 # 添加計算的 start_time 和 end_time（用於向後兼容）
                 if row:
                     row["start_time"] = period_to_start_time(row["period"])
                     row["end_time"] = period_to_end_time(row["period"])
                 return row
-        finally:
-            conn.close()
 
     @staticmethod
     def update_clinic_session(provider_user_id, session_id, date_, period, capacity, status):
         """
         醫師更新自己的門診時段（日期、時段、人數上限、狀態）。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
                 cur.execute(
                     """
@@ -147,14 +146,13 @@ class SessionRepository:
                     (date_, period, capacity, status, session_id, provider_user_id),
                 )
                 row = cur.fetchone()
+                notify_session_changes(conn, [row["session_id"]] if row else [])
                 conn.commit()
                 # 添加計算的 start_time 和 end_time（用於向後兼容）
                 if row:
                     row["start_time"] = period_to_start_time(row["period"])
                     row["end_time"] = period_to_end_time(row["period"])
                 return row
-        finally:
-            conn.close()
 
     @staticmethod
     def cancel_clinic_session(provider_user_id, session_id, cancel_status=2):
@@ -163,8 +161,7 @@ class SessionRepository:
         回傳 True/False 表示有沒有更新到。
         status: 1 = open (開診), 2 = closed (停診)
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
@@ -175,53 +172,30 @@ class SessionRepository:
                     """,
                     (cancel_status, session_id, provider_user_id),
                 )
+                updated = cur.rowcount > 0
+                if updated:
+                    notify_session_changes(conn, [session_id])
                 conn.commit()
-                return cur.rowcount > 0
-        finally:
-            conn.close()
+                return updated
 
     @staticmethod
     def get_session_by_id(session_id):
         """
         根據 session_id 取得門診時段資訊，包含 provider 和 department 資訊。
-        自動將已過期的 session status 更新為 2（停診）。
+        已過結束時間的 session 以 status = 2（停診）回傳（依條件判斷，不在讀取時寫入）。
         status: 1 = open (開診), 2 = closed (停診)
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                # 先自動更新已過期的 session status（使用 period 計算結束時間）
                 cur.execute(
-                    """
-                    UPDATE CLINIC_SESSION
-                    SET status = 2
-                    WHERE session_id = %s
-                      AND status = 1
-                      AND (
-                          date < CURRENT_DATE 
-                          OR (
-                              date = CURRENT_DATE 
-                              AND (
-                                  (period = 1 AND CURRENT_TIME >= TIME '12:00:00')
-                                  OR (period = 2 AND CURRENT_TIME >= TIME '17:00:00')
-                                  OR (period = 3 AND CURRENT_TIME >= TIME '21:00:00')
-                              )
-                          )
-                      );
-                    """,
-                    (session_id,)
-                )
-                conn.commit()
-
-                cur.execute(
-                    """
+                    f"""
                     SELECT
                         cs.session_id,
                         cs.provider_id,
                         cs.date,
                         cs.period,
                         cs.capacity,
-                        cs.status,
+                        {effective_status_sql('cs')} AS status,
                         pr.dept_id,
                         u.name AS provider_name,
                         pr.license_no,
@@ -241,49 +215,22 @@ class SessionRepository:
                     row["start_time"] = period_to_start_time(row["period"])
                     row["end_time"] = period_to_end_time(row["period"])
                 return row
-        finally:
-            conn.close()
 
     @staticmethod
     def get_booked_count(session_id):
         """
         取得某個門診時段的已預約數量（排除已取消的掛號）。
+        直接讀取 CLINIC_SESSION.booked_count（由 AppointmentRepository._insert_status_history 維護）。
         如果 session 不存在，回傳 None。
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
-                # 先檢查 session 是否存在
                 cur.execute(
-                    "SELECT session_id FROM CLINIC_SESSION WHERE session_id = %s;",
-                    (session_id,),
-                )
-                if not cur.fetchone():
-                    return None
-
-                cur.execute(
-                    """
-                    SELECT COUNT(CASE WHEN COALESCE(ash_latest.to_status, 1) != 0 
-                                         AND COALESCE(ash_latest.to_status, 1) != 4 
-                                    THEN a.appt_id END) AS booked_count
-                    FROM CLINIC_SESSION cs
-                    LEFT JOIN APPOINTMENT a ON a.session_id = cs.session_id
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
-                    WHERE cs.session_id = %s
-                    GROUP BY cs.session_id;
-                    """,
+                    "SELECT booked_count FROM CLINIC_SESSION WHERE session_id = %s;",
                     (session_id,),
                 )
                 row = cur.fetchone()
-                return row[0] if row else 0
-        finally:
-            conn.close()
+                return row[0] if row else None
 
     @staticmethod
     def is_session_time_valid(session_date, period):
@@ -291,19 +238,16 @@ class SessionRepository:
         檢查門診時段是否在時間範圍內（當前時間在該 period 的時間範圍內）。
         回傳 (is_valid, session_info) 元組。
         """
-        conn = get_pg_conn()
-        try:
-            is_valid = is_period_time_valid(session_date, period)
-            # 返回 session_info（包含計算的時間）
-            session_info = {
-                "date": session_date,
-                "period": period,
-                "start_time": period_to_start_time(period),
-                "end_time": period_to_end_time(period),
-            }
-            return is_valid, session_info
-        finally:
-            conn.close()
+        # 純時間計算，不需要向連線池借連線
+        is_valid = is_period_time_valid(session_date, period)
+        # 返回 session_info（包含計算的時間）
+        session_info = {
+            "date": session_date,
+            "period": period,
+            "start_time": period_to_start_time(period),
+            "end_time": period_to_end_time(period),
+        }
+        return is_valid, session_info
 
     @staticmethod
     def get_remaining_capacity(session_id):
@@ -311,25 +255,13 @@ class SessionRepository:
         取得某個門診時段的剩餘容量。
         回傳：capacity - booked_count
         """
-        conn = get_pg_conn()
-        try:
+        with pg_conn() as conn:
             with conn.cursor() as cur:
                 cur.execute(
                     """
-                    SELECT
-                        cs.capacity,
-                        COUNT(CASE WHEN COALESCE(ash_latest.to_status, 1) != 0 THEN a.appt_id END) AS booked_count
-                    FROM CLINIC_SESSION cs
-                    LEFT JOIN APPOINTMENT a ON a.session_id = cs.session_id
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
-                    WHERE cs.session_id = %s
-                    GROUP BY cs.session_id, cs.capacity;
+                    SELECT capacity, booked_count
+                    FROM CLINIC_SESSION
+                    WHERE session_id = %s;
                     """,
                     (session_id,),
                 )
@@ -339,126 +271,86 @@ class SessionRepository:
                     booked_count = row[1] if row[1] else 0
                     return max(0, capacity - booked_count)
                 return None
-        finally:
-            conn.close()
 
     @staticmethod
     def search_sessions(dept_id=None, provider_id=None, date_=None):
         """
         搜尋門診時段，可根據科別、醫師、日期過濾。
         回傳每個 session 的資訊，包含 provider 和 department 資訊，以及已預約人數。
-        自動將已過期的 session status 更新為 0（停診）。
+        已過結束時間的 session 依條件排除（不在讀取時寫入，status 由背景排程更新）。
+        結果快取在行程內（session_search_cache），任何 worker 寫入門診或掛號後即失效。
         
         注意：門診的科別（dept_name）來自該門診醫師的科別。
         查詢邏輯：CLINIC_SESSION → PROVIDER (provider_id) → DEPARTMENT (dept_id)
         """
-        conn = get_pg_conn()
-        try:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                try:
-                    # 先自動更新已過期的 session status（使用 period 計算結束時間）
-                    # status: 1 = open (開診), 2 = closed (停診)
-                    cur.execute(
-                        """
-                        UPDATE CLINIC_SESSION
-                        SET status = 2
-                        WHERE status = 1
-                          AND (
-                              date < CURRENT_DATE 
-                              OR (
-                                  date = CURRENT_DATE 
-                                  AND (
-                                      (period = 1 AND CURRENT_TIME >= TIME '12:00:00')
-                                      OR (period = 2 AND CURRENT_TIME >= TIME '17:00:00')
-                                      OR (period = 3 AND CURRENT_TIME >= TIME '21:00:00')
-                                  )
-                              )
-                          );
-                        """
-                    )
-                    conn.commit()
-                except Exception as update_error:
-                    # 如果更新失敗（可能是約束問題），記錄錯誤但繼續執行查詢
-                    conn.rollback()
-                    print(f"Warning: Failed to update expired sessions: {update_error}")
-                    # 繼續執行，不中斷查詢
+        return session_search_cache.get_or_load(
+            (dept_id, provider_id, date_),
+            lambda: SessionRepository._load_search_sessions(dept_id, provider_id, date_),
+            tags=session_search_tags(dept_id, provider_id),
+        )
 
-                conditions = []
-                params = []
+    @staticmethod
+    def _load_search_sessions(dept_id, provider_id, date_):
+        """search_sessions 的資料庫查詢（不經過快取）"""
+        with pg_conn() as conn:
+            try:
+                with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                    conditions = []
+                    params = []
 
-                # 只顯示正常狀態的門診（status = 1），不顯示已停診的門診
-                conditions.append("cs.status = 1")
+                    # 只顯示正常狀態的門診（status = 1），不顯示已停診或已過結束時間的門診
+                    conditions.append("cs.status = 1")
+                    conditions.append(f"NOT {session_ended_sql('cs')}")
 
-                if dept_id is not None:
-                    conditions.append("pr.dept_id = %s")
-                    params.append(dept_id)
+                    if dept_id is not None:
+                        conditions.append("pr.dept_id = %s")
+                        params.append(dept_id)
 
-                if provider_id is not None:
-                    conditions.append("cs.provider_id = %s")
-                    params.append(provider_id)
+                    if provider_id is not None:
+                        conditions.append("cs.provider_id = %s")
+                        params.append(provider_id)
 
-                if date_ is not None:
-                    conditions.append("cs.date = %s")
-                    params.append(date_)
+                    if date_ is not None:
+                        conditions.append("cs.date = %s")
+                        params.append(date_)
 
-                where_clause = " AND ".join(conditions)
+                    where_clause = " AND ".join(conditions)
 
-                cur.execute(
-                    f"""
-                    SELECT
-                        cs.session_id,
-                        cs.provider_id,
-                        cs.date,
-                        cs.period,
-                        cs.capacity,
-                        cs.status,
-                        pr.dept_id,
-                        u.name AS provider_name,
-                        pr.license_no,
-                        d.name AS dept_name,
-                        COALESCE(d.location, '') AS department_location,
-                        COUNT(CASE WHEN COALESCE(ash_latest.to_status, 1) != 0 THEN a.appt_id END) AS booked_count
-                    FROM CLINIC_SESSION cs
-                    JOIN PROVIDER pr ON cs.provider_id = pr.user_id
-                    JOIN "USER" u ON pr.user_id = u.user_id
-                    LEFT JOIN DEPARTMENT d ON pr.dept_id = d.dept_id
-                    LEFT JOIN APPOINTMENT a ON a.session_id = cs.session_id
-                    LEFT JOIN LATERAL (
-                        SELECT ash.to_status
-                        FROM APPOINTMENT_STATUS_HISTORY ash
-                        WHERE ash.appt_id = a.appt_id
-                        ORDER BY ash.changed_at DESC
-                        LIMIT 1
-                    ) AS ash_latest ON TRUE
-                    WHERE {where_clause}
-                    GROUP BY cs.session_id,
-                             cs.provider_id,
-                             cs.date,
-                             cs.period,
-                             cs.capacity,
-                             cs.status,
-                             pr.dept_id,
-                             u.name,
-                             pr.license_no,
-                             d.name,
-                             d.location
-                    ORDER BY cs.date, cs.period;
-                    """,
-                    params,
-                )
-                rows = cur.fetchall()
-                # 為每個 session 添加計算的 start_time 和 end_time（用於向後兼容）
-                for row in rows:
-                    row["start_time"] = period_to_start_time(row["period"])
-                    row["end_time"] = period_to_end_time(row["period"])
-                return rows
-        except Exception as e:
-            print(f"Error in search_sessions: {e}")
-            import traceback
-            traceback.print_exc()
-            raise
-        finally:
-            conn.close()
+                    cur.execute(
+                        f"""
+                        SELECT
+                            cs.session_id,
+                            cs.provider_id,
+                            cs.date,
+                            cs.period,
+                            cs.capacity,
+                            cs.status,
+                            pr.dept_id,
+                            u.name AS provider_name,
+                            pr.license_no,
+                            d.name AS dept_name,
+                            COALESCE(d.location, '') AS department_location,
+                            cs.booked_count
+                        FROM CLINIC_SESSION cs
+                        JOIN PROVIDER pr ON cs.provider_id = pr.user_id
+                        JOIN "USER" u ON pr.user_id = u.user_id
+                        LEFT JOIN DEPARTMENT d ON pr.dept_id = d.dept_id
+                        WHERE {where_clause}
+                        ORDER BY cs.date, cs.period;
+                        """,
+                        params,
+                    )
+                    rows = cur.fetchall()
+                    # 為每個 session 添加計算的 start_time 和 end_time（用於向後兼容）
+                    for row in rows:
+                        row["start_time"] = period_to_start_time(row["period"])
+                        row["end_time"] = period_to_end_time(row["period"])
+                    return rows
+            except Exception as e:
+                print(f"Error in search_sessions: {e}")
+                import traceback
+                traceback.print_exc()
+                raise
 
     @staticmethod
     def update_expired_sessions(provider_id=None):
@@ -468,52 +360,103 @@ class SessionRepository:
         回傳更新的數量。
         status: 1 = open (開診), 2 = closed (停診)
         """
-        conn = get_pg_conn()
-        try:
+        conditions = ["cs.status = 1", session_ended_sql("cs")]
+        params = []
+        if provider_id is not None:
+            conditions.append("cs.provider_id = %s")
+            params.append(provider_id)
+        where_clause = " AND ".join(conditions)
+
+        with pg_conn() as conn:
             with conn.cursor() as cur:
-                if provider_id is not None:
-                    cur.execute(
-                        """
-                        UPDATE CLINIC_SESSION
-                        SET status = 2
-                        WHERE provider_id = %s
-                          AND status = 1
-                          AND (
-                              date < CURRENT_DATE 
-                              OR (
-                                  date = CURRENT_DATE 
-                                  AND (
-                                      (period = 1 AND CURRENT_TIME >= TIME '12:00:00')
-                                      OR (period = 2 AND CURRENT_TIME >= TIME '17:00:00')
-                                      OR (period = 3 AND CURRENT_TIME >= TIME '21:00:00')
-                                  )
-                              )
-                          );
-                        """,
-                        (provider_id,)
-                    )
-                else:
-                    cur.execute(
-                        """
-                        UPDATE CLINIC_SESSION
-                        SET status = 2
-                        WHERE status = 1
-                          AND (
-                              date < CURRENT_DATE 
-                              OR (
-                                  date = CURRENT_DATE 
-                                  AND (
-                                      (period = 1 AND CURRENT_TIME >= TIME '12:00:00')
-                                      OR (period = 2 AND CURRENT_TIME >= TIME '17:00:00')
-                                      OR (period = 3 AND CURRENT_TIME >= TIME '21:00:00')
-                                  )
-                              )
-                          );
-                        """
-                    )
+                cur.execute(
+                    f"""
+                    UPDATE CLINIC_SESSION cs
+                    SET status = 2
+                    WHERE {where_clause}
+                    RETURNING cs.session_id;
+                    """,
+                    params,
+                )
                 updated_count = cur.rowcount
+                notify_session_changes(conn, [row[0] for row in cur.fetchall()])
                 conn.commit()
                 return updated_count
-        finally:
-            conn.close()
 
+    @staticmethod
+    def reconcile_booked_counts(session_ids=None, repair=True):
+        """
+        比對 CLINIC_SESSION.booked_count 與實際佔用名額的掛號數（排除 NON_OCCUPYING_STATUSES），
+        回傳不一致的 session 清單 [{session_id, booked_count, actual_count}]。
+        repair=True 時修正為實際值並送出門診時段變更通知；session_ids 為 None 時檢查全部 session。
+        """
+        conditions = ["cs.booked_count <> COALESCE(actual.actual_count, 0)"]
+        params = [list(NON_OCCUPYING_STATUSES)]
+        if session_ids is not None:
+            conditions.append("cs.session_id = ANY(%s)")
+            params.append(list(session_ids))
+        where_clause = " AND ".join(conditions)
+
+        with pg_conn() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                # 1. 不加鎖找出可能不一致的 session
+                cur.execute(
+                    f"""
+                    WITH actual AS (
+                        SELECT a.session_id, COUNT(*) AS actual_count
+                        FROM APPOINTMENT a
+                        WHERE a.current_status <> ALL(%s)
+                        GROUP BY a.session_id
+                    )
+                    SELECT
+                        cs.session_id,
+                        cs.booked_count,
+                        COALESCE(actual.actual_count, 0) AS actual_count
+                    FROM CLINIC_SESSION cs
+                    LEFT JOIN actual ON actual.session_id = cs.session_id
+                    WHERE {where_clause}
+                    ORDER BY cs.session_id;
+                    """,
+                    params,
+                )
+                drifted = cur.fetchall()
+                if not repair or not drifted:
+                    return drifted
+
+                drifted_ids = [row["session_id"] for row in drifted]
+
+                # 2. 依 session_id 順序鎖定（與掛號交易相同的鎖），確保重新計算時沒有進行中的掛號
+                cur.execute(
+                    """
+                    SELECT session_id
+                    FROM CLINIC_SESSION
+                    WHERE session_id = ANY(%s)
+                    ORDER BY session_id
+                    FOR UPDATE;
+                    """,
+                    (drifted_ids,),
+                )
+
+                # 3. 取得鎖之後用新的 snapshot 重新計算並修正
+                cur.execute(
+                    """
+                    UPDATE CLINIC_SESSION cs
+                    SET booked_count = (
+                        SELECT COUNT(*)
+                        FROM APPOINTMENT a
+                        WHERE a.session_id = cs.session_id
+                          AND a.current_status <> ALL(%s)
+                    )
+                    WHERE cs.session_id = ANY(%s)
+                    RETURNING cs.session_id, cs.booked_count AS actual_count;
+                    """,
+                    (list(NON_OCCUPYING_STATUSES), drifted_ids),
+                )
+                repaired = {row["session_id"]: row["actual_count"] for row in cur.fetchall()}
+                # 修正後的名額要通知搜尋快取與 /events 訂閱者
+                notify_session_changes(conn, list(repaired))
+                conn.commit()
+
+                for row in drifted:
+                    row["actual_count"] = repaired.get(row["session_id"], row["actual_count"])
+                return drifted
@@ -1,6 +1,9 @@
 # routers/__init__.py
 from .patient_router import router as patient_router
 from .provider_router import router as provider_router
+from .export_router import router as export_router
+from .stats_router import router as stats_router
+from .events_router import router as events_router
 
-__all__ = ["patient_router", "provider_router"]
+__all__ = ["patient_router", "provider_router", "export_router", "stats_router", "events_router"]
 
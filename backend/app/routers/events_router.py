@@ -0,0 +1,38 @@
+# routers/events_router.py
+from fastapi import APIRouter, Request
+from fastapi.responses import StreamingResponse
+
+from ..services.event_service import EventService, SSE_MEDIA_TYPE, SSE_HEADERS
+
+router = APIRouter()
+event_service = EventService()
+
+
+@router.get("/sessions/{session_id}")
+async def api_session_events(request: Request, session_id: int):
+    """
+    訂閱單一門診時段的變更（Server-Sent Events）。
+    每筆事件為 event: session，data 為 {session_id, dept_id, capacity, booked_count, status, ...}；
+    收到 event: resync 時請重新載入（伺服器的 LISTEN 連線曾中斷，可能漏掉事件）。
+    """
+    return StreamingResponse(
+        event_service.stream_session_events(request, session_id),
+        media_type=SSE_MEDIA_TYPE,
+        headers=SSE_HEADERS,
+    )
+
+
+@router.get("/departments/{dept_id}")
+async def api_department_events(request: Request, dept_id: int):
+    """訂閱科別內所有門診時段的變更（Server-Sent Events），事件格式同 /events/sessions/{session_id}"""
+    return StreamingResponse(
+        event_service.stream_department_events(request, dept_id),
+        media_type=SSE_MEDIA_TYPE,
+        headers=SSE_HEADERS,
+    )
+
+
+@router.get("/stats")
+async def api_event_stats():
+    """本 worker 的 LISTEN 連線狀態與訂閱者、分送統計"""
+    return event_service.get_stats()
@@ -0,0 +1,35 @@
+# routers/export_router.py
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Query
+from fastapi.responses import StreamingResponse
+
+from ..services.export_service import ExportService
+
+router = APIRouter()
+export_service = ExportService()
+
+
+@router.get("/{dataset}")
+def api_export(
+    dataset: str,
+    date_from: date = Query(...),
+    date_to: date = Query(...),
+    format: str = Query("ndjson"),
+    patient_id: Optional[int] = Query(None),
+    provider_id: Optional[int] = Query(None),
+):
+    """
+    依就診日期區間（含兩端）串流匯出資料，可再以 patient_id / provider_id 篩選。
+    dataset：encounters、diagnoses、prescriptions（一列一個用藥明細）、lab_results、payments
+    format：ndjson（預設）或 csv
+    資料以 server-side cursor 分批讀取並直接寫出，整年份的匯出記憶體用量也固定。
+    """
+    export_service.validate(dataset, format, date_from, date_to)
+    filename = f"{dataset}_{date_from.isoformat()}_{date_to.isoformat()}.{format}"
+    return StreamingResponse(
+        export_service.stream_export(dataset, format, date_from, date_to, patient_id, provider_id),
+        media_type=export_service.media_type(format),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
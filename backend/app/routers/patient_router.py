@@ -1,16 +1,29 @@
 # routers/patient_router.py
-from fastapi import APIRouter, HTTPException, Query
-from datetime import date
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from datetime import date, datetime
 from typing import Optional
 from pydantic import BaseModel
 
-from ..services.shared import AppointmentService, SessionService
+from ..services.shared import (
+    AppointmentService,
+    SessionService,
+    AsyncAppointmentService,
+    AsyncSessionService,
+    IdempotencyService,
+    AsyncIdempotencyService,
+)
 from ..services.patient_history_service import PatientHistoryService
 from ..services.patient_service import PatientService
+from ..config import HISTORY_PAGE_SIZE_MAX
 
 router = APIRouter()
 appointment_service = AppointmentService()
 session_service = SessionService()
+async_appointment_service = AsyncAppointmentService()
+async_session_service = AsyncSessionService()
+idempotency_service = IdempotencyService()
+async_idempotency_service = AsyncIdempotencyService()
 history_service = PatientHistoryService()
 patient_service = PatientService()
 
@@ -42,6 +55,7 @@ class PatientLoginResponse(BaseModel):
 
 class AppointmentCreateRequest(BaseModel):
     session_id: int
+    join_waitlist: bool = True  # 額滿時加入候補（False 則回傳 409）
 
 
 class AppointmentRescheduleRequest(BaseModel):
@@ -92,7 +106,7 @@ def api_get_patient_profile(patient_id: int):
 
 
 @router.get("/sessions")
-def api_list_sessions(
+async def api_list_sessions(
     dept_id: Optional[int] = Query(None),
     provider_id: Optional[int] = Query(None),
     date_: Optional[date] = Query(None, alias="date"),
@@ -101,7 +115,7 @@ def api_list_sessions(
     列出可預約的門診時段。
     可根據科別、醫師、日期過濾。
     """
-    return session_service.search_sessions(
+    return await async_session_service.search_sessions(
         dept_id=dept_id,
         provider_id=provider_id,
         date_=date_,
@@ -118,19 +132,29 @@ def api_list_appointments(patient_id: int = Query(...)):
 
 
 @router.post("/appointments")
-def api_create_appointment(
+async def api_create_appointment(
     patient_id: int = Query(...),
     body: AppointmentCreateRequest = ...,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
     """
     建立掛號：
-    - 使用 transaction + FOR UPDATE 避免併行衝突
-    - slot_seq = 已掛號人數 + 1
+    - 同一門診時段的併發請求由掛號引擎合併成一批，整批只鎖定門診時段一次
+    - slot_seq 由門診時段的序號計數器配發
     - 寫入 APPOINTMENT_STATUS_HISTORY
+    - 額滿且 join_waitlist 時加入候補（status = 6、waitlist_position），有人取消時依序自動遞補
+    - 帶 Idempotency-Key header 時，以相同的鍵重送會回傳第一次的結果
     """
-    return appointment_service.create_appointment(
-        patient_id=patient_id,
-        session_id=body.session_id,
+    return await async_idempotency_service.run(
+        patient_id,
+        idempotency_key,
+        "create_appointment",
+        f"session_id={body.session_id}&join_waitlist={body.join_waitlist}",
+        lambda: async_appointment_service.create_appointment(
+            patient_id=patient_id,
+            session_id=body.session_id,
+            join_waitlist=body.join_waitlist,
+        ),
     )
 
 
@@ -138,16 +162,25 @@ def api_create_appointment(
 def api_cancel_appointment(
     appt_id: int,
     patient_id: int = Query(...),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
     """
     取消掛號：
     - 驗證 patient_id 是否匹配
     - 更新狀態為「已取消」
     - 寫入 APPOINTMENT_STATUS_HISTORY
+    - 釋出的名額由候補依序遞補
+    - 帶 Idempotency-Key header 時，以相同的鍵重送會回傳第一次的結果
     """
-    return appointment_service.cancel_appointment(
-        appt_id=appt_id,
-        patient_id=patient_id,
+    return idempotency_service.run(
+        patient_id,
+        idempotency_key,
+        "cancel_appointment",
+        f"appt_id={appt_id}",
+        lambda: appointment_service.cancel_appointment(
+            appt_id=appt_id,
+            patient_id=patient_id,
+        ),
     )
 
 
@@ -156,29 +189,40 @@ def api_reschedule_appointment(
     appt_id: int,
     patient_id: int = Query(...),
     body: AppointmentRescheduleRequest = ...,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
 ):
     """
     修改掛號（更換門診時段）：
     - 使用固定鎖序避免死鎖
     - 更新 session_id 和 slot_seq
     - 寫入 APPOINTMENT_STATUS_HISTORY
+    - 帶 Idempotency-Key header 時，以相同的鍵重送會回傳第一次的結果
     """
-    # 獲取掛號資訊並驗證權限
-    from ..repositories import AppointmentRepository
-    appointment = AppointmentRepository.get_appointment_by_id(appt_id)
-    
-    if appointment is None or appointment["patient_id"] != patient_id:
-        raise HTTPException(
-            status_code=404,
-            detail="Appointment not found or patient_id does not match"
+    def reschedule():
+        # 獲取掛號資訊並驗證權限
+        from ..repositories import AppointmentRepository
+        appointment = AppointmentRepository.get_appointment_by_id(appt_id)
+
+        if appointment is None or appointment["patient_id"] != patient_id:
+            raise HTTPException(
+                status_code=404,
+                detail="Appointment not found or patient_id does not match"
+            )
+
+        old_session_id = appointment["session_id"]
+
+        return appointment_service.modify_appointment(
+            appt_id=appt_id,
+            old_session_id=old_session_id,
+            new_session_id=body.new_session_id,
         )
-    
-    old_session_id = appointment["session_id"]
-    
-    return appointment_service.modify_appointment(
-        appt_id=appt_id,
-        old_session_id=old_session_id,
-        new_session_id=body.new_session_id,
+
+    return idempotency_service.run(
+        patient_id,
+        idempotency_key,
+        "reschedule_appointment",
+        f"appt_id={appt_id}&new_session_id={body.new_session_id}",
+        reschedule,
     )
 
 
@@ -200,14 +244,53 @@ def api_checkin_appointment(
 
 
 @router.get("/history")
-def api_get_patient_history(patient_id: int = Query(...)):
+def api_get_patient_history(
+    patient_id: int = Query(...),
+    stream: bool = Query(False),
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_PAGE_SIZE_MAX),
+    cursor: Optional[str] = Query(None),
+    updated_since: Optional[datetime] = Query(None),
+):
     """
     取得某位病人的完整歷史記錄。
     包含：所有就診記錄、處方箋、檢驗結果、繳費記錄。
+    stream=true 時由 PostgreSQL 組好 JSON 並串流回傳（單一查詢，適合就診次數很多的病人）。
+    帶 limit / cursor / updated_since 任一參數時改為分頁模式：
+    - 依就診時間由新到舊，每頁 limit 筆就診及其相關資料，next_cursor 帶入下一次請求的 cursor
+    - updated_since 帶入上次回傳的 sync_token，只回傳之後有變更的就診
     """
+    if limit is not None or cursor is not None or updated_since is not None:
+        return history_service.get_patient_history_page(patient_id, limit, cursor, updated_since)
+    if stream:
+        return StreamingResponse(
+            history_service.stream_patient_history(patient_id),
+            media_type="application/json",
+        )
     return history_service.get_patient_history(patient_id)
 
 
+@router.get("/statistics")
+def api_get_patient_statistics(patient_id: int = Query(...)):
+    """
+    病人儀表板統計：年度就診次數、各科別就診分布、常見診斷 top 10。
+    讀取預先計算的病人統計 cube（隨分析快照更新），as_of 為資料時間。
+    """
+    return patient_service.get_patient_statistics(patient_id)
+
+
+@router.get("/notifications")
+def api_list_notifications(
+    patient_id: int = Query(...),
+    after_id: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500),
+):
+    """
+    病人的通知事件（例如 waitlist_promoted：候補已遞補為正式掛號）。
+    用回傳的 next_after_id 作為下一次的 after_id，只取新的通知。
+    """
+    return patient_service.list_notifications(patient_id, after_id, limit)
+
+
 @router.get("/payments")
 def api_list_payments(patient_id: int = Query(...)):
     """
@@ -232,7 +315,7 @@ def api_pay_online(
     注意：實際金額由系統計算，此處只更新付款資訊
     """
     from ..repositories import PaymentRepository
-    from ..pg_base import get_pg_conn
+    from ..pg_base import pg_conn
     from psycopg2.extras import RealDictCursor
     
     payment_repo = PaymentRepository()
@@ -245,8 +328,7 @@ def api_pay_online(
     enct_id = payment["enct_id"]
     
     # 驗證 encounter 是否屬於該病人（使用單次查詢）
-    conn = get_pg_conn()
-    try:
+    with pg_conn() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
                 """
@@ -262,8 +344,6 @@ def api_pay_online(
                     status_code=403,
                     detail="Payment does not belong to this patient"
                 )
-    finally:
-        conn.close()
     
     # 更新付款資訊（保持原金額）
     return payment_repo.upsert_payment_for_encounter(
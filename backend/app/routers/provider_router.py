@@ -1,10 +1,11 @@
 # routers/provider_router.py
 from fastapi import APIRouter, Query, HTTPException
-from datetime import date, time
+from datetime import date, time, datetime
 from typing import Optional, List
 from pydantic import BaseModel
 
 from ..services import ProviderService
+from ..config import HISTORY_PAGE_SIZE_MAX
 
 router = APIRouter()
 service = ProviderService()
@@ -258,9 +259,15 @@ def api_search_diseases(query: Optional[str] = Query(None), limit: int = Query(5
 
 
 @router.get("/medications")
-def api_search_medications(query: Optional[str] = Query(None), limit: int = Query(50, le=200)):
-    """搜尋藥品（med_id 和 name）"""
-    return service.search_medications(query, limit)
+def api_search_medications(
+    query: Optional[str] = Query(None),
+    limit: int = Query(50, le=200),
+    offset: int = Query(0, ge=0),
+    spec: Optional[str] = Query(None),
+    unit: Optional[str] = Query(None),
+):
+    """搜尋藥品（med_id 和 name），依相符程度排序；spec 為規格包含、unit 為單位完全相同"""
+    return service.search_medications(query, limit, offset, spec, unit)
 
 
 @router.get("/{provider_id}/encounters/{enct_id}/prescription")
@@ -345,20 +352,32 @@ def api_create_payment(provider_id: int, enct_id: int, body: PaymentCreate):
 
 
 @router.get("/{provider_id}/patients/{patient_id}/history")
-def api_get_patient_history(provider_id: int, patient_id: int):
+def api_get_patient_history(
+    provider_id: int,
+    patient_id: int,
+    limit: Optional[int] = Query(None, ge=1, le=HISTORY_PAGE_SIZE_MAX),
+    cursor: Optional[str] = Query(None),
+    updated_since: Optional[datetime] = Query(None),
+):
     """
     醫師查詢某位病患的所有就診記錄、診斷與檢驗報告（不限醫師、科別）。
     回傳包含：
     - encounters: 所有就診記錄
     - diagnoses: 所有診斷
     - lab_results: 所有檢驗結果
+    帶 limit / cursor / updated_since 任一參數時改為分頁模式：
+    只回傳一頁就診及其診斷、檢驗結果，另含 next_cursor 與 sync_token。
+    """
+    if limit is not None or cursor is not None or updated_since is not None:
+        return service.get_patient_history_page(patient_id, limit, cursor, updated_since)
+    return service.get_patient_history(patient_id)
+
+
+@router.get("/{provider_id}/patients/{patient_id}/statistics")
+def api_get_patient_statistics(provider_id: int, patient_id: int):
+    """
+    醫師查看病患的統計摘要：年度就診次數、各科別就診分布、常見診斷 top 10。
+    讀取預先計算的病人統計 cube（隨分析快照更新），as_of 為資料時間。
     """
-    encounters = service.list_all_encounters_for_patient(patient_id)
-    diagnoses = service.list_all_diagnoses_for_patient(patient_id)
-    lab_results = service.list_all_lab_results_for_patient(patient_id)
-    return {
-        "encounters": encounters,
-        "diagnoses": diagnoses,
-        "lab_results": lab_results,
-    }
+    return service.get_patient_statistics(patient_id)
 
@@ -0,0 +1,36 @@
+# routers/stats_router.py
+from datetime import date
+
+from fastapi import APIRouter, Query, Response
+
+from ..services.stats_service import StatsService
+
+router = APIRouter()
+stats_service = StatsService()
+
+
+@router.get("/encounters")
+def api_encounter_stats(
+    date_from: date = Query(...),
+    date_to: date = Query(...),
+    granularity: str = Query("day"),
+    group_by: str = Query("none"),
+    format: str = Query("json"),
+):
+    """
+    全院看診次數統計，日期區間（含兩端）：
+    - granularity：day（預設）、month、year
+    - group_by：none（預設）、department（科別）、provider（醫師）
+    - format：json（預設）、arrow（Arrow IPC stream）、parquet
+    讀取分析快照的每日彙總，資料時間見 as_of（JSON）；月、年統計由每日彙總加總，不掃描就診明細。
+    """
+    stats_service.validate_encounter_stats(date_from, date_to, granularity, group_by, format)
+    if format == "json":
+        return stats_service.get_encounter_stats(date_from, date_to, granularity, group_by)
+
+    filename = f"encounters_{granularity}_{date_from.isoformat()}_{date_to.isoformat()}.{format}"
+    return Response(
+        content=stats_service.encounter_stats_bytes(date_from, date_to, granularity, group_by, format),
+        media_type=stats_service.media_type(format),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
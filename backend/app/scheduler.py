@@ -0,0 +1,305 @@
+# scheduler.py
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from .config import (
+    SESSION_EXPIRY_INTERVAL_SECONDS,
+    NO_SHOW_INTERVAL_SECONDS,
+    DEPARTMENT_CACHE_TTL_SECONDS,
+    DISEASE_INDEX_CHECK_INTERVAL_SECONDS,
+    ANALYTICS_SNAPSHOT_INTERVAL_SECONDS,
+    IDEMPOTENCY_PURGE_INTERVAL_SECONDS,
+    BOOKED_COUNT_RECONCILE_INTERVAL_SECONDS,
+)
+from .jobs import (
+    run_session_expiry,
+    run_no_show_processing,
+    run_department_cache_warm,
+    run_disease_index_refresh,
+    run_analytics_snapshot,
+    run_idempotency_purge,
+    run_booked_count_reconcile,
+)
+from .pg_base import get_pg_conn
+
+# 排程 leader 使用的 advisory lock key（兩個 int4：命名空間, 鎖編號）
+LEADER_LOCK_KEY = (7301, 1)
+
+_scheduler = None
+# job_id -> {"func", "seconds", "run_on_start", "leader_only", "metrics"}
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class JobMetrics:
+    """單一任務的執行統計（執行緒安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.skipped_not_leader = 0
+        self.total_duration_ms = 0.0
+        self.max_duration_ms = 0.0
+        self.last_duration_ms = None
+        self.last_started_at = None
+        self.last_succeeded_at = None
+        self.last_error = None
+        self.last_result = None
+
+    def record_run(self, started_at, duration_ms, result=None, error=None):
+        with self._lock:
+            self.runs += 1
+            self.total_duration_ms += duration_ms
+            self.max_duration_ms = max(self.max_duration_ms, duration_ms)
+            self.last_duration_ms = duration_ms
+            self.last_started_at = started_at
+            if error is None:
+                self.last_succeeded_at = started_at
+                self.last_result = result
+            else:
+                self.failures += 1
+                self.last_error = error
+
+    def record_skip(self):
+        with self._lock:
+            self.skipped_not_leader += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "failures": self.failures,
+                "skipped_not_leader": self.skipped_not_leader,
+                "avg_duration_ms": round(self.total_duration_ms / self.runs, 1) if self.runs else None,
+                "max_duration_ms": round(self.max_duration_ms, 1),
+                "last_duration_ms": round(self.last_duration_ms, 1) if self.last_duration_ms is not None else None,
+                "last_started_at": self.last_started_at,
+                "last_succeeded_at": self.last_succeeded_at,
+                "last_error": self.last_error,
+                "last_result": self.last_result,
+            }
+
+
+class LeaderLock:
+    """
+    跨 worker 的排程 leader：以專用連線持有 PostgreSQL session-level advisory lock。
+    - 每次執行任務前呼叫 is_leader()：尚未取得時嘗試 pg_try_advisory_lock，已取得時確認連線仍存活
+    - 持有鎖的 worker 結束或連線中斷時，PostgreSQL 自動釋放鎖，其他 worker 下次執行時接手
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _drop(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except Exception:
+                pass
+        self._conn = None
+
+    def is_leader(self):
+        with self._lock:
+            try:
+                if self._conn is None:
+                    conn = get_pg_conn()
+                    conn.autocommit = True
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT pg_try_advisory_lock(%s, %s);", self.key)
+                        acquired = cur.fetchone()[0]
+                    if not acquired:
+                        conn.close()
+                        return False
+                    self._conn = conn
+                    print(f"✅ 本 worker 成為排程 leader（advisory lock {self.key}）")
+                    return True
+
+                # 已是 leader：確認連線（以及鎖）仍在
+                with self._conn.cursor() as cur:
+                    cur.execute("SELECT 1;")
+                return True
+            except Exception as e:
+                print(f"⚠️ 排程 leader 連線異常，放棄 leader: {e}")
+                self._drop()
+                return False
+
+    @property
+    def held(self):
+        """本 worker 目前是否持有 leader lock（不做連線檢查）"""
+        return self._conn is not None
+
+    def release(self):
+        with self._lock:
+            if self._conn is not None and not self._conn.closed:
+                try:
+                    with self._conn.cursor() as cur:
+                        cur.execute("SELECT pg_advisory_unlock(%s, %s);", self.key)
+                except Exception:
+                    pass
+            self._drop()
+
+
+_leader = LeaderLock(LEADER_LOCK_KEY)
+
+
+def register_job(job_id, func, seconds, run_on_start=True, leader_only=True):
+    """
+    註冊定時任務（init_scheduler 之前或之後皆可；之後註冊會立即加入排程器）。
+    func 不接受參數，回傳值會記錄在該任務的 last_result。
+    run_on_start=True 時啟動後立即執行一次。
+    leader_only=False 的任務每個 worker 都會執行（例如預熱行程內快取）。
+    """
+    with _registry_lock:
+        existing = _registry.get(job_id)
+        _registry[job_id] = {
+            "func": func,
+            "seconds": seconds,
+            "run_on_start": run_on_start,
+            "leader_only": leader_only,
+            "metrics": existing["metrics"] if existing else JobMetrics(),
+        }
+    if _scheduler is not None:
+        _add_to_scheduler(job_id)
+
+
+def _run_job(job_id):
+    """排程器實際執行的包裝：leader_only 任務只有 leader 執行，並記錄耗時與結果"""
+    job = _registry[job_id]
+    metrics = job["metrics"]
+    if job["leader_only"] and not _leader.is_leader():
+        metrics.record_skip()
+        return
+
+    started_at = datetime.now()
+    started = time.perf_counter()
+    try:
+        result = job["func"]()
+    except Exception as e:
+        duration_ms = (time.perf_counter() - started) * 1000
+        metrics.record_run(started_at, duration_ms, error=str(e))
+        print(f"⚠️ 排程任務 {job_id} 執行失敗: {e}")
+        traceback.print_exc()
+        return
+    duration_ms = (time.perf_counter() - started) * 1000
+    metrics.record_run(started_at, duration_ms, result=result)
+
+
+def _add_to_scheduler(job_id):
+    job = _registry[job_id]
+    options = {}
+    if job["run_on_start"]:
+        # 不指定 next_run_time 時，第一次執行在一個間隔之後
+        options["next_run_time"] = datetime.now()
+    _scheduler.add_job(
+        _run_job,
+        "interval",
+        args=[job_id],
+        seconds=job["seconds"],
+        id=job_id,
+        replace_existing=True,
+        **options,
+    )
+
+
+def _register_builtin_jobs():
+    """內建定時任務"""
+    # 把已結束的門診時段設為停診
+    register_job("session_expiry", run_session_expiry, SESSION_EXPIRY_INTERVAL_SECONDS)
+    # 把已結束門診中未報到的掛號標記為未報到並累計爽約次數
+    register_job("no_show", run_no_show_processing, NO_SHOW_INTERVAL_SECONDS)
+    # 每個 worker 在 TTL 到期前重新載入部門目錄，讀取端不會遇到過期而打資料庫
+    register_job(
+        "department_cache_warm",
+        run_department_cache_warm,
+        max(1, DEPARTMENT_CACHE_TTL_SECONDS // 2),
+        leader_only=False,
+    )
+    # 每個 worker 各自持有疾病搜尋索引：DISEASE 有變更時重建（啟動時已建立，不需立即執行）
+    register_job(
+        "disease_index_refresh",
+        run_disease_index_refresh,
+        DISEASE_INDEX_CHECK_INTERVAL_SECONDS,
+        run_on_start=False,
+        leader_only=False,
+    )
+    # PostgreSQL → Parquet 分析快照：只由 leader 寫入，所有 worker 讀同一份檔案
+    register_job("analytics_snapshot", run_analytics_snapshot, ANALYTICS_SNAPSHOT_INTERVAL_SECONDS)
+    # 刪除過期的冪等鍵
+    register_job("idempotency_purge", run_idempotency_purge, IDEMPOTENCY_PURGE_INTERVAL_SECONDS)
+    # 檢查並修正 booked_count 與實際掛號數的偏差（啟動後一個間隔才第一次執行）
+    register_job(
+        "booked_count_reconcile",
+        run_booked_count_reconcile,
+        BOOKED_COUNT_RECONCILE_INTERVAL_SECONDS,
+        run_on_start=False,
+    )
+
+
+def init_scheduler():
+    """
+    建立背景排程器並加入所有已註冊的任務。
+    任務在排程器執行緒中執行，不阻塞應用程式啟動；
+    多個 uvicorn worker 同時啟動時，只有取得 leader lock 的 worker 實際執行任務。
+    """
+    global _scheduler
+    if _scheduler is not None:
+        return _scheduler
+
+    _register_builtin_jobs()
+    _scheduler = BackgroundScheduler(
+        # 錯過的執行只補一次，同一任務不重疊執行
+        job_defaults={"coalesce": True, "max_instances": 1},
+    )
+    with _registry_lock:
+        job_ids = list(_registry)
+    for job_id in job_ids:
+        _add_to_scheduler(job_id)
+    return _scheduler
+
+
+def start_scheduler():
+    """啟動排程器（需先呼叫 init_scheduler）"""
+    if _scheduler is not None and not _scheduler.running:
+        _scheduler.start()
+
+
+def shutdown_scheduler():
+    """停止排程器並釋放 leader lock（應用程式 shutdown 時呼叫），不等待執行中的任務"""
+    global _scheduler
+    if _scheduler is not None:
+        if _scheduler.running:
+            _scheduler.shutdown(wait=False)
+        _scheduler = None
+    _leader.release()
+
+
+def get_job_metrics():
+    """回傳各任務的排程設定與執行統計"""
+    with _registry_lock:
+        jobs = dict(_registry)
+
+    result = {}
+    for job_id, job in jobs.items():
+        next_run_time = None
+        if _scheduler is not None:
+            scheduled = _scheduler.get_job(job_id)
+            if scheduled is not None:
+                next_run_time = scheduled.next_run_time
+        result[job_id] = {
+            "interval_seconds": job["seconds"],
+            "leader_only": job["leader_only"],
+            "next_run_time": next_run_time,
+            **job["metrics"].snapshot(),
+        }
+    return {
+        "running": _scheduler is not None and _scheduler.running,
+        "is_leader": _leader.held,
+        "jobs": result,
+    }
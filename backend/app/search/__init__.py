@@ -0,0 +1,16 @@
+# search/__init__.py
+from .disease_index import (
+    DiseaseIndex,
+    get_disease_index,
+    reload_disease_index,
+    refresh_disease_index_if_changed,
+    search_diseases,
+)
+
+__all__ = [
+    "DiseaseIndex",
+    "get_disease_index",
+    "reload_disease_index",
+    "refresh_disease_index_if_changed",
+    "search_diseases",
+]
@@ -0,0 +1,267 @@
+# search/disease_index.py
+import heapq
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from ..repositories import DiagnosisRepository
+
+# 描述欄位的 n-gram 長度（子字串搜尋用；中文描述沒有空白，需要 n-gram 才能搜尋片段）
+NGRAM_SIZE = 2
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _normalize_code(code):
+    """代碼比對不分大小寫、忽略小數點（A00.1 與 a001 視為相同）"""
+    return code.replace(".", "").strip().upper()
+
+
+def _tokenize(text):
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _ngrams(text, n=NGRAM_SIZE):
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class _CodeTrie:
+    """
+    ICD 代碼前綴樹。代碼依正規化後的字串排序編號，
+    同一前綴的代碼編號連續，所以每個節點只需記錄 [lo, hi) 區間。
+    """
+
+    __slots__ = ("children", "lo", "hi")
+
+    def __init__(self, lo):
+        self.children = {}
+        self.lo = lo
+        self.hi = lo
+
+    @classmethod
+    def build(cls, sorted_codes):
+        root = cls(0)
+        for doc_id, code in enumerate(sorted_codes):
+            node = root
+            node.hi = doc_id + 1
+            for ch in code:
+                child = node.children.get(ch)
+                if child is None:
+                    child = node.children[ch] = cls(doc_id)
+                child.hi = doc_id + 1
+                node = child
+        return root
+
+    def prefix_range(self, prefix):
+        node = self
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return 0, 0
+        return node.lo, node.hi
+
+
+class DiseaseIndex:
+    """
+    DISEASE 目錄的唯讀記憶體索引（建好後不再修改，重建時整個替換）：
+    - 代碼前綴樹：代碼完全相同／前綴比對
+    - 單字索引：描述拆成單字，單字 → 疾病編號（排序後的單字表可做前綴範圍查詢）
+    - n-gram 索引：代碼與描述的子字串比對，取最少見的 n-gram 當候選再逐筆確認
+    - 單字元索引：查詢只有一個字元（例如「炎」）時直接取該字元出現過的疾病
+    結果依比對品質排序：代碼完全相同 > 代碼前綴 > 描述單字完全相同 > 描述單字前綴 > 子字串，
+    同一等級內依代碼排序（與原本 ORDER BY code_icd 一致）。
+    """
+
+    def __init__(self, rows, signature=None):
+        entries = {}
+        for code, description in rows:
+            if code is None:
+                continue
+            entries[code] = description if description is not None else code
+        # 依正規化代碼排序，前綴樹的區間才會連續
+        ordered = sorted(entries.items(), key=lambda item: (_normalize_code(item[0]), item[0]))
+
+        self.signature = signature
+        self.built_at = time.time()
+        self._codes = [code for code, _ in ordered]
+        self._descriptions = [description for _, description in ordered]
+        self._norm_codes = [_normalize_code(code) for code in self._codes]
+        self._haystacks = []
+        # 每筆疾病描述的單字（多個查詢詞時逐筆確認其餘詞是否符合）
+        self._doc_words = []
+
+        word_postings = {}
+        gram_postings = {}
+        char_postings = {}
+        for doc_id, (code, description) in enumerate(ordered):
+            desc_lower = str(description).lower()
+            # 代碼與描述合併成一個字串做子字串比對（以 \0 分隔，查詢字串不會跨越兩者）
+            haystack = f"{self._norm_codes[doc_id].lower()}\0{code.lower()}\0{desc_lower}"
+            self._haystacks.append(haystack)
+            doc_words = tuple(sorted(set(_tokenize(desc_lower))))
+            self._doc_words.append(doc_words)
+            for word in doc_words:
+                word_postings.setdefault(word, array("i")).append(doc_id)
+            for gram in _ngrams(haystack):
+                if "\0" not in gram:
+                    gram_postings.setdefault(gram, array("i")).append(doc_id)
+            for ch in set(haystack):
+                if ch != "\0":
+                    char_postings.setdefault(ch, array("i")).append(doc_id)
+
+        self._trie = _CodeTrie.build(self._norm_codes)
+        self._words = sorted(word_postings)
+        self._word_postings = word_postings
+        self._gram_postings = gram_postings
+        self._char_postings = char_postings
+
+    def __len__(self):
+        return len(self._codes)
+
+    def _doc(self, doc_id):
+        return {"code_icd": self._codes[doc_id], "description": self._descriptions[doc_id]}
+
+    def _word_exact_ids(self, words):
+        """描述包含所有查詢詞（完整單字）的疾病編號，依編號遞增逐一產生"""
+        postings = [self._word_postings.get(word) for word in words]
+        if any(p is None for p in postings):
+            return
+        # 從最少見的詞開始，其餘詞逐筆確認
+        for doc_id in min(postings, key=len):
+            doc_words = self._doc_words[doc_id]
+            if all(word in doc_words for word in words):
+                yield doc_id
+
+    def _word_prefix_ids(self, words):
+        """描述中每個查詢詞都是某個單字前綴的疾病編號，依編號遞增逐一產生"""
+        # 以最長的查詢詞展開候選（通常最有鑑別度），其餘詞逐筆確認
+        pivot = max(words, key=len)
+        lo = bisect_left(self._words, pivot)
+        hi = bisect_right(self._words, pivot + "\U0010ffff")
+        candidates = heapq.merge(*(self._word_postings[word] for word in self._words[lo:hi]))
+        last = -1
+        for doc_id in candidates:
+            if doc_id == last:
+                continue
+            last = doc_id
+            doc_words = self._doc_words[doc_id]
+            if all(any(w.startswith(word) for w in doc_words) for word in words):
+                yield doc_id
+
+    def _substring_ids(self, needle):
+        """代碼或描述包含 needle 的疾病編號（依編號遞增逐一產生）"""
+        if len(needle) < NGRAM_SIZE:
+            # 單一字元：沒有對應的 n-gram，直接取單字元索引（字元在代碼或描述的任何位置都算）
+            candidates = self._char_postings.get(needle, ())
+        else:
+            postings = [self._gram_postings.get(gram) for gram in _ngrams(needle)]
+            if any(p is None for p in postings):
+                return
+            candidates = min(postings, key=len)
+        last = -1
+        for doc_id in candidates:
+            if doc_id != last and needle in self._haystacks[doc_id]:
+                yield doc_id
+            last = doc_id
+
+    def search(self, query=None, limit=50):
+        """
+        搜尋疾病，回傳 [{code_icd, description}, ...]，最多 limit 筆。
+        query 為空時依代碼排序回傳前 limit 筆。
+        """
+        if limit <= 0:
+            return []
+        query = (query or "").strip()
+        if not query:
+            return [self._doc(doc_id) for doc_id in range(min(limit, len(self._codes)))]
+
+        results = []
+        seen = set()
+
+        def take(doc_ids):
+            """依序加入尚未出現的結果；回傳是否已經滿 limit"""
+            for doc_id in doc_ids:
+                if doc_id not in seen:
+                    seen.add(doc_id)
+                    results.append(doc_id)
+                    if len(results) >= limit:
+                        return True
+            return False
+
+        # 1. 代碼完全相同、2. 代碼前綴（前綴樹區間依代碼排序，完全相同的代碼必在區間最前面）
+        norm = _normalize_code(query)
+        if norm:
+            lo, hi = self._trie.prefix_range(norm)
+            if take(range(lo, hi)):
+                return [self._doc(doc_id) for doc_id in results]
+
+        # 3. 描述單字完全相同、4. 描述單字前綴（多個查詢詞需全部符合）
+        words = _tokenize(query)
+        if words:
+            if take(self._word_exact_ids(words)) or take(self._word_prefix_ids(words)):
+                return [self._doc(doc_id) for doc_id in results]
+
+        # 5. 代碼或描述包含整個查詢字串（與原本 ILIKE '%q%' 相同的涵蓋範圍）
+        take(self._substring_ids(query.lower()))
+        return [self._doc(doc_id) for doc_id in results]
+
+    def stats(self):
+        return {
+            "diseases": len(self._codes),
+            "words": len(self._words),
+            "ngrams": len(self._gram_postings),
+            "chars": len(self._char_postings),
+            "signature": self.signature,
+            "built_at": self.built_at,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def reload_disease_index():
+    """
+    從資料庫重新載入 DISEASE 並建立新索引，建好後一次替換（搜尋中的請求繼續使用舊索引）。
+    回傳索引統計。
+    """
+    global _index
+    with _index_lock:
+        started = time.perf_counter()
+        signature = DiagnosisRepository.disease_catalog_signature()
+        rows = DiagnosisRepository.list_disease_catalog()
+        index = DiseaseIndex(rows, signature=signature)
+        _index = index
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"✅ 疾病搜尋索引已建立：{len(index)} 筆（{elapsed_ms:.1f} ms）")
+    return index.stats()
+
+
+def get_disease_index():
+    """取得目前的疾病索引；尚未建立（例如啟動時資料庫無法連線）時先建立"""
+    index = _index
+    if index is None:
+        reload_disease_index()
+        index = _index
+    return index
+
+
+def refresh_disease_index_if_changed():
+    """
+    比對資料庫中 DISEASE 的簽章，內容有變才重建索引（排程定期呼叫）。
+    回傳是否重建。
+    """
+    index = _index
+    if index is not None and DiagnosisRepository.disease_catalog_signature() == index.signature:
+        return False
+    reload_disease_index()
+    return True
+
+
+def search_diseases(query=None, limit=50):
+    """以記憶體索引搜尋疾病（不查詢資料庫）"""
+    return get_disease_index().search(query, limit)
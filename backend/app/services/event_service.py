@@ -0,0 +1,53 @@
+# services/event_service.py
+import json
+
+from ..config import EVENTS_HEARTBEAT_SECONDS
+from ..events import event_hub, session_topic, department_topic, get_event_stats
+
+SSE_MEDIA_TYPE = "text/event-stream"
+# 避免反向代理（nginx 等）緩衝事件，並讓瀏覽器不要快取
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# 瀏覽器 EventSource 斷線後的重連間隔（毫秒）
+SSE_RETRY_MS = 3000
+
+
+def _format_event(event):
+    """一筆 SSE 訊息：event 名稱為事件的 type，data 為 JSON"""
+    return f"event: {event.get('type', 'message')}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+class EventService:
+    """
+    門診時段即時事件（Server-Sent Events）：
+    訂閱本行程的 event_hub（由 LISTEN 連線分送 PostgreSQL 通知），不查詢資料庫、不佔用連線池。
+    客戶端連上（含斷線重連）後應先重新載入一次資料，之後只在收到事件時更新。
+    """
+
+    async def _stream(self, request, topic):
+        subscription = event_hub.subscribe(topic)
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n"
+            yield _format_event({"type": "ready", "topic": topic})
+            while True:
+                events = await subscription.next_events(EVENTS_HEARTBEAT_SECONDS)
+                if await request.is_disconnected():
+                    break
+                if not events:
+                    # 心跳（SSE 註解行），讓代理伺服器不會因閒置切斷連線
+                    yield ": heartbeat\n\n"
+                    continue
+                for event in events:
+                    yield _format_event(event)
+        finally:
+            event_hub.unsubscribe(subscription)
+
+    def stream_session_events(self, request, session_id: int):
+        """單一門診時段的變更（掛號、取消、報到、看診狀態、容量或停診）"""
+        return self._stream(request, session_topic(session_id))
+
+    def stream_department_events(self, request, dept_id: int):
+        """科別內所有門診時段的變更（剩餘名額、新增或停診）"""
+        return self._stream(request, department_topic(dept_id))
+
+    def get_stats(self):
+        return get_event_stats()
@@ -0,0 +1,95 @@
+# services/export_service.py
+import csv
+import io
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from fastapi import HTTPException
+
+from ..repositories import ExportRepository
+from ..repositories.export_repo import EXPORT_DATASETS
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def _json_default(value):
+    """日期時間輸出 ISO 格式；金額等 Decimal 以字串輸出，避免轉成浮點數失去精度"""
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _csv_value(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    return value
+
+
+class ExportService:
+    """就診、診斷、處方、檢驗、繳費的大量匯出（NDJSON / CSV 串流）"""
+
+    def __init__(self):
+        self.export_repo = ExportRepository()
+
+    def validate(self, dataset: str, fmt: str, date_from: date, date_to: date):
+        """在開始串流前檢查參數（串流開始後就無法再回傳錯誤狀態碼）"""
+        if dataset not in EXPORT_DATASETS:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Unknown dataset '{dataset}', expected one of: {', '.join(EXPORT_DATASETS)}",
+            )
+        if fmt not in EXPORT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown format '{fmt}', expected one of: {', '.join(EXPORT_FORMATS)}",
+            )
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+
+    def media_type(self, fmt: str):
+        return EXPORT_FORMATS[fmt]
+
+    def stream_export(
+        self,
+        dataset: str,
+        fmt: str,
+        date_from: date,
+        date_to: date,
+        patient_id: int = None,
+        provider_id: int = None,
+    ):
+        """
+        回傳匯出內容的 generator，每批資料列轉成一段文字：
+        - ndjson：一列一個 JSON 物件
+        - csv：第一列為欄位名稱（UTF-8 BOM 開頭，方便 Excel 開啟）
+        """
+        batches = self.export_repo.stream_rows(
+            dataset, date_from, date_to, patient_id=patient_id, provider_id=provider_id
+        )
+        columns = next(batches)
+
+        if fmt == "ndjson":
+            for rows in batches:
+                yield "".join(
+                    json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + "\n"
+                    for row in rows
+                )
+            return
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        buffer.write("\ufeff")
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows([_csv_value(value) for value in row] for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+        if buffer.tell():
+            yield buffer.getvalue()
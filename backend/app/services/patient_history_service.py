@@ -1,12 +1,39 @@
 # services/patient_history_service.py
+import base64
+import binascii
+from datetime import datetime
+
+from fastapi import HTTPException
+
+from ..config import HISTORY_PAGE_SIZE, HISTORY_SYNC_OVERLAP_SECONDS
+from ..fanout import fan_out
 from ..repositories import (
     EncounterRepository,
     PrescriptionRepository,
     LabResultRepository,
     PaymentRepository,
     DiagnosisRepository,
+    PatientHistoryRepository,
 )
 
+# 分頁模式預設一併回傳的相關資料
+HISTORY_PAGE_SECTIONS = ("prescriptions", "lab_results", "payments", "diagnoses")
+
+
+def _encode_history_cursor(encounter_at, enct_id):
+    """把 keyset 位置 (encounter_at, enct_id) 編成不透明的 cursor 字串"""
+    raw = f"{encounter_at.isoformat()}|{enct_id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def _decode_history_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        encounter_at, enct_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(encounter_at), int(enct_id)
+    except (ValueError, UnicodeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 
 class PatientHistoryService:
     """處理病人歷史記錄相關的服務"""
@@ -17,6 +44,7 @@ class PatientHistoryService:
         self.lab_result_repo = LabResultRepository()
         self.payment_repo = PaymentRepository()
         self.diagnosis_repo = DiagnosisRepository()
+        self.history_repo = PatientHistoryRepository()
 
     def get_all_encounters(self, patient_id: int):
         """
@@ -76,17 +104,74 @@ class PatientHistoryService:
         enct_ids = [encounter["enct_id"] for encounter in encounters]
         
         # 第二步：使用批量查詢方法，一次性查詢所有相關資料
-        # 這些查詢都使用 enct_id IN (...) 或 ANY(%s)，避免重複 JOIN APPOINTMENT 表
-        diagnoses = self.diagnosis_repo.list_diagnoses_for_encounters(enct_ids)
-        prescriptions = self.prescription_repo.list_prescriptions_for_encounters(enct_ids)
-        lab_results = self.lab_result_repo.list_lab_results_for_encounters(enct_ids)
-        payments = self.payment_repo.list_payments_for_encounters(enct_ids)
-        
+        # 這些查詢都使用 enct_id IN (...) 或 ANY(%s)，避免重複 JOIN APPOINTMENT 表；
+        # 四個查詢互不相依，並行執行，總耗時約等於最慢的一個
+        related = fan_out({
+            "diagnoses": lambda: self.diagnosis_repo.list_diagnoses_for_encounters(enct_ids),
+            "prescriptions": lambda: self.prescription_repo.list_prescriptions_for_encounters(enct_ids),
+            "lab_results": lambda: self.lab_result_repo.list_lab_results_for_encounters(enct_ids),
+            "payments": lambda: self.payment_repo.list_payments_for_encounters(enct_ids),
+        })
+
         return {
             "encounters": encounters,
-            "prescriptions": prescriptions,
-            "lab_results": lab_results,
-            "payments": payments,
-            "diagnoses": diagnoses,
+            "prescriptions": related["prescriptions"],
+            "lab_results": related["lab_results"],
+            "payments": related["payments"],
+            "diagnoses": related["diagnoses"],
         }
 
+    def get_patient_history_page(
+        self,
+        patient_id: int,
+        limit: int = None,
+        cursor: str = None,
+        updated_since: datetime = None,
+        sections=HISTORY_PAGE_SECTIONS,
+    ):
+        """
+        分頁／增量同步版本的病人歷史記錄：
+        - 依 (encounter_at, enct_id) 由新到舊做 keyset 分頁，每頁 limit 筆就診（預設 HISTORY_PAGE_SIZE），
+          sections 指定要一併回傳哪些與這些就診相關的資料
+        - cursor：上一頁回傳的 next_cursor；next_cursor 為 None 表示沒有下一頁
+        - updated_since：只回傳此時間之後有變更的就診（連同其所有相關資料，前端以就診為單位覆蓋），
+          可與 cursor 一起使用
+        - sync_token：下次增量同步的 updated_since；分頁讀取時請保留第一頁的 sync_token
+        每頁的查詢量只與 limit 有關，不隨病人的就診總數成長。
+        """
+        limit = limit or HISTORY_PAGE_SIZE
+        before = _decode_history_cursor(cursor) if cursor else None
+
+        encounters, has_more, sync_watermark = self.encounter_repo.list_encounters_for_patient_page(
+            patient_id,
+            limit,
+            before=before,
+            updated_since=updated_since,
+            sync_overlap_seconds=HISTORY_SYNC_OVERLAP_SECONDS,
+        )
+
+        enct_ids = [encounter["enct_id"] for encounter in encounters]
+        loaders = {
+            "prescriptions": lambda: self.prescription_repo.list_prescriptions_for_encounters(enct_ids),
+            "lab_results": lambda: self.lab_result_repo.list_lab_results_for_encounters(enct_ids),
+            "payments": lambda: self.payment_repo.list_payments_for_encounters(enct_ids),
+            "diagnoses": lambda: self.diagnosis_repo.list_diagnoses_for_encounters(enct_ids),
+        }
+        related = fan_out({name: loaders[name] for name in sections}) if enct_ids else {}
+
+        last = encounters[-1] if encounters else None
+        return {
+            "encounters": encounters,
+            **{name: related.get(name, []) for name in sections},
+            "next_cursor": _encode_history_cursor(last["encounter_at"], last["enct_id"]) if has_more else None,
+            "sync_token": sync_watermark.isoformat(),
+        }
+
+    def stream_patient_history(self, patient_id: int):
+        """
+        取得某位病人的完整歷史記錄（串流版本），回傳 JSON 文字片段的 generator。
+        內容與 get_patient_history 相同，但整份文件在 PostgreSQL 以 json_build_object 組成，
+        只需一次查詢、一條連線，也不在 Python 端建立中間的 dict 列表。
+        """
+        return self.history_repo.stream_patient_history(patient_id)
+
@@ -5,7 +5,8 @@ from typing import Optional
 from fastapi import HTTPException
 import psycopg2
 
-from ..repositories import PatientRepository
+from ..repositories import PatientRepository, NotificationRepository
+from ..analytics import get_patient_statistics
 
 
 class PatientService:
@@ -13,6 +14,7 @@ class PatientService:
 
     def __init__(self):
         self.patient_repo = PatientRepository()
+        self.notification_repo = NotificationRepository()
 
     def register_patient(
         self, name: str, password: str, national_id: str, birth_date: date, sex: str, phone: str
@@ -75,6 +77,24 @@ class PatientService:
             raise HTTPException(status_code=404, detail="Patient not found")
         return row
 
+    def get_patient_statistics(self, patient_id: int):
+        """病人儀表板統計（年度就診次數、各科別分布、常見診斷）：只讀取統計 cube 的一列"""
+        stats = get_patient_statistics(patient_id)
+        if stats is None:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        return stats
+
+    def list_notifications(self, patient_id: int, after_id: int = 0, limit: int = 100):
+        """
+        病人的通知事件（例如候補遞補），依 notification_id 由舊到新；
+        next_after_id 帶入下一次的 after_id 即可只取新的通知。
+        """
+        rows = self.notification_repo.list_notifications(patient_id, after_id, limit)
+        return {
+            "notifications": rows,
+            "next_after_id": rows[-1]["notification_id"] if rows else after_id,
+        }
+
     def login_patient(self, national_id: str, password: str):
         """病患登入驗證"""
         hash_pwd = hashlib.sha256(password.encode("utf-8")).hexdigest()
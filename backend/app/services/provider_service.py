@@ -15,6 +15,10 @@ from ..repositories import (
     LabResultRepository,
     PaymentRepository,
 )
+from ..search import search_diseases
+from ..analytics import get_patient_statistics
+from ..fanout import fan_out
+from .patient_history_service import PatientHistoryService
 
 
 class ProviderService:
@@ -29,6 +33,7 @@ class ProviderService:
         self.prescription_repo = PrescriptionRepository()
         self.lab_result_repo = LabResultRepository()
         self.payment_repo = PaymentRepository()
+        self.history_service = PatientHistoryService()
 
     def register_provider(self, name: str, password: str, license_no: str, dept_id: int):
         """
@@ -319,8 +324,15 @@ class ProviderService:
         return self.appointment_repo.list_appointments_for_session(provider_id, session_id)
 
     def update_appointment_status(self, provider_id: int, appt_id: int, new_status: int):
-        """醫師更新掛號狀態"""
-        self.appointment_repo.update_appointment_status(provider_id, appt_id, new_status)
+        """醫師更新掛號狀態（候補中的掛號只能取消，遞補由取消掛號時自動處理）"""
+        try:
+            self.appointment_repo.update_appointment_status(provider_id, appt_id, new_status)
+        except Exception as e:
+            if "Appointment is waitlisted" in str(e):
+                raise HTTPException(
+                    status_code=409, detail="候補中的掛號尚未遞補，無法變更為此狀態"
+                ) from e
+            raise
         return {"success": True, "appt_id": appt_id, "new_status": new_status}
 
     def get_encounter(self, provider_id: int, appt_id: int):
@@ -473,12 +485,19 @@ class ProviderService:
         return self.diagnosis_repo.list_diagnoses_for_encounter(enct_id)
 
     def search_diseases(self, query: str = None, limit: int = 50):
-        """搜尋疾病（ICD 代碼和描述）"""
-        return self.diagnosis_repo.search_diseases(query, limit)
+        """搜尋疾病（ICD 代碼和描述），走記憶體索引，不查詢資料庫"""
+        return search_diseases(query, limit)
 
-    def search_medications(self, query: str = None, limit: int = 50):
-        """搜尋藥品（med_id 和 name）"""
-        return self.prescription_repo.search_medications(query, limit)
+    def search_medications(
+        self,
+        query: str = None,
+        limit: int = 50,
+        offset: int = 0,
+        spec: str = None,
+        unit: str = None,
+    ):
+        """搜尋藥品（med_id 和 name），依相符程度排序並支援分頁與規格／單位篩選"""
+        return self.prescription_repo.search_medications(query, limit, offset, spec, unit)
 
     def get_prescription(self, enct_id: int):
         """取得處方箋，如果不存在則返回 None（與 get_payment 行為一致）"""
@@ -554,6 +573,37 @@ class ProviderService:
         """醫師查詢某位病患的所有檢驗結果（不限醫師、科別）"""
         return self.lab_result_repo.list_lab_results_for_patient(patient_id)
 
+    def get_patient_history(self, patient_id: int):
+        """
+        醫師查詢某位病患的所有就診記錄、診斷與檢驗報告（不限醫師、科別）。
+        三個查詢互不相依，並行執行。
+        """
+        return fan_out({
+            "encounters": lambda: self.list_all_encounters_for_patient(patient_id),
+            "diagnoses": lambda: self.list_all_diagnoses_for_patient(patient_id),
+            "lab_results": lambda: self.list_all_lab_results_for_patient(patient_id),
+        })
+
+    def get_patient_history_page(self, patient_id: int, limit: int = None, cursor: str = None, updated_since=None):
+        """
+        醫師查詢病患歷史記錄的分頁／增量同步版本（就診 + 診斷 + 檢驗結果），
+        規則同 PatientHistoryService.get_patient_history_page。
+        """
+        return self.history_service.get_patient_history_page(
+            patient_id,
+            limit=limit,
+            cursor=cursor,
+            updated_since=updated_since,
+            sections=("diagnoses", "lab_results"),
+        )
+
+    def get_patient_statistics(self, patient_id: int):
+        """醫師查看病患的統計摘要（年度就診次數、各科別分布、常見診斷）：只讀取統計 cube 的一列"""
+        stats = get_patient_statistics(patient_id)
+        if stats is None:
+            raise HTTPException(status_code=404, detail="Patient not found")
+        return stats
+
     def list_lab_results(self, enct_id: int):
         """列出某次就診的所有檢驗結果"""
         return self.lab_result_repo.list_lab_results_for_encounter(enct_id)
@@ -1,6 +1,14 @@
 # services/shared/__init__.py
-from .session_service import SessionService
-from .appointment_service import AppointmentService
+from .session_service import SessionService, AsyncSessionService
+from .appointment_service import AppointmentService, AsyncAppointmentService
+from .idempotency_service import IdempotencyService, AsyncIdempotencyService
 
-__all__ = ["SessionService", "AppointmentService"]
+__all__ = [
+    "SessionService",
+    "AppointmentService",
+    "AsyncSessionService",
+    "AsyncAppointmentService",
+    "IdempotencyService",
+    "AsyncIdempotencyService",
+]
 
@@ -1,6 +1,52 @@
 from fastapi import HTTPException
 
+from ...booking import booking_engine
 from ...repositories import AppointmentRepository
+from ...repositories.aio import AsyncAppointmentRepository, AsyncPatientRepository
+
+
+def _banned_http_error(banned_until):
+    """病人被禁止掛號時回傳的 403"""
+    return HTTPException(
+        status_code=403,
+        detail=f"您因爽約次數過多，已被禁止掛號至 {banned_until}。請於禁止期結束後再試。"
+    )
+
+
+def _create_appointment_http_error(e, patient_id, session_id):
+    """把 repository 拋出的建立掛號錯誤轉成對應的 HTTPException（同步／非同步版共用）"""
+    import traceback
+    error_msg = str(e)
+    error_trace = traceback.format_exc()
+    print(f"❌ 建立掛號錯誤:")
+    print(f"   patient_id: {patient_id}, session_id: {session_id}")
+    print(f"   錯誤訊息: {error_msg}")
+    print(f"   錯誤堆疊:\n{error_trace}")
+
+    if "already has an appointment" in error_msg or "無法重複預約" in error_msg:
+        return HTTPException(
+            status_code=409,
+            detail="無法重複預約同一門診"
+        )
+    elif "Session is full" in error_msg:
+        return HTTPException(
+            status_code=409,
+            detail="Session is full, no more appointments available"
+        )
+    elif "Session not found" in error_msg:
+        return HTTPException(status_code=404, detail="Session not found")
+    elif "Session has ended" in error_msg or "cannot book appointment" in error_msg:
+        return HTTPException(
+            status_code=409,
+            detail="此門診時段已結束，無法預約"
+        )
+    elif "Session is cancelled" in error_msg or "cancelled" in error_msg.lower():
+        return HTTPException(
+            status_code=409,
+            detail="此門診時段已取消"
+        )
+    return HTTPException(status_code=500, detail=f"Error creating appointment: {error_msg}")
+
 
 
 class AppointmentService:
@@ -9,14 +55,14 @@ class AppointmentService:
     def __init__(self):
         self.appointment_repo = AppointmentRepository()
 
-    def create_appointment(self, patient_id: int, session_id: int):
+    def create_appointment(self, patient_id: int, session_id: int, join_waitlist: bool = True):
         """
         建立掛號：
         - 檢查病人是否被禁止掛號（達到三次爽約且在兩週內）
         - 檢查是否已在該 session 重複掛號
-        - 檢查 session 容量是否已滿
+        - 檢查 session 容量是否已滿；已滿且 join_waitlist 時加入候補（status = 6）
         - 使用 transaction + FOR UPDATE 避免併行衝突
-        - slot_seq = 已掛號人數 + 1
+        - slot_seq 由門診時段的序號計數器配發
         - 寫入 APPOINTMENT_STATUS_HISTORY
         """
         from ...repositories import PatientRepository
@@ -24,51 +70,17 @@ class AppointmentService:
         # 檢查病人是否被禁止掛號
         is_banned, banned_until = PatientRepository.is_patient_banned(patient_id)
         if is_banned:
-            from datetime import date
-            raise HTTPException(
-                status_code=403,
-                detail=f"您因爽約次數過多，已被禁止掛號至 {banned_until}。請於禁止期結束後再試。"
-            )
+            raise _banned_http_error(banned_until)
         
         try:
-            appt = self.appointment_repo.create_appointment(patient_id, session_id)
+            appt = self.appointment_repo.create_appointment(patient_id, session_id, join_waitlist)
             if appt is None:
                 raise HTTPException(status_code=400, detail="Failed to create appointment")
             return appt
         except Exception as e:
             if isinstance(e, HTTPException):
                 raise e
-            import traceback
-            error_msg = str(e)
-            error_trace = traceback.format_exc()
-            print(f"❌ 建立掛號錯誤:")
-            print(f"   patient_id: {patient_id}, session_id: {session_id}")
-            print(f"   錯誤訊息: {error_msg}")
-            print(f"   錯誤堆疊:\n{error_trace}")
-            
-            if "already has an appointment" in error_msg or "無法重複預約" in error_msg:
-                raise HTTPException(
-                    status_code=409,
-                    detail="無法重複預約同一門診"
-                )
-            elif "Session is full" in error_msg:
-                raise HTTPException(
-                    status_code=409,
-                    detail="Session is full, no more appointments available"
-                )
-            elif "Session not found" in error_msg:
-                raise HTTPException(status_code=404, detail="Session not found")
-            elif "Session has ended" in error_msg or "cannot book appointment" in error_msg:
-                raise HTTPException(
-                    status_code=409,
-                    detail="此門診時段已結束，無法預約"
-                )
-            elif "Session is cancelled" in error_msg or "cancelled" in error_msg.lower():
-                raise HTTPException(
-                    status_code=409,
-                    detail="此門診時段已取消"
-                )
-            raise HTTPException(status_code=500, detail=f"Error creating appointment: {error_msg}") from e
+            raise _create_appointment_http_error(e, patient_id, session_id) from e
 
     def cancel_appointment(self, appt_id: int, patient_id: int):
         """
@@ -76,6 +88,7 @@ class AppointmentService:
         - 驗證 patient_id 是否匹配
         - 更新狀態為「已取消」
         - 寫入 APPOINTMENT_STATUS_HISTORY
+        - 釋出的名額在同一交易中由候補遞補（回傳 waitlist_promoted 人數）
         """
         try:
             result = self.appointment_repo.cancel_appointment(appt_id, patient_id)
@@ -122,6 +135,18 @@ class AppointmentService:
         except Exception as e:
             if isinstance(e, HTTPException):
                 raise e
+            if "Session is full" in str(e):
+                raise HTTPException(
+                    status_code=409,
+                    detail="Session is full, no more appointments available"
+                ) from e
+            if "Appointment is waitlisted" in str(e):
+                raise HTTPException(
+                    status_code=409,
+                    detail="候補中的掛號無法改期，請取消後重新掛號"
+                ) from e
+            if "Session not found" in str(e):
+                raise HTTPException(status_code=404, detail="Session not found") from e
             raise HTTPException(
                 status_code=500, detail=f"Error modifying appointment: {str(e)}"
             ) from e
@@ -153,6 +178,13 @@ class AppointmentService:
             )
         
         session_id = appointment["session_id"]
+
+        # 候補（6）尚未取得名額，不能報到
+        if appointment["current_status"] == 6:
+            raise HTTPException(
+                status_code=409,
+                detail="候補中的掛號無法報到，遞補後才能報到"
+            )
         
         # 獲取 session 資訊
         session_info = SessionRepository.get_session_by_id(session_id)
@@ -180,3 +212,33 @@ class AppointmentService:
                 detail="Appointment not found or patient_id does not match"
             )
         return result
+
+
+class AsyncAppointmentService:
+    """AppointmentService 的 asyncio 版本，供 async def 路由使用（不佔用 threadpool）"""
+
+    def __init__(self):
+        self.appointment_repo = AsyncAppointmentRepository()
+        self.patient_repo = AsyncPatientRepository()
+
+    async def create_appointment(self, patient_id: int, session_id: int, join_waitlist: bool = True):
+        """
+        建立掛號（流程與 AppointmentService.create_appointment 相同）：
+        - 檢查病人是否被禁止掛號
+        - 交給掛號引擎（app.booking）：同一 session 的併發請求合併成一批，
+          在單一交易中檢查重複、容量並寫入掛號與狀態歷史
+        - 額滿且 join_waitlist 時加入候補（回傳 status = 6 與 waitlist_position）
+        """
+        is_banned, banned_until = await self.patient_repo.is_patient_banned(patient_id)
+        if is_banned:
+            raise _banned_http_error(banned_until)
+
+        try:
+            appt = await booking_engine.book(patient_id, session_id, join_waitlist)
+            if appt is None:
+                raise HTTPException(status_code=400, detail="Failed to create appointment")
+            return appt
+        except Exception as e:
+            if isinstance(e, HTTPException):
+                raise e
+            raise _create_appointment_http_error(e, patient_id, session_id) from e
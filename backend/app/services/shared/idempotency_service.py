@@ -0,0 +1,139 @@
+# services/shared/idempotency_service.py
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from ...config import IDEMPOTENCY_KEY_TTL_SECONDS, IDEMPOTENCY_PROCESSING_LEASE_SECONDS
+from ...repositories import IdempotencyRepository
+from ...repositories.aio import AsyncIdempotencyRepository
+
+# Idempotency-Key header 的最大長度（與 IDEMPOTENCY_KEY.idem_key 欄位相同）
+IDEMPOTENCY_KEY_MAX_LENGTH = 128
+
+
+def _validate_key(idem_key):
+    if not idem_key or len(idem_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key 長度須為 1～{IDEMPOTENCY_KEY_MAX_LENGTH} 個字元",
+        )
+
+
+def _replay(row, operation, request_fingerprint):
+    """
+    以第一次請求的結果回應重送的請求（同步／非同步版共用）：
+    - 鍵用在不同的操作或參數：422
+    - 第一次請求仍在處理中：409
+    - 第一次為錯誤回應（4xx）：拋出相同的 HTTPException；成功則回傳相同內容
+    """
+    if row["operation"] != operation or row["request_fingerprint"] != request_fingerprint:
+        raise HTTPException(
+            status_code=422,
+            detail="此 Idempotency-Key 已用於其他請求，請為新的操作產生新的鍵",
+        )
+    if row["status_code"] is None:
+        raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的請求仍在處理中，請稍後再試")
+    if row["status_code"] >= 400:
+        raise HTTPException(status_code=row["status_code"], detail=row["response"]["detail"])
+    return row["response"]
+
+
+class IdempotencyService:
+    """
+    冪等鍵：同一位病人以相同 Idempotency-Key 重送請求時，回傳第一次的結果而不重新執行。
+    - 成功與 4xx 錯誤（例如名額已滿）都會保存，重送只需一次主鍵查詢
+    - 5xx、非預期錯誤或請求被取消時不保存，釋放鍵讓重送可以重新執行
+    - 處理中的鍵超過 IDEMPOTENCY_PROCESSING_LEASE_SECONDS 秒仍未寫回結果（worker 中斷、寫回失敗），
+      視為第一次請求已中斷，重送可重新佔用；寫回與釋放都比對佔用時的 claim_token，
+      原本的請求之後才結束也不會覆蓋或刪除接手者的鍵
+    - 鍵保存 IDEMPOTENCY_KEY_TTL_SECONDS 秒，過期後由背景排程刪除
+    """
+
+    def __init__(self):
+        self.idempotency_repo = IdempotencyRepository()
+
+    def run(self, patient_id: int, idem_key, operation: str, request_fingerprint: str, fn):
+        """執行 fn()；idem_key 為 None（未帶 header）時直接執行"""
+        if idem_key is None:
+            return fn()
+        _validate_key(idem_key)
+
+        row = self.idempotency_repo.get_key(patient_id, idem_key)
+        if row is None or row["status_code"] is None:
+            claim_token = self.idempotency_repo.claim_key(
+                patient_id,
+                idem_key,
+                operation,
+                request_fingerprint,
+                IDEMPOTENCY_KEY_TTL_SECONDS,
+                IDEMPOTENCY_PROCESSING_LEASE_SECONDS,
+            )
+            if claim_token is not None:
+                try:
+                    result = fn()
+                except HTTPException as e:
+                    if e.status_code < 500:
+                        self.idempotency_repo.save_response(
+                            patient_id, idem_key, claim_token, e.status_code, {"detail": jsonable_encoder(e.detail)}
+                        )
+                    else:
+                        self.idempotency_repo.release_key(patient_id, idem_key, claim_token)
+                    raise
+                except BaseException:
+                    # 包含 asyncio.CancelledError（用戶端中斷連線）等非 Exception 的中斷
+                    self.idempotency_repo.release_key(patient_id, idem_key, claim_token)
+                    raise
+                response = jsonable_encoder(result)
+                self.idempotency_repo.save_response(patient_id, idem_key, claim_token, 200, response)
+                return response
+            # 同時有另一個相同鍵的請求搶先佔用，或第一次請求仍在租約內處理中
+            row = self.idempotency_repo.get_key(patient_id, idem_key)
+            if row is None:
+                raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的請求仍在處理中，請稍後再試")
+        return _replay(row, operation, request_fingerprint)
+
+
+class AsyncIdempotencyService:
+    """IdempotencyService 的 asyncio 版本，供 async def 路由使用"""
+
+    def __init__(self):
+        self.idempotency_repo = AsyncIdempotencyRepository()
+
+    async def run(self, patient_id: int, idem_key, operation: str, request_fingerprint: str, fn):
+        """await fn()；idem_key 為 None（未帶 header）時直接執行"""
+        if idem_key is None:
+            return await fn()
+        _validate_key(idem_key)
+
+        row = await self.idempotency_repo.get_key(patient_id, idem_key)
+        if row is None or row["status_code"] is None:
+            claim_token = await self.idempotency_repo.claim_key(
+                patient_id,
+                idem_key,
+                operation,
+                request_fingerprint,
+                IDEMPOTENCY_KEY_TTL_SECONDS,
+                IDEMPOTENCY_PROCESSING_LEASE_SECONDS,
+            )
+            if claim_token is not None:
+                try:
+                    result = await fn()
+                except HTTPException as e:
+                    if e.status_code < 500:
+                        await self.idempotency_repo.save_response(
+                            patient_id, idem_key, claim_token, e.status_code, {"detail": jsonable_encoder(e.detail)}
+                        )
+                    else:
+                        await self.idempotency_repo.release_key(patient_id, idem_key, claim_token)
+                    raise
+                except BaseException:
+                    # 包含 asyncio.CancelledError（用戶端中斷連線）等非 Exception 的中斷
+                    await self.idempotency_repo.release_key(patient_id, idem_key, claim_token)
+                    raise
+                response = jsonable_encoder(result)
+                await self.idempotency_repo.save_response(patient_id, idem_key, claim_token, 200, response)
+                return response
+            # 同時有另一個相同鍵的請求搶先佔用，或第一次請求仍在租約內處理中
+            row = await self.idempotency_repo.get_key(patient_id, idem_key)
+            if row is None:
+                raise HTTPException(status_code=409, detail="相同 Idempotency-Key 的請求仍在處理中，請稍後再試")
+        return _replay(row, operation, request_fingerprint)
@@ -4,6 +4,7 @@ from datetime import date
 from fastapi import HTTPException
 
 from ...repositories import SessionRepository
+from ...repositories.aio import AsyncSessionRepository
 
 
 class SessionService:
@@ -56,3 +57,44 @@ class SessionService:
             date_=date_,
         )
 
+
+
+class AsyncSessionService:
+    """SessionService 的 asyncio 版本，供 async def 路由使用"""
+
+    def __init__(self):
+        self.session_repo = AsyncSessionRepository()
+
+    async def get_session_by_id(self, session_id: int):
+        """根據 session_id 取得門診時段資訊"""
+        session = await self.session_repo.get_session_by_id(session_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return session
+
+    async def get_booked_count(self, session_id: int) -> int:
+        """取得某個門診時段的已預約數量"""
+        count = await self.session_repo.get_booked_count(session_id)
+        if count is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return count
+
+    async def get_remaining_capacity(self, session_id: int) -> int:
+        """取得某個門診時段的剩餘容量"""
+        remaining = await self.session_repo.get_remaining_capacity(session_id)
+        if remaining is None:
+            raise HTTPException(status_code=404, detail="Session not found")
+        return remaining
+
+    async def search_sessions(
+        self,
+        dept_id: Optional[int] = None,
+        provider_id: Optional[int] = None,
+        date_: Optional[date] = None,
+    ):
+        """搜尋門診時段，可根據科別、醫師、日期過濾"""
+        return await self.session_repo.search_sessions(
+            dept_id=dept_id,
+            provider_id=provider_id,
+            date_=date_,
+        )
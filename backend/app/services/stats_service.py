@@ -0,0 +1,71 @@
+# services/stats_service.py
+from datetime import date
+
+from fastapi import HTTPException
+
+from ..db_duck import duck_engine
+from ..analytics.clinic_stats import (
+    ENCOUNTER_STATS_GRANULARITIES,
+    ENCOUNTER_STATS_GROUPS,
+    encounter_stats_query,
+    encounter_stats_as_of,
+)
+
+STATS_FORMATS = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class StatsService:
+    """全院營運統計（讀取分析快照，不查詢 PostgreSQL）"""
+
+    def validate_encounter_stats(self, date_from: date, date_to: date, granularity: str, group_by: str, fmt: str):
+        if date_from > date_to:
+            raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+        if granularity not in ENCOUNTER_STATS_GRANULARITIES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown granularity '{granularity}', expected one of: {', '.join(ENCOUNTER_STATS_GRANULARITIES)}",
+            )
+        if group_by not in ENCOUNTER_STATS_GROUPS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown group_by '{group_by}', expected one of: {', '.join(ENCOUNTER_STATS_GROUPS)}",
+            )
+        if fmt not in STATS_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown format '{fmt}', expected one of: {', '.join(STATS_FORMATS)}",
+            )
+
+    def media_type(self, fmt: str):
+        return STATS_FORMATS[fmt]
+
+    def get_encounter_stats(self, date_from: date, date_to: date, granularity: str = "day", group_by: str = "none"):
+        """JSON 格式：{ 查詢條件, as_of, rows: [{period, ..., encounter_count}] }"""
+        sql, params = encounter_stats_query(date_from, date_to, granularity, group_by)
+        return {
+            "date_from": date_from,
+            "date_to": date_to,
+            "granularity": granularity,
+            "group_by": group_by,
+            "as_of": encounter_stats_as_of(),
+            "rows": duck_engine.fetch_dicts(sql, params),
+        }
+
+    def encounter_stats_bytes(self, date_from: date, date_to: date, granularity: str, group_by: str, fmt: str):
+        """Arrow IPC stream 或 Parquet 檔的內容：由 DuckDB 直接產生欄式資料，不逐列轉成 Python 物件"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        sql, params = encounter_stats_query(date_from, date_to, granularity, group_by)
+        table = duck_engine.fetch_arrow(sql, params)
+        sink = pa.BufferOutputStream()
+        if fmt == "arrow":
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            pq.write_table(table, sink)
+        return sink.getvalue().to_pybytes()
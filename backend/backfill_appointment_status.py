@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+回填並驗證 APPOINTMENT.current_status / status_changed_at
+
+用法：
+    python backfill_appointment_status.py            # 建立欄位（若不存在）並回填
+    python backfill_appointment_status.py --verify   # 只檢查，不寫入；有不一致時以非 0 結束
+"""
+import sys
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from app.config import PG_DSN
+
+# 每批回填的掛號數，避免單一交易鎖住整張 APPOINTMENT
+BATCH_SIZE = 5000
+
+# 最新狀態：每個掛號取最後一筆狀態歷史；沒有歷史的掛號視為 1（已預約）
+MISMATCH_SQL = """
+    SELECT
+        a.appt_id,
+        a.current_status,
+        a.status_changed_at,
+        COALESCE(ls.to_status, 1) AS expected_status,
+        ls.changed_at AS expected_changed_at
+    FROM APPOINTMENT a
+    LEFT JOIN (
+        SELECT DISTINCT ON (ash.appt_id)
+               ash.appt_id,
+               ash.to_status,
+               ash.changed_at
+        FROM APPOINTMENT_STATUS_HISTORY ash
+        ORDER BY ash.appt_id, ash.changed_at DESC
+    ) AS ls ON ls.appt_id = a.appt_id
+    WHERE a.current_status IS DISTINCT FROM COALESCE(ls.to_status, 1)
+       OR a.status_changed_at IS DISTINCT FROM ls.changed_at
+    ORDER BY a.appt_id
+"""
+
+
+def ensure_columns(conn):
+    """建立反正規化欄位（可重複執行）"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            ALTER TABLE APPOINTMENT
+                ADD COLUMN IF NOT EXISTS current_status SMALLINT NOT NULL DEFAULT 1;
+            ALTER TABLE APPOINTMENT
+                ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMP;
+            CREATE INDEX IF NOT EXISTS idx_appointment_session_id_current_status
+            ON APPOINTMENT(session_id, current_status);
+            CREATE INDEX IF NOT EXISTS idx_appointment_patient_id_current_status
+            ON APPOINTMENT(patient_id, current_status);
+            """
+        )
+    conn.commit()
+
+
+def backfill(conn):
+    """依 appt_id 分批回填，回傳更新筆數"""
+    total = 0
+    with conn.cursor() as cur:
+        cur.execute("SELECT COALESCE(MIN(appt_id), 0), COALESCE(MAX(appt_id), 0) FROM APPOINTMENT;")
+        min_id, max_id = cur.fetchone()
+
+        start = min_id
+        while start <= max_id:
+            end = start + BATCH_SIZE
+            cur.execute(
+                """
+                UPDATE APPOINTMENT a
+                SET current_status = COALESCE(ls.to_status, 1),
+                    status_changed_at = ls.changed_at
+                FROM APPOINTMENT a2
+                LEFT JOIN LATERAL (
+                    SELECT ash.to_status, ash.changed_at
+                    FROM APPOINTMENT_STATUS_HISTORY ash
+                    WHERE ash.appt_id = a2.appt_id
+                    ORDER BY ash.changed_at DESC
+                    LIMIT 1
+                ) AS ls ON TRUE
+                WHERE a.appt_id = a2.appt_id
+                  AND a2.appt_id >= %s AND a2.appt_id < %s
+                  AND (a.current_status IS DISTINCT FROM COALESCE(ls.to_status, 1)
+                       OR a.status_changed_at IS DISTINCT FROM ls.changed_at);
+                """,
+                (start, end),
+            )
+            total += cur.rowcount
+            conn.commit()
+            start = end
+    return total
+
+
+def verify(conn, limit=20):
+    """列出與狀態歷史不一致的掛號，回傳不一致筆數"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute(MISMATCH_SQL)
+        rows = cur.fetchall()
+
+    if not rows:
+        print("✅ 所有掛號的 current_status / status_changed_at 與狀態歷史一致")
+        return 0
+
+    print(f"❌ 共 {len(rows)} 筆掛號與狀態歷史不一致（顯示前 {min(limit, len(rows))} 筆）：")
+    for row in rows[:limit]:
+        print(
+            f"  appt_id={row['appt_id']}: "
+            f"current_status={row['current_status']} (應為 {row['expected_status']}), "
+            f"status_changed_at={row['status_changed_at']} (應為 {row['expected_changed_at']})"
+        )
+    return len(rows)
+
+
+def main():
+    verify_only = "--verify" in sys.argv[1:]
+    conn = psycopg2.connect(PG_DSN)
+    try:
+        if not verify_only:
+            print("=== 建立欄位 ===")
+            ensure_columns(conn)
+            print("=== 回填 current_status / status_changed_at ===")
+            updated = backfill(conn)
+            print(f"已更新 {updated} 筆掛號")
+            if updated:
+                print("current_status 有變動，請接著執行 python reconcile_booked_counts.py 重新計算各門診已預約人數")
+            print()
+
+        print("=== 驗證 ===")
+        mismatches = verify(conn)
+        return 1 if mismatches else 0
+    except Exception as e:
+        conn.rollback()
+        print(f"錯誤: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
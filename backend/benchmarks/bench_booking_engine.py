@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+掛號引擎（app.booking.BookingEngine）併發壓力測試
+
+在獨立 schema（預設 bench_booking_engine）建立精簡版資料表與一個門診時段，
+同時送出 --requests 筆掛號（每筆不同病人，另有 --duplicates 筆重複送出），分別量測：
+- direct：每筆請求各自一個交易、各自鎖定 CLINIC_SESSION（AsyncAppointmentRepository.create_appointment）
+- engine：經過 booking_engine.book()，同一 session 的請求合併成一批、整批只鎖一次
+每一輪結束後檢查沒有超賣：成功筆數 = min(容量, 病人數) = booked_count = 已預約掛號數，
+slot_seq 為 1..成功筆數且不重複，同一病人最多一筆掛號；任何一項不符即以非零狀態結束。
+
+用法（在 backend/ 目錄下）：
+    python benchmarks/bench_booking_engine.py
+    python benchmarks/bench_booking_engine.py --requests 1000 --capacity 200 --rounds 3
+    python benchmarks/bench_booking_engine.py --keep     # 保留測試 schema
+"""
+import argparse
+import asyncio
+import functools
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PROVIDER_ID = 1
+SESSION_ID = 1
+
+SCHEMA_SQL = """
+    -- 門診時段變更通知（app.events.notify_session_changes）需要醫師的科別
+    CREATE TABLE PROVIDER (
+        user_id INT PRIMARY KEY,
+        dept_id INT
+    );
+    CREATE TABLE CLINIC_SESSION (
+        session_id    INT PRIMARY KEY,
+        provider_id   INT NOT NULL,
+        date          DATE NOT NULL,
+        period        SMALLINT NOT NULL,
+        capacity      INT NOT NULL,
+        status        SMALLINT NOT NULL DEFAULT 1,
+        booked_count  INT NOT NULL DEFAULT 0 CHECK (booked_count >= 0),
+        next_slot_seq INT NOT NULL DEFAULT 1
+    );
+    CREATE TABLE APPOINTMENT (
+        appt_id           SERIAL PRIMARY KEY,
+        patient_id        INT NOT NULL,
+        session_id        INT NOT NULL REFERENCES CLINIC_SESSION (session_id),
+        slot_seq          INT NOT NULL,
+        current_status    SMALLINT NOT NULL DEFAULT 1,
+        status_changed_at TIMESTAMP
+    );
+    CREATE TABLE APPOINTMENT_STATUS_HISTORY (
+        appt_id     INT NOT NULL REFERENCES APPOINTMENT (appt_id),
+        from_status SMALLINT,
+        to_status   SMALLINT NOT NULL,
+        changed_by  INT NOT NULL,
+        changed_at  TIMESTAMP NOT NULL
+    );
+
+    -- 與 create_indexes.sql / migrate_appointment_current_status.sql 相同的索引
+    CREATE INDEX ON APPOINTMENT (patient_id);
+    CREATE INDEX ON APPOINTMENT (session_id, slot_seq);
+    CREATE INDEX ON APPOINTMENT (patient_id, current_status);
+    CREATE INDEX ON APPOINTMENT_STATUS_HISTORY (appt_id, changed_at DESC);
+"""
+
+
+def setup_schema(conn, schema):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {schema};")
+        cur.execute(f"SET search_path TO {schema};")
+        cur.execute(SCHEMA_SQL)
+        cur.execute("INSERT INTO PROVIDER (user_id, dept_id) VALUES (%s, 1);", (PROVIDER_ID,))
+    conn.commit()
+
+
+def reset_session(conn, capacity):
+    """清空掛號並重建門診時段（一週後的第 1 時段，不會被視為已結束）"""
+    with conn.cursor() as cur:
+        cur.execute("TRUNCATE APPOINTMENT_STATUS_HISTORY, APPOINTMENT, CLINIC_SESSION RESTART IDENTITY;")
+        cur.execute(
+            """
+            INSERT INTO CLINIC_SESSION (session_id, provider_id, date, period, capacity)
+            VALUES (%s, %s, CURRENT_DATE + 7, 1, %s);
+            """,
+            (SESSION_ID, PROVIDER_ID, capacity),
+        )
+    conn.commit()
+
+
+def verify(conn, outcomes, patient_count, capacity):
+    """檢查沒有超賣與重複配號，回傳錯誤訊息 list（空 list 表示通過）"""
+    problems = []
+    expected = min(capacity, patient_count)
+    succeeded = sum(1 for outcome in outcomes if not isinstance(outcome, Exception))
+    with conn.cursor() as cur:
+        cur.execute("SELECT booked_count, next_slot_seq FROM CLINIC_SESSION WHERE session_id = %s;", (SESSION_ID,))
+        booked_count, next_slot_seq = cur.fetchone()
+        cur.execute("SELECT patient_id, slot_seq FROM APPOINTMENT WHERE session_id = %s AND current_status = 1;", (SESSION_ID,))
+        rows = cur.fetchall()
+        cur.execute("SELECT COUNT(*) FROM APPOINTMENT_STATUS_HISTORY;")
+        history_count = cur.fetchone()[0]
+    conn.rollback()
+
+    if succeeded != expected:
+        problems.append(f"成功 {succeeded} 筆，預期 {expected} 筆")
+    if booked_count != len(rows) or booked_count != succeeded:
+        problems.append(f"booked_count={booked_count}、已預約掛號 {len(rows)} 筆、成功 {succeeded} 筆不一致")
+    if booked_count > capacity:
+        problems.append(f"超賣：booked_count={booked_count} > capacity={capacity}")
+    slot_seqs = sorted(slot_seq for _, slot_seq in rows)
+    if slot_seqs != list(range(1, len(rows) + 1)) or next_slot_seq != len(rows) + 1:
+        problems.append(f"slot_seq 不連續或重複（next_slot_seq={next_slot_seq}）")
+    duplicated = [patient_id for patient_id, count in Counter(p for p, _ in rows).items() if count > 1]
+    if duplicated:
+        problems.append(f"同一病人重複掛號：{duplicated[:10]}")
+    if history_count != len(rows):
+        problems.append(f"狀態歷史 {history_count} 筆，預期 {len(rows)} 筆")
+    unexpected = Counter(
+        str(outcome) for outcome in outcomes
+        if isinstance(outcome, Exception)
+        and str(outcome) not in ("Session is full", "無法重複預約同一門診")
+    )
+    if unexpected:
+        problems.append(f"非預期錯誤：{dict(unexpected)}")
+    return problems
+
+
+async def run_round(book, patient_ids):
+    """同時送出所有請求，回傳 (耗時秒數, 每筆結果)"""
+    started = time.perf_counter()
+    outcomes = await asyncio.gather(
+        *(book(patient_id, SESSION_ID) for patient_id in patient_ids),
+        return_exceptions=True,
+    )
+    return time.perf_counter() - started, outcomes
+
+
+async def run(args, conn):
+    from app.booking import BookingEngine
+    from app.pg_async import close_async_pool, open_async_pool
+    from app.repositories.aio import AsyncAppointmentRepository
+
+    await open_async_pool()
+    engine = BookingEngine(batch_max_size=args.batch_size)
+    # 不加入候補：額滿後的請求都應回傳 Session is full
+    modes = {
+        "direct": functools.partial(AsyncAppointmentRepository.create_appointment, join_waitlist=False),
+        "engine": functools.partial(engine.book, join_waitlist=False),
+    }
+    # 每筆不同病人，另外讓前 --duplicates 位病人再送一次
+    patient_ids = list(range(1, args.requests + 1)) + list(range(1, args.duplicates + 1))
+
+    failed = False
+    try:
+        print(f"{args.requests} 位病人（另 {args.duplicates} 筆重複）搶 {args.capacity} 個名額")
+        print(f"{'mode':>8} | {'median (ms)':>12} | {'req/s':>8} | {'booked':>6} | result")
+        print("-" * 60)
+        for mode, book in modes.items():
+            timings = []
+            mode_failed = False
+            for _ in range(args.rounds):
+                reset_session(conn, args.capacity)
+                elapsed, outcomes = await run_round(book, patient_ids)
+                timings.append(elapsed)
+                problems = verify(conn, outcomes, args.requests, args.capacity)
+                if problems:
+                    mode_failed = failed = True
+                    for problem in problems:
+                        print(f"❌ [{mode}] {problem}")
+            median = statistics.median(timings)
+            booked = sum(1 for outcome in outcomes if not isinstance(outcome, Exception))
+            print(
+                f"{mode:>8} | {median * 1000:>12.1f} | {len(patient_ids) / median:>8.0f} | "
+                f"{booked:>6} | {'❌' if mode_failed else '✅ 沒有超賣'}"
+            )
+        print(f"engine 統計：{engine.stats()}")
+    finally:
+        await close_async_pool()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000, help="同時送出的掛號請求數（不同病人）")
+    parser.add_argument("--duplicates", type=int, default=50, help="另外重複送出的請求數")
+    parser.add_argument("--capacity", type=int, default=100, help="門診時段容量")
+    parser.add_argument("--batch-size", type=int, default=100, help="engine 每批最多筆數")
+    parser.add_argument("--rounds", type=int, default=3, help="每種模式重複次數（取中位數）")
+    parser.add_argument("--schema", default="bench_booking_engine", help="測試用 schema 名稱")
+    parser.add_argument("--keep", action="store_true", help="結束後保留測試 schema")
+    args = parser.parse_args()
+
+    # 讓連線池的每條連線都使用測試 schema（libpq 會讀取 PGOPTIONS）
+    os.environ["PGOPTIONS"] = f"-c search_path={args.schema}"
+    from app.pg_base import get_pg_conn
+
+    conn = get_pg_conn()
+    try:
+        setup_schema(conn, args.schema)
+        failed = asyncio.run(run(args, conn))
+    finally:
+        conn.rollback()
+        if not args.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE;")
+            conn.commit()
+        conn.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
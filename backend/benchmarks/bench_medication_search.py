@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+藥品搜尋（PrescriptionRepository.search_medications）效能測試
+
+在獨立 schema（預設 bench_medication_search）建立 MEDICATION 並灌入指定筆數（預設 10 萬筆）的藥品，
+分兩個階段量測幾組典型查詢：
+1. 未建立搜尋索引
+2. 執行 create_search_indexes.sql 之後
+每個階段量測：
+- legacy：舊版 CAST(med_id AS TEXT) ILIKE / name ILIKE、ORDER BY med_id 的查詢
+- current：PrescriptionRepository.search_medications（排序、前綴／主鍵快速路徑、相似度）
+
+為了讓 repository 的連線池也連到測試 schema，腳本會在匯入 app 之前設定
+PGOPTIONS 的 search_path（測試 schema 優先，其次 public，pg_trgm 通常安裝在 public）。
+
+用法（在 backend/ 目錄下）：
+    python benchmarks/bench_medication_search.py
+    python benchmarks/bench_medication_search.py --rows 500000 --repeat 50
+    python benchmarks/bench_medication_search.py --keep     # 保留測試 schema
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000, help="藥品筆數")
+    parser.add_argument("--repeat", type=int, default=20, help="每個查詢重複次數（取中位數）")
+    parser.add_argument("--schema", default="bench_medication_search", help="測試用 schema 名稱")
+    parser.add_argument("--keep", action="store_true", help="結束後保留測試 schema")
+    return parser.parse_args()
+
+
+ARGS = _parse_args()
+os.environ["PGOPTIONS"] = f"{os.environ.get('PGOPTIONS', '')} -c search_path={ARGS.schema},public".strip()
+
+from app.pg_base import get_pg_conn, close_pg_pool  # noqa: E402
+from app.repositories.prescription_repo import PrescriptionRepository  # noqa: E402
+
+LEGACY_SQL = """
+    SELECT med_id, name, spec, unit
+    FROM MEDICATION
+    WHERE CAST(med_id AS TEXT) ILIKE %s OR name ILIKE %s
+    ORDER BY med_id
+    LIMIT %s;
+"""
+
+SCHEMA_SQL = """
+    CREATE TABLE MEDICATION (
+        med_id INT PRIMARY KEY,
+        name   VARCHAR(200) NOT NULL,
+        spec   VARCHAR(100),
+        unit   VARCHAR(20)
+    );
+"""
+
+# 由音節組合出藥名，讓 trigram 分布接近真實藥品目錄（大量共用字首／字尾）
+SEED_SQL = """
+    SELECT setseed(0.42);
+    INSERT INTO MEDICATION (med_id, name, spec, unit)
+    SELECT
+        g,
+        initcap(
+            (ARRAY['amo','para','ibu','met','ator','losa','ome','cef','levo','clo',
+                   'pre','dex','flu','vala','nife','sim','ros','war','gaba','sertra'])[1 + floor(random() * 20)::int]
+            || (ARRAY['xi','ce','pro','for','va','ta','pra','ro','flo','pi',
+                      'me','ni','zo','li','do','ba','ti','sa','mi','lo'])[1 + floor(random() * 20)::int]
+            || (ARRAY['cillin','tamol','fen','min','statin','rtan','zole','azolin','xacin','pidogrel',
+                      'dnisone','amethasone','conazole','cyclovir','dipine','vastatin','uvastatin','farin','pentin','line'])[1 + floor(random() * 20)::int]
+        ) || ' ' || (g % 97),
+        (ARRAY['5 mg','10 mg','20 mg','50 mg','100 mg','250 mg','500 mg','1 g','5 mg/ml','100 mg/5 ml'])[1 + floor(random() * 10)::int],
+        (ARRAY['tab','cap','ml','vial','amp','bottle','tube','sachet'])[1 + floor(random() * 8)::int]
+    FROM generate_series(1, %s) AS g;
+    ANALYZE MEDICATION;
+"""
+
+# (說明, query, spec, unit)
+CASES = [
+    ("exact med_id", "12345", None, None),
+    ("short prefix", "am", None, None),
+    ("name prefix", "amoxi", None, None),
+    ("name infix", "cillin", None, None),
+    ("full name", "Amoxicillin 7", None, None),
+    ("typo", "amoxicilin", None, None),
+    ("infix + unit", "statin", None, "tab"),
+    ("no match", "zzzzzz", None, None),
+]
+
+
+def setup_schema(conn, schema, rows):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {schema};")
+        cur.execute(SCHEMA_SQL)
+        cur.execute(SEED_SQL, (rows,))
+    conn.commit()
+
+
+def create_search_indexes(conn):
+    with open(os.path.join(BACKEND_DIR, "create_search_indexes.sql"), encoding="utf-8") as f:
+        sql = f.read()
+    with conn.cursor() as cur:
+        cur.execute(sql)
+    conn.commit()
+
+
+def measure(fn, repeat):
+    """執行 repeat 次，回傳中位數毫秒與最後一次的結果"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), result
+
+
+def run_cases(conn, repeat, label):
+    print(f"\n[{label}]")
+    print(f"{'case':>16} | {'legacy (ms)':>12} | {'current (ms)':>12} | {'rows':>5} | first result")
+    print("-" * 90)
+    for title, query, spec, unit in CASES:
+        def run_legacy():
+            with conn.cursor() as cur:
+                cur.execute(LEGACY_SQL, (f"%{query}%", f"%{query}%", 50))
+                return cur.fetchall()
+
+        def run_current():
+            return PrescriptionRepository.search_medications(query, 50, 0, spec, unit)
+
+        legacy_ms, _ = measure(run_legacy, repeat)
+        current_ms, rows = measure(run_current, repeat)
+        conn.rollback()
+        first = f"{rows[0]['med_id']} {rows[0]['name']}" if rows else "-"
+        print(f"{title:>16} | {legacy_ms:>12.2f} | {current_ms:>12.2f} | {len(rows):>5} | {first}")
+
+
+def main():
+    conn = get_pg_conn()
+    try:
+        setup_schema(conn, ARGS.schema, ARGS.rows)
+        print(f"MEDICATION rows: {ARGS.rows:,}")
+
+        run_cases(conn, ARGS.repeat, "without search indexes")
+
+        create_search_indexes(conn)
+        # 建立索引後重新判斷 pg_trgm 是否可用
+        PrescriptionRepository._has_pg_trgm = None
+        run_cases(conn, ARGS.repeat, "with create_search_indexes.sql")
+    finally:
+        conn.rollback()
+        if not ARGS.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {ARGS.schema} CASCADE;")
+            conn.commit()
+        conn.close()
+        close_pg_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+病人過期掛號處理（_auto_update_expired_appointments_for_patient）效能測試
+
+在獨立 schema（預設 bench_patient_expiry）建立精簡版資料表，逐步把 APPOINTMENT_STATUS_HISTORY
+灌到指定筆數，每個規模量測：
+- legacy：舊版對整張歷史表 DISTINCT ON 再過濾病人的查詢（只量 SELECT）
+- current：AppointmentRepository._mark_expired_no_shows(conn, patient_id)（含寫入，每次 rollback）
+預期 current 的耗時不隨歷史表筆數成長，legacy 則大致線性成長。
+
+用法（在 backend/ 目錄下）：
+    python benchmarks/bench_patient_expiry.py
+    python benchmarks/bench_patient_expiry.py --sizes 100000,1000000,5000000 --repeat 20
+    python benchmarks/bench_patient_expiry.py --keep     # 保留測試 schema
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.pg_base import get_pg_conn  # noqa: E402
+from app.repositories.appointment_repo import AppointmentRepository  # noqa: E402
+
+# 每個掛號平均寫入的狀態歷史筆數（預約 → 報到 → 完成）
+HISTORY_PER_APPOINTMENT = 3
+# 量測對象：固定 1 位病人、20 筆掛號，其中 5 筆為已結束但未報到
+TARGET_PATIENT_ID = 1
+TARGET_APPOINTMENTS = 20
+TARGET_EXPIRED = 5
+PROVIDER_ID = 1
+
+LEGACY_SQL = """
+    WITH latest_status AS (
+        SELECT DISTINCT ON (ash.appt_id)
+               ash.appt_id,
+               ash.to_status AS latest_status
+        FROM APPOINTMENT_STATUS_HISTORY ash
+        ORDER BY ash.appt_id, ash.changed_at DESC
+    )
+    SELECT a.appt_id, a.session_id, cs.provider_id, COALESCE(ls.latest_status, 1) AS latest_status
+    FROM APPOINTMENT a
+    JOIN CLINIC_SESSION cs ON a.session_id = cs.session_id
+    LEFT JOIN latest_status ls ON ls.appt_id = a.appt_id
+    WHERE a.patient_id = %s
+      AND COALESCE(ls.latest_status, 1) = 1
+      AND cs.date < CURRENT_DATE
+      AND NOT EXISTS (SELECT 1 FROM ENCOUNTER e WHERE e.appt_id = a.appt_id);
+"""
+
+SCHEMA_SQL = """
+    -- 門診時段變更通知（app.events.notify_session_changes）需要醫師的科別
+    CREATE TABLE PROVIDER (user_id INT PRIMARY KEY, dept_id INT);
+    CREATE TABLE CLINIC_SESSION (
+        session_id   INT PRIMARY KEY,
+        provider_id  INT NOT NULL,
+        date         DATE NOT NULL,
+        period       SMALLINT NOT NULL,
+        capacity     INT NOT NULL,
+        status       SMALLINT NOT NULL DEFAULT 1,
+        booked_count INT NOT NULL DEFAULT 0
+    );
+    CREATE TABLE APPOINTMENT (
+        appt_id           INT PRIMARY KEY,
+        patient_id        INT NOT NULL,
+        session_id        INT NOT NULL,
+        slot_seq          INT NOT NULL,
+        current_status    SMALLINT NOT NULL DEFAULT 1,
+        status_changed_at TIMESTAMP
+    );
+    CREATE TABLE APPOINTMENT_STATUS_HISTORY (
+        appt_id     INT NOT NULL,
+        from_status SMALLINT,
+        to_status   SMALLINT NOT NULL,
+        changed_by  INT NOT NULL,
+        changed_at  TIMESTAMP NOT NULL
+    );
+    CREATE TABLE ENCOUNTER (enct_id SERIAL PRIMARY KEY, appt_id INT NOT NULL);
+    CREATE TABLE no_show_event (patient_id INT NOT NULL, appt_id INT NOT NULL, recorded_at TIMESTAMP);
+    CREATE TABLE patient (user_id INT PRIMARY KEY, banned_until DATE);
+
+    -- 與 create_indexes.sql / migrate_appointment_current_status.sql 相同的索引
+    CREATE INDEX ON APPOINTMENT_STATUS_HISTORY (appt_id, changed_at DESC);
+    CREATE INDEX ON APPOINTMENT (patient_id);
+    CREATE INDEX ON APPOINTMENT (session_id);
+    CREATE INDEX ON APPOINTMENT (patient_id, current_status);
+    CREATE INDEX ON ENCOUNTER (appt_id);
+    CREATE INDEX ON no_show_event (patient_id);
+"""
+
+
+def setup_schema(conn, schema):
+    with conn.cursor() as cur:
+        cur.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE;")
+        cur.execute(f"CREATE SCHEMA {schema};")
+        cur.execute(f"SET search_path TO {schema};")
+        cur.execute(SCHEMA_SQL)
+        # 2000 個過去的門診時段
+        cur.execute(
+            """
+            INSERT INTO CLINIC_SESSION (session_id, provider_id, date, period, capacity, status)
+            SELECT g, %s, CURRENT_DATE - (g % 365 + 1), g % 3 + 1, 60, 1
+            FROM generate_series(1, 2000) AS g;
+            """,
+            (PROVIDER_ID,),
+        )
+        # 量測對象病人的掛號：前 TARGET_EXPIRED 筆維持已預約（會被標記），其餘已完成
+        cur.execute(
+            """
+            INSERT INTO PROVIDER (user_id, dept_id) VALUES (%s, 1);
+            INSERT INTO patient (user_id) VALUES (%s);
+            INSERT INTO APPOINTMENT (appt_id, patient_id, session_id, slot_seq, current_status)
+            SELECT g, %s, g, 1, CASE WHEN g <= %s THEN 1 ELSE 3 END
+            FROM generate_series(1, %s) AS g;
+            INSERT INTO APPOINTMENT_STATUS_HISTORY (appt_id, from_status, to_status, changed_by, changed_at)
+            SELECT appt_id, NULL, 1, %s, NOW() - INTERVAL '400 days' FROM APPOINTMENT;
+            INSERT INTO APPOINTMENT_STATUS_HISTORY (appt_id, from_status, to_status, changed_by, changed_at)
+            SELECT appt_id, 1, 3, %s, NOW() - INTERVAL '399 days' FROM APPOINTMENT WHERE current_status = 3;
+            INSERT INTO ENCOUNTER (appt_id) SELECT appt_id FROM APPOINTMENT WHERE current_status = 3;
+            """,
+            (
+                PROVIDER_ID, TARGET_PATIENT_ID, TARGET_PATIENT_ID, TARGET_EXPIRED, TARGET_APPOINTMENTS,
+                PROVIDER_ID, PROVIDER_ID,
+            ),
+        )
+    conn.commit()
+
+
+def grow_history(conn, target_rows):
+    """加入其他病人的已完成掛號，直到狀態歷史達到 target_rows 筆"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM APPOINTMENT_STATUS_HISTORY;")
+        current_rows = cur.fetchone()[0]
+        if current_rows >= target_rows:
+            return current_rows
+        cur.execute("SELECT COALESCE(MAX(appt_id), 0) FROM APPOINTMENT;")
+        next_id = cur.fetchone()[0] + 1
+        new_appts = (target_rows - current_rows) // HISTORY_PER_APPOINTMENT + 1
+        last_id = next_id + new_appts - 1
+
+        cur.execute(
+            """
+            INSERT INTO APPOINTMENT (appt_id, patient_id, session_id, slot_seq, current_status)
+            SELECT g, 1000 + g % 50000, g % 2000 + 1, g % 60 + 1, 3
+            FROM generate_series(%s, %s) AS g;
+            """,
+            (next_id, last_id),
+        )
+        cur.execute(
+            """
+            INSERT INTO APPOINTMENT_STATUS_HISTORY (appt_id, from_status, to_status, changed_by, changed_at)
+            SELECT g, s.from_status, s.to_status, %s, NOW() - INTERVAL '300 days' + s.step * INTERVAL '1 hour'
+            FROM generate_series(%s, %s) AS g
+            CROSS JOIN (VALUES (0, NULL::smallint, 1::smallint), (1, 1, 2), (2, 2, 3)) AS s(step, from_status, to_status);
+            """,
+            (PROVIDER_ID, next_id, last_id),
+        )
+        cur.execute(
+            "INSERT INTO ENCOUNTER (appt_id) SELECT g FROM generate_series(%s, %s) AS g;",
+            (next_id, last_id),
+        )
+        cur.execute("ANALYZE;")
+        cur.execute("SELECT COUNT(*) FROM APPOINTMENT_STATUS_HISTORY;")
+        rows = cur.fetchone()[0]
+    conn.commit()
+    return rows
+
+
+def measure(conn, fn, repeat):
+    """執行 repeat 次並 rollback，回傳中位數毫秒"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+        conn.rollback()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000,3000000",
+                        help="狀態歷史筆數（逗號分隔，由小到大）")
+    parser.add_argument("--repeat", type=int, default=10, help="每個規模重複次數（取中位數）")
+    parser.add_argument("--schema", default="bench_patient_expiry", help="測試用 schema 名稱")
+    parser.add_argument("--keep", action="store_true", help="結束後保留測試 schema")
+    args = parser.parse_args()
+    sizes = sorted(int(x) for x in args.sizes.split(","))
+
+    conn = get_pg_conn()
+    try:
+        setup_schema(conn, args.schema)
+
+        def run_legacy():
+            with conn.cursor() as cur:
+                cur.execute(LEGACY_SQL, (TARGET_PATIENT_ID,))
+                cur.fetchall()
+
+        def run_current():
+            result = AppointmentRepository._mark_expired_no_shows(conn, TARGET_PATIENT_ID)
+            assert result["marked"] == TARGET_EXPIRED, result
+
+        print(f"{'history rows':>14} | {'legacy (ms)':>12} | {'current (ms)':>12}")
+        print("-" * 46)
+        for size in sizes:
+            rows = grow_history(conn, size)
+            with conn.cursor() as cur:
+                cur.execute(f"SET search_path TO {args.schema};")
+            conn.commit()
+            legacy_ms = measure(conn, run_legacy, args.repeat)
+            current_ms = measure(conn, run_current, args.repeat)
+            print(f"{rows:>14,} | {legacy_ms:>12.2f} | {current_ms:>12.2f}")
+    finally:
+        conn.rollback()
+        if not args.keep:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {args.schema} CASCADE;")
+            conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
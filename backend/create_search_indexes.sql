@@ -0,0 +1,55 @@
+-- ============================================================
+-- 搜尋用索引建立腳本（藥品搜尋）
+-- ============================================================
+-- 供 PrescriptionRepository.search_medications（GET /provider/medications）使用
+-- 需要 pg_trgm 擴充套件（CREATE EXTENSION 需要資料庫擁有者或超級使用者權限）
+-- 執行方式：psql -d dbms -f create_search_indexes.sql
+-- 未安裝 pg_trgm 時搜尋仍可使用，只是不做相似度排序、包含比對會掃描整張表
+-- ============================================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- ============================================================
+-- 1. 藥名
+-- ============================================================
+
+-- trigram GIN 索引：name ILIKE '%q%' 與相似度比對（name % q）
+CREATE INDEX IF NOT EXISTS idx_medication_name_trgm
+ON MEDICATION USING gin (name gin_trgm_ops);
+
+-- 前綴索引：少於 3 個字的查詢（lower(name) LIKE 'q%'）
+CREATE INDEX IF NOT EXISTS idx_medication_name_lower_prefix
+ON MEDICATION (lower(name) text_pattern_ops);
+
+-- ============================================================
+-- 2. 藥品代碼（以文字比對 med_id 的一部分）
+-- ============================================================
+
+-- trigram GIN 索引：CAST(med_id AS TEXT) ILIKE '%q%'
+CREATE INDEX IF NOT EXISTS idx_medication_med_id_text_trgm
+ON MEDICATION USING gin ((CAST(med_id AS TEXT)) gin_trgm_ops);
+
+-- 前綴索引：CAST(med_id AS TEXT) LIKE 'q%'
+CREATE INDEX IF NOT EXISTS idx_medication_med_id_text_prefix
+ON MEDICATION ((CAST(med_id AS TEXT)) text_pattern_ops);
+
+-- ============================================================
+-- 3. 規格／單位篩選
+-- ============================================================
+
+-- 規格包含比對：spec ILIKE '%q%'
+CREATE INDEX IF NOT EXISTS idx_medication_spec_trgm
+ON MEDICATION USING gin (spec gin_trgm_ops);
+
+-- 單位完全相同（不分大小寫）：lower(unit) = lower(q)
+CREATE INDEX IF NOT EXISTS idx_medication_unit_lower
+ON MEDICATION (lower(unit));
+
+ANALYZE MEDICATION;
+
+-- ============================================================
+-- 索引建立完成
+-- ============================================================
+-- 檢查：
+-- SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'medication';
+-- ============================================================
@@ -0,0 +1,16 @@
+-- ============================================================
+-- 分析快照用索引（增量更新時找出有變更的月份）
+-- ============================================================
+-- 供 app.analytics.snapshot.refresh_snapshot 使用：
+--   ENCOUNTER.updated_at > 上次的 high-water mark
+--   APPOINTMENT.status_changed_at > 上次的 high-water mark
+-- 需先執行 migrate_history_sync.sql（updated_at）與 migrate_appointment_current_status.sql（status_changed_at）
+-- 執行方式：psql -d dbms -f create_snapshot_indexes.sql
+-- 未建立時快照仍可更新，只是每次都要掃描整張表
+-- ============================================================
+
+CREATE INDEX IF NOT EXISTS idx_encounter_updated_at
+ON ENCOUNTER (updated_at);
+
+CREATE INDEX IF NOT EXISTS idx_appointment_status_changed_at
+ON APPOINTMENT (status_changed_at);
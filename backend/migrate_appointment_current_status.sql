@@ -0,0 +1,44 @@
+-- ============================================================
+-- APPOINTMENT 反正規化狀態欄位
+-- ============================================================
+-- 在 APPOINTMENT 上維護目前狀態，避免每次讀取都對
+-- APPOINTMENT_STATUS_HISTORY 做 LATERAL (ORDER BY changed_at DESC LIMIT 1)。
+--
+-- current_status     ：最新一筆 APPOINTMENT_STATUS_HISTORY.to_status（沒有歷史時為 1 = 已預約）
+-- status_changed_at  ：最新一筆 APPOINTMENT_STATUS_HISTORY.changed_at
+--
+-- 兩個欄位由 AppointmentRepository._insert_status_history 在同一交易中維護。
+-- 執行方式（需在部署新版程式前完成）：
+--   psql -d dbms -f migrate_appointment_current_status.sql
+--   python backfill_appointment_status.py --verify
+-- ============================================================
+
+ALTER TABLE APPOINTMENT
+    ADD COLUMN IF NOT EXISTS current_status SMALLINT NOT NULL DEFAULT 1;
+
+ALTER TABLE APPOINTMENT
+    ADD COLUMN IF NOT EXISTS status_changed_at TIMESTAMP;
+
+-- 回填：每個掛號取最後一筆狀態歷史
+UPDATE APPOINTMENT a
+SET current_status = ls.to_status,
+    status_changed_at = ls.changed_at
+FROM (
+    SELECT DISTINCT ON (ash.appt_id)
+           ash.appt_id,
+           ash.to_status,
+           ash.changed_at
+    FROM APPOINTMENT_STATUS_HISTORY ash
+    ORDER BY ash.appt_id, ash.changed_at DESC
+) AS ls
+WHERE a.appt_id = ls.appt_id
+  AND (a.current_status IS DISTINCT FROM ls.to_status
+       OR a.status_changed_at IS DISTINCT FROM ls.changed_at);
+
+-- 門診時段的已預約人數／掛號清單：依 session 與狀態過濾
+CREATE INDEX IF NOT EXISTS idx_appointment_session_id_current_status
+ON APPOINTMENT(session_id, current_status);
+
+-- 病人掛號清單與過期掛號處理：依病人與狀態過濾
+CREATE INDEX IF NOT EXISTS idx_appointment_patient_id_current_status
+ON APPOINTMENT(patient_id, current_status);
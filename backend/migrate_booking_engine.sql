@@ -0,0 +1,26 @@
+-- ============================================================
+-- CLINIC_SESSION 掛號序號計數器
+-- ============================================================
+-- next_slot_seq：該門診時段下一個要配發的 slot_seq（只增不減）
+--
+-- 建立掛號（app.booking.BookingEngine 整批配發、AppointmentRepository.create_appointment）
+-- 與更換門診時段（AppointmentRepository.modify_appointment）都從此計數器取號，
+-- 取消後再掛號不會拿到與既有掛號相同的 slot_seq。
+-- 需先完成 migrate_session_booked_count.sql。
+-- 執行方式：
+--   psql -d dbms -f migrate_booking_engine.sql
+-- ============================================================
+
+ALTER TABLE CLINIC_SESSION
+    ADD COLUMN IF NOT EXISTS next_slot_seq INTEGER NOT NULL DEFAULT 1;
+
+-- 回填：已配發的最大 slot_seq + 1
+UPDATE CLINIC_SESSION cs
+SET next_slot_seq = used.max_slot_seq + 1
+FROM (
+    SELECT a.session_id, MAX(a.slot_seq) AS max_slot_seq
+    FROM APPOINTMENT a
+    GROUP BY a.session_id
+) AS used
+WHERE cs.session_id = used.session_id
+  AND cs.next_slot_seq <= used.max_slot_seq;
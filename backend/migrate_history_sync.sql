@@ -0,0 +1,95 @@
+-- ============================================================
+-- 病人歷史記錄增量同步：ENCOUNTER.updated_at
+-- ============================================================
+-- GET /patient/history 與 GET /provider/{id}/patients/{pid}/history 的 updated_since 模式
+-- 以就診為單位回傳變更：就診本身或其診斷、處方（含用藥明細）、檢驗結果、繳費
+-- 有新增、修改、刪除時，都把該就診的 updated_at 設為目前交易時間。
+--
+-- updated_at：只在就診內容欄位變更時更新（鎖定／解鎖編輯的 locked_by、locked_at 不算）。
+-- 執行方式（部署新版程式前後皆可；未執行時只有 updated_since 模式無法使用）：
+--   psql -d dbms -f migrate_history_sync.sql
+-- ============================================================
+
+-- 既有資料的 updated_at 為執行遷移的時間：舊的 sync_token 一律會拿到全部就診
+ALTER TABLE ENCOUNTER
+    ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+-- ============================================================
+-- 1. 就診內容變更
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION encounter_touch_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_encounter_touch_updated_at ON ENCOUNTER;
+CREATE TRIGGER trg_encounter_touch_updated_at
+    BEFORE UPDATE OF appt_id, provider_id, encounter_at, status, chief_complaint, subjective, assessment, plan
+    ON ENCOUNTER
+    FOR EACH ROW
+    EXECUTE FUNCTION encounter_touch_updated_at();
+
+-- ============================================================
+-- 2. 相關資料變更：更新所屬就診的 updated_at
+-- ============================================================
+
+CREATE OR REPLACE FUNCTION encounter_touch_from_child() RETURNS trigger AS $$
+DECLARE
+    touched_enct_ids BIGINT[];
+BEGIN
+    IF TG_TABLE_NAME = 'include' THEN
+        -- 用藥明細經由處方對應到就診
+        SELECT array_agg(rx.enct_id) INTO touched_enct_ids
+        FROM PRESCRIPTION rx
+        WHERE rx.rx_id IN (
+            CASE WHEN TG_OP <> 'INSERT' THEN OLD.rx_id END,
+            CASE WHEN TG_OP <> 'DELETE' THEN NEW.rx_id END
+        );
+    ELSE
+        touched_enct_ids := ARRAY[
+            CASE WHEN TG_OP <> 'INSERT' THEN OLD.enct_id END,
+            CASE WHEN TG_OP <> 'DELETE' THEN NEW.enct_id END
+        ];
+    END IF;
+
+    UPDATE ENCOUNTER
+    SET updated_at = NOW()
+    WHERE enct_id = ANY(touched_enct_ids)
+      AND updated_at IS DISTINCT FROM NOW();
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_diagnosis_touch_encounter ON DIAGNOSIS;
+CREATE TRIGGER trg_diagnosis_touch_encounter
+    AFTER INSERT OR UPDATE OR DELETE ON DIAGNOSIS
+    FOR EACH ROW EXECUTE FUNCTION encounter_touch_from_child();
+
+DROP TRIGGER IF EXISTS trg_prescription_touch_encounter ON PRESCRIPTION;
+CREATE TRIGGER trg_prescription_touch_encounter
+    AFTER INSERT OR UPDATE OR DELETE ON PRESCRIPTION
+    FOR EACH ROW EXECUTE FUNCTION encounter_touch_from_child();
+
+DROP TRIGGER IF EXISTS trg_include_touch_encounter ON INCLUDE;
+CREATE TRIGGER trg_include_touch_encounter
+    AFTER INSERT OR UPDATE OR DELETE ON INCLUDE
+    FOR EACH ROW EXECUTE FUNCTION encounter_touch_from_child();
+
+DROP TRIGGER IF EXISTS trg_lab_result_touch_encounter ON LAB_RESULT;
+CREATE TRIGGER trg_lab_result_touch_encounter
+    AFTER INSERT OR UPDATE OR DELETE ON LAB_RESULT
+    FOR EACH ROW EXECUTE FUNCTION encounter_touch_from_child();
+
+DROP TRIGGER IF EXISTS trg_payment_touch_encounter ON PAYMENT;
+CREATE TRIGGER trg_payment_touch_encounter
+    AFTER INSERT OR UPDATE OR DELETE ON PAYMENT
+    FOR EACH ROW EXECUTE FUNCTION encounter_touch_from_child();
+
+-- ============================================================
+-- 檢查：
+-- SELECT enct_id, encounter_at, updated_at FROM ENCOUNTER ORDER BY updated_at DESC LIMIT 10;
+-- ============================================================
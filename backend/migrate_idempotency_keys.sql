@@ -0,0 +1,38 @@
+-- ============================================================
+-- 冪等鍵：IDEMPOTENCY_KEY（病人 + Idempotency-Key 一列）
+-- ============================================================
+-- 建立掛號、取消掛號、修改掛號可帶 Idempotency-Key header；同一位病人以相同的鍵重送時，
+-- 直接回傳第一次的結果（一次主鍵查詢），不再重跑鎖定門診時段的交易。
+-- 見 app/services/shared/idempotency_service.py。
+--
+-- operation / request_fingerprint：第一次請求的操作與參數，同一個鍵用在不同請求時回傳 422
+-- status_code / response         ：第一次的回應；status_code 為 NULL 表示第一次請求仍在處理中
+-- created_at                     ：處理中的租約起點；超過 IDEMPOTENCY_PROCESSING_LEASE_SECONDS 仍未寫回結果，
+--                                  視為第一次請求已中斷，重送可重新佔用
+-- claim_token                    ：每次佔用產生的代號；寫回結果與釋放鍵時比對，
+--                                  租約過期被接手後，原本的請求無法覆蓋或刪除接手者的鍵
+-- expires_at                     ：過期後可重新使用，由背景排程 idempotency_purge 刪除
+--
+-- 執行方式：psql -d dbms -f migrate_idempotency_keys.sql
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS IDEMPOTENCY_KEY (
+    patient_id          BIGINT NOT NULL,
+    idem_key            VARCHAR(128) NOT NULL,
+    operation           VARCHAR(32) NOT NULL,
+    request_fingerprint TEXT NOT NULL,
+    status_code         SMALLINT,
+    response            JSONB,
+    claim_token         UUID,
+    created_at          TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at          TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (patient_id, idem_key)
+);
+
+-- 已建立過此表時補上佔用代號欄位
+ALTER TABLE IDEMPOTENCY_KEY
+    ADD COLUMN IF NOT EXISTS claim_token UUID;
+
+-- 清除過期的鍵
+CREATE INDEX IF NOT EXISTS idx_idempotency_key_expires_at
+ON IDEMPOTENCY_KEY (expires_at);
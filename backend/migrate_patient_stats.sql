@@ -0,0 +1,29 @@
+-- ============================================================
+-- 病人統計 cube：PATIENT_STATS（一位病人一列）
+-- ============================================================
+-- GET /patient/statistics 與 GET /provider/{id}/patients/{pid}/statistics 只讀這張表的一列，
+-- 不再對就診、診斷做 JOIN 與 GROUP BY。
+-- 內容由分析快照計算（app.analytics.patient_analysis.refresh_patient_stats）：
+-- 快照每次增量更新後，重算就診月份有變更的病人；完整重建時重算所有病人。
+--
+-- annual_visits          ：[{year, visit_count}]，年份由新到舊
+-- department_distribution：[{dept_id, department_name, visit_count}]，次數由多到少
+-- diagnosis_frequency    ：[{code_icd, diagnosis_description, diagnosis_count}]，所有診斷，次數由多到少
+-- snapshot_built_at      ：計算時使用的快照時間（完整重建後，早於該時間的列即為已沒有就診的病人）
+--
+-- 執行方式：psql -d dbms -f migrate_patient_stats.sql
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS PATIENT_STATS (
+    patient_id              BIGINT PRIMARY KEY,
+    total_visits            INTEGER NOT NULL DEFAULT 0,
+    annual_visits           JSONB NOT NULL DEFAULT '[]'::jsonb,
+    department_distribution JSONB NOT NULL DEFAULT '[]'::jsonb,
+    diagnosis_frequency     JSONB NOT NULL DEFAULT '[]'::jsonb,
+    snapshot_built_at       TIMESTAMPTZ NOT NULL,
+    updated_at              TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- 完整重建後刪除過期的列（snapshot_built_at < 本次快照時間）
+CREATE INDEX IF NOT EXISTS idx_patient_stats_snapshot_built_at
+ON PATIENT_STATS (snapshot_built_at);
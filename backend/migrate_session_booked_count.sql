@@ -0,0 +1,40 @@
+-- ============================================================
+-- CLINIC_SESSION 已預約人數計數欄位
+-- ============================================================
+-- booked_count：該門診時段中「佔用名額」的掛號數（current_status 不為 4 = 已取消、6 = 候補，
+--               與 AppointmentRepository.NON_OCCUPYING_STATUSES 相同）
+--
+-- 由 AppointmentRepository._insert_status_history（狀態變更）與
+-- AppointmentRepository._move_booked_count（更換門診時段）在同一交易中維護，
+-- 建立掛號時的容量檢查只需讀取此欄位。
+-- 需先完成 migrate_appointment_current_status.sql。
+-- 執行方式：
+--   psql -d dbms -f migrate_session_booked_count.sql
+--   python reconcile_booked_counts.py --check
+-- ============================================================
+
+ALTER TABLE CLINIC_SESSION
+    ADD COLUMN IF NOT EXISTS booked_count INTEGER NOT NULL DEFAULT 0;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'clinic_session_booked_count_nonnegative'
+    ) THEN
+        ALTER TABLE CLINIC_SESSION
+            ADD CONSTRAINT clinic_session_booked_count_nonnegative CHECK (booked_count >= 0);
+    END IF;
+END $$;
+
+-- 回填
+UPDATE CLINIC_SESSION cs
+SET booked_count = COALESCE(actual.actual_count, 0)
+FROM CLINIC_SESSION cs2
+LEFT JOIN (
+    SELECT a.session_id, COUNT(*) AS actual_count
+    FROM APPOINTMENT a
+    WHERE a.current_status NOT IN (4, 6)
+    GROUP BY a.session_id
+) AS actual ON actual.session_id = cs2.session_id
+WHERE cs.session_id = cs2.session_id
+  AND cs.booked_count <> COALESCE(actual.actual_count, 0);
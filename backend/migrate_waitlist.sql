@@ -0,0 +1,28 @@
+-- ============================================================
+-- 候補（APPOINTMENT.current_status = 6）與病人通知事件
+-- ============================================================
+-- 門診時段額滿時，建立掛號改為加入候補（狀態 6，不佔用名額），slot_seq 仍從
+-- CLINIC_SESSION.next_slot_seq 配發，因此同一時段的候補依 slot_seq 即為先來後到（FIFO）。
+-- 取消掛號、更換時段等釋出名額的交易中，由 AppointmentRepository._promote_waitlist
+-- 依序把候補改為已預約（6 → 1），並寫入一筆 PATIENT_NOTIFICATION（event_type = 'waitlist_promoted'）。
+-- 需先完成 migrate_booking_engine.sql。
+-- 執行方式：psql -d dbms -f migrate_waitlist.sql
+-- ============================================================
+
+-- 遞補時依 slot_seq 取出同一時段最前面的候補
+CREATE INDEX IF NOT EXISTS idx_appointment_waitlist
+ON APPOINTMENT (session_id, slot_seq)
+WHERE current_status = 6;
+
+CREATE TABLE IF NOT EXISTS PATIENT_NOTIFICATION (
+    notification_id BIGSERIAL PRIMARY KEY,
+    patient_id      BIGINT NOT NULL,
+    appt_id         INTEGER,
+    event_type      VARCHAR(32) NOT NULL,
+    payload         JSONB NOT NULL DEFAULT '{}'::jsonb,
+    created_at      TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- GET /patient/notifications：依病人取 notification_id 之後的事件
+CREATE INDEX IF NOT EXISTS idx_patient_notification_patient
+ON PATIENT_NOTIFICATION (patient_id, notification_id);
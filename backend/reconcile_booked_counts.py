@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+檢查並修正 CLINIC_SESSION.booked_count 與實際掛號數的偏差
+
+用法：
+    python reconcile_booked_counts.py            # 檢查並修正
+    python reconcile_booked_counts.py --check    # 只檢查，不寫入；有偏差時以非 0 結束
+"""
+import sys
+
+from app.repositories import SessionRepository
+from app.pg_base import close_pg_pool
+
+
+def main():
+    repair = "--check" not in sys.argv[1:]
+    try:
+        drifted = SessionRepository.reconcile_booked_counts(repair=repair)
+    except Exception as e:
+        print(f"錯誤: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    finally:
+        close_pg_pool()
+
+    if not drifted:
+        print("✅ 所有門診時段的 booked_count 皆正確")
+        return 0
+
+    action = "已修正" if repair else "發現"
+    print(f"{'✅' if repair else '❌'} {action} {len(drifted)} 個門診時段的 booked_count 偏差：")
+    for row in drifted:
+        print(f"  session_id={row['session_id']}: booked_count={row['booked_count']} → 實際 {row['actual_count']}")
+    return 0 if repair else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
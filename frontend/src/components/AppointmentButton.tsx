@@ -1,8 +1,8 @@
 // 預約按鈕組件（客戶端組件）
-import React from 'react';
+import React, { useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
-import { patientApi } from '../services/api';
+import { newIdempotencyKey, patientApi } from '../services/api';
 import './AppointmentButton.css';
 
 interface AppointmentButtonProps {
@@ -18,13 +18,21 @@ export const AppointmentButton: React.FC<AppointmentButtonProps> = ({
 }) => {
   const { user } = useAuth();
   const navigate = useNavigate();
+  // 同一次掛號（含連點、重試）共用一個 Idempotency-Key，成功後才換新的鍵（失敗時頁面會重新整理）
+  const idempotencyKey = useRef(newIdempotencyKey());
 
   const handleClick = async () => {
     if (disabled || !user) return;
 
     try {
-      await patientApi.createAppointment(user.user_id, sessionId);
-      alert('掛號成功！');
+      const appt = await patientApi.createAppointment(user.user_id, sessionId, idempotencyKey.current);
+      idempotencyKey.current = newIdempotencyKey();
+      // 額滿時後端會加入候補（status 6），有人取消時依序自動遞補
+      alert(
+        appt.status === 6
+          ? `門診已額滿，已為您加入候補（第 ${appt.waitlist_position} 位），有名額釋出時會自動遞補`
+          : '掛號成功！'
+      );
       if (onSuccess) {
         onSuccess();
       } else {
@@ -5,10 +5,10 @@ import { Layout } from '../../components/Layout';
 import { DoctorSessionList } from '../../components/DoctorSessionList';
 import type { SessionForUI } from '../../components/DoctorSessionList';
 import { formatDateWithWeekday } from '../../lib/dateFormat';
-import { patientApi } from '../../services/api';
+import { patientApi, eventsApi } from '../../services/api';
 import { useAuth } from '../../context/AuthContext';
 import { departmentClickLogger } from '../../lib/departmentClickLogger';
-import type { ClinicSession } from '../../types';
+import type { ClinicSession, SessionEvent } from '../../types';
 import './DepartmentDetail.css';
 
 export const DepartmentDetail: React.FC = () => {
@@ -27,6 +27,72 @@ export const DepartmentDetail: React.FC = () => {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
 
+  // 載入該部門的會話（不顯示載入中，供即時事件觸發重新載入）
+  const loadSessions = useCallback(async (deptId: number) => {
+    const sessionsData = await patientApi.listSessions({
+      dept_id: deptId,
+    });
+
+    // 確保 sessionsData 是陣列
+    if (!sessionsData || !Array.isArray(sessionsData)) {
+      console.warn('API 返回的 sessionsData 不是陣列:', sessionsData);
+      setSessions([]);
+      return;
+    }
+
+    // 轉換為 UI 格式
+    const formattedSessions: SessionForUI[] = sessionsData.map(
+      (session: ClinicSession) => {
+        const date = new Date(session.date + 'T00:00:00');
+        const weekdayLabels = [
+          '星期日',
+          '星期一',
+          '星期二',
+          '星期三',
+          '星期四',
+          '星期五',
+          '星期六',
+        ];
+        const weekdayLabel = weekdayLabels[date.getDay()];
+
+        const formatTime = (timeStr: string | undefined) => {
+          if (!timeStr) return '';
+          const time = timeStr.split(':');
+          return `${time[0]}:${time[1]}`;
+        };
+
+        return {
+          sessionId: session.session_id,
+          doctorName: session.provider_name || '醫師',
+          date: session.date,
+          weekdayLabel,
+          startTime: formatTime(session.start_time),
+          endTime: formatTime(session.end_time),
+          period: session.period,
+          capacity: session.capacity,
+          remaining: Math.max(0, session.capacity - (session.booked_count || 0)),
+        };
+      }
+    );
+
+    // 過濾未來日期並排序
+    const today = new Date();
+    today.setHours(0, 0, 0, 0);
+    const futureSessions = formattedSessions
+      .filter((s) => {
+        const sessionDate = new Date(s.date + 'T00:00:00');
+        return sessionDate >= today;
+      })
+      .sort((a, b) => {
+        if (a.date !== b.date) {
+          return a.date.localeCompare(b.date);
+        }
+        return a.startTime.localeCompare(b.startTime);
+      });
+
+    setSessions(futureSessions);
+  }, []);
+
   const loadDepartmentData = useCallback(async () => {
     try {
       setLoading(true);
@@ -64,75 +130,14 @@ export const DepartmentDetail: React.FC = () => {
       }
 
       // 獲取該部門的會話
-      const sessionsData = await patientApi.listSessions({
-        dept_id: deptData.dept_id,
-      });
-
-      // 確保 sessionsData 是陣列
-      if (!sessionsData || !Array.isArray(sessionsData)) {
-        console.warn('API 返回的 sessionsData 不是陣列:', sessionsData);
-        setSessions([]);
-        return;
-      }
-
-      // 轉換為 UI 格式
-      const formattedSessions: SessionForUI[] = sessionsData.map(
-        (session: ClinicSession) => {
-          const date = new Date(session.date + 'T00:00:00');
-          const weekdayLabels = [
-            '星期日',
-            '星期一',
-            '星期二',
-            '星期三',
-            '星期四',
-            '星期五',
-            '星期六',
-          ];
-          const weekdayLabel = weekdayLabels[date.getDay()];
-
-          const formatTime = (timeStr: string | undefined) => {
-            if (!timeStr) return '';
-            const time = timeStr.split(':');
-            return `${time[0]}:${time[1]}`;
-          };
-
-          return {
-            sessionId: session.session_id,
-            doctorName: session.provider_name || '醫師',
-            date: session.date,
-            weekdayLabel,
-            startTime: formatTime(session.start_time),
-            endTime: formatTime(session.end_time),
-            period: session.period,
-            capacity: session.capacity,
-            remaining: Math.max(0, session.capacity - (session.booked_count || 0)),
-          };
-        }
-      );
-
-      // 過濾未來日期並排序
-      const today = new Date();
-      today.setHours(0, 0, 0, 0);
-      const futureSessions = formattedSessions
-        .filter((s) => {
-          const sessionDate = new Date(s.date + 'T00:00:00');
-          return sessionDate >= today;
-        })
-        .sort((a, b) => {
-          if (a.date !== b.date) {
-            return a.date.localeCompare(b.date);
-          }
-          return a.startTime.localeCompare(b.startTime);
-        });
-
-      setSessions(futureSessions);
+      await loadSessions(deptData.dept_id);
     } catch (err: any) {
       console.error('載入部門資料失敗:', err);
       setError('載入部門資料失敗，請稍後再試');
     } finally {
       setLoading(false);
     }
-  }, [slug, user, userType]);
+  }, [slug, user, userType, loadSessions]);
 
   useEffect(() => {
     if (!slug) {
@@ -145,6 +150,40 @@ export const DepartmentDetail: React.FC = () => {
     loadDepartmentData();
   }, [slug, loadDepartmentData]);
 
+  // 訂閱科別即時事件：只更新變動的門診剩餘名額，不需要輪詢
+  const deptId = department?.dept_id;
+  useEffect(() => {
+    if (deptId === undefined) return;
+    const reload = () =>
+      loadSessions(deptId).catch((err) => console.error('重新載入門診失敗:', err));
+    const applyEvent = (event: SessionEvent) => {
+      setSessions((prev) => {
+        if (!prev.some((s) => s.sessionId === event.session_id)) {
+          // 新增的門診：重新載入列表
+          if (event.status === 1) reload();
+          return prev;
+        }
+        if (event.status !== 1) {
+          // 停診：從列表移除
+          return prev.filter((s) => s.sessionId !== event.session_id);
+        }
+        return prev.map((s) =>
+          s.sessionId === event.session_id
+            ? {
+                ...s,
+                capacity: event.capacity,
+                remaining: Math.max(0, event.capacity - event.booked_count),
+              }
+            : s
+        );
+      });
+    };
+    return eventsApi.subscribeDepartment(deptId, {
+      onSession: applyEvent,
+      onResync: reload,
+    });
+  }, [deptId, loadSessions]);
+
   // 按日期分組
   const groupedByDate: Record<string, SessionForUI[]> = {};
   sessions.forEach((session) => {
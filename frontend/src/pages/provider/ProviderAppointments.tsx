@@ -1,7 +1,7 @@
 // 醫師預約管理頁面
 import React, { useState, useEffect } from 'react';
 import { useNavigate, useParams } from 'react-router-dom';
-import { providerApi } from '../../services/api';
+import { providerApi, eventsApi } from '../../services/api';
 import { useAuth } from '../../context/AuthContext';
 import { Layout } from '../../components/Layout';
 import type { Appointment } from '../../types';
@@ -22,6 +22,15 @@ export const ProviderAppointments: React.FC = () => {
     loadAppointments();
   }, [user, userType, sessionId]);
 
+  // 訂閱門診時段即時事件：有掛號、取消、報到或看診狀態變更時才重新載入，不需要輪詢
+  useEffect(() => {
+    if (userType !== 'provider' || !user || !sessionId) return;
+    return eventsApi.subscribeSession(parseInt(sessionId), {
+      onSession: () => loadAppointments(),
+      onResync: () => loadAppointments(),
+    });
+  }, [user, userType, sessionId]);
+
   const loadAppointments = async () => {
     if (!user || !sessionId) return;
     try {
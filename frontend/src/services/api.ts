@@ -1,5 +1,6 @@
 // API 服務層
 import axios from 'axios';
+import type { SessionEvent } from '../types';
 
 const API_BASE_URL = 'http://localhost:8000';
 
@@ -10,6 +11,9 @@ const api = axios.create({
   },
 });
 
+// 建立／取消／修改掛號帶上 Idempotency-Key：同一次操作重送（重試、連點）時後端會回傳第一次的結果
+export const newIdempotencyKey = () => crypto.randomUUID();
+
 // ==================== 病人端 API ====================
 
 export const patientApi = {
@@ -57,19 +61,31 @@ export const patientApi = {
   },
 
   // 建立掛號
-  createAppointment: async (patientId: number, sessionId: number) => {
+  createAppointment: async (
+    patientId: number,
+    sessionId: number,
+    idempotencyKey: string = newIdempotencyKey()
+  ) => {
     const response = await api.post(
       '/patient/appointments',
       { session_id: sessionId },
-      { params: { patient_id: patientId } }
+      {
+        params: { patient_id: patientId },
+        headers: { 'Idempotency-Key': idempotencyKey },
+      }
     );
     return response.data;
   },
 
   // 取消掛號
-  cancelAppointment: async (apptId: number, patientId: number) => {
+  cancelAppointment: async (
+    apptId: number,
+    patientId: number,
+    idempotencyKey: string = newIdempotencyKey()
+  ) => {
     const response = await api.delete(`/patient/appointments/${apptId}`, {
       params: { patient_id: patientId },
+      headers: { 'Idempotency-Key': idempotencyKey },
     });
     return response.data;
   },
@@ -78,16 +94,28 @@ export const patientApi = {
   rescheduleAppointment: async (
     apptId: number,
     patientId: number,
-    newSessionId: number
+    newSessionId: number,
+    idempotencyKey: string = newIdempotencyKey()
   ) => {
     const response = await api.patch(
       `/patient/appointments/${apptId}/reschedule`,
       { new_session_id: newSessionId },
-      { params: { patient_id: patientId } }
+      {
+        params: { patient_id: patientId },
+        headers: { 'Idempotency-Key': idempotencyKey },
+      }
     );
     return response.data;
   },
 
+  // 通知事件（例如候補遞補），afterId 帶入上一次回傳的 next_after_id
+  listNotifications: async (patientId: number, afterId: number = 0) => {
+    const response = await api.get('/patient/notifications', {
+      params: { patient_id: patientId, after_id: afterId },
+    });
+    return response.data;
+  },
+
   // 病人報到
   checkin: async (apptId: number, patientId: number) => {
     const response = await api.post(
@@ -481,5 +509,35 @@ export const providerApi = {
   },
 };
 
+// ==================== 即時事件（SSE） ====================
+
+interface SessionEventHandlers {
+  // 收到門診時段變更
+  onSession: (event: SessionEvent) => void;
+  // 連上（含斷線重連）或伺服器要求重新載入時呼叫，期間可能漏掉事件
+  onResync: () => void;
+}
+
+const subscribeEvents = (path: string, handlers: SessionEventHandlers) => {
+  const source = new EventSource(`${API_BASE_URL}/events${path}`);
+  source.addEventListener('ready', () => handlers.onResync());
+  source.addEventListener('resync', () => handlers.onResync());
+  source.addEventListener('session', (e) =>
+    handlers.onSession(JSON.parse((e as MessageEvent).data) as SessionEvent)
+  );
+  // 回傳取消訂閱的函式（useEffect cleanup 使用）
+  return () => source.close();
+};
+
+export const eventsApi = {
+  // 訂閱單一門診時段的變更（掛號、取消、報到、看診狀態）
+  subscribeSession: (sessionId: number, handlers: SessionEventHandlers) =>
+    subscribeEvents(`/sessions/${sessionId}`, handlers),
+
+  // 訂閱科別內所有門診時段的變更（剩餘名額、新增或停診）
+  subscribeDepartment: (deptId: number, handlers: SessionEventHandlers) =>
+    subscribeEvents(`/departments/${deptId}`, handlers),
+};
+
 export default api;
 
@@ -37,6 +37,19 @@ export interface ClinicSession {
   status: number;
 }
 
+// 門診時段即時事件（/events 的 SSE，event: session）
+export interface SessionEvent {
+  type: 'session';
+  session_id: number;
+  provider_id: number;
+  dept_id: number;
+  date: string;
+  period: number;
+  capacity: number;
+  booked_count: number;
+  status: number;
+}
+
 export interface Appointment {
   appt_id: number;
   patient_id: number;